@@ -0,0 +1,269 @@
+// Viterbi alignments for OpInvAlign.InvAlignOp and OpNumpyAlign.NumpyAlignOp.
+// These are exact ports of the Python implementations (InvAlignOp._viterbi,
+// NumpyAlignOp._fullAlignmentSequence and NumpyAlignOp._fullAlignmentSequenceInv),
+// including the float32/float64 arithmetic and the tie-breaking of np.argmin,
+// so that both give the same alignments.
+// Every function aligns one sequence of the batch, thus the caller can run them in parallel.
+// Layouts are the same as the Theano inputs:
+//   scores: (time,batch,classes), transcription: (time,batch), outputs: (time,batch).
+
+#include <vector>
+#include <algorithm>
+
+// The Python code uses this as infinity.
+#define ALIGN_VITERBI_INF 1e30
+
+// Return codes.
+#define ALIGN_VITERBI_OK 0
+#define ALIGN_VITERBI_ERR_LENGTH 1  // sequence or transcription too short
+#define ALIGN_VITERBI_ERR_LABEL 2  // label index out of range
+#define ALIGN_VITERBI_ERR_INVALID 3  // backtracking left the lattice
+
+struct AlignViterbiSeq {
+  const float* scores;  // scores + b * n_classes
+  long scores_stride;  // n_batch * n_classes
+  int n_classes;
+  const int* transcription;  // transcription + b
+  long trans_stride;  // n_batch
+  int length_x;  // number of frames
+  int length_y;  // number of labels
+};
+
+static inline int align_viterbi_check_labels(const AlignViterbiSeq& seq) {
+  for(int i = 0; i < seq.length_y; ++i) {
+    int c = seq.transcription[i * seq.trans_stride];
+    if(c < 0 || c >= seq.n_classes)
+      return ALIGN_VITERBI_ERR_LABEL;
+  }
+  return ALIGN_VITERBI_OK;
+}
+
+// Score of frame t for the label of HMM state s.
+static inline float align_viterbi_score(const AlignViterbiSeq& seq, int t, int s, int nstates) {
+  return seq.scores[t * seq.scores_stride + seq.transcription[(s / nstates) * seq.trans_stride]];
+}
+
+// See InvAlignOp._viterbi().
+// attention and labelling have stride out_stride and get length_y * nstates entries.
+static int inv_align_viterbi(
+    const AlignViterbiSeq& seq, const double* all_tdps, int n_tdps, int nstates,
+    int* attention, int* labelling, long out_stride) {
+  const int lengthT = seq.length_x;
+  const int lengthS = seq.length_y * nstates;
+  const int skip = std::min(n_tdps, lengthT - nstates);
+  if(skip < 1 || lengthS < 1)
+    return ALIGN_VITERBI_ERR_LENGTH;
+  if(align_viterbi_check_labels(seq) != ALIGN_VITERBI_OK)
+    return ALIGN_VITERBI_ERR_LABEL;
+  const double* tdps = all_tdps;  // tdps[:skip]
+  const int width = lengthT + skip - 1;
+  std::vector<double> fwdScore((size_t) lengthS * width, ALIGN_VITERBI_INF);
+  std::vector<int> bt((size_t) lengthS * width, -1);
+  // The score lattice in the Python code has `skip - 1` margin columns with inf at the beginning.
+#define SCORE(s, col) ((col) < skip - 1 ? ALIGN_VITERBI_INF : (double) align_viterbi_score(seq, (col) - skip + 1, s, nstates))
+
+  // forward, first row
+  for(int i = 1; i < skip; ++i) {
+    int col = skip - 2 + i;
+    fwdScore[col] = SCORE(0, col) + tdps[i];
+    bt[col] = i;
+  }
+  // remaining rows
+  for(int s = 1; s < lengthS; ++s) {
+    const double* previous = &fwdScore[(size_t) (s - 1) * width];
+    int t_start = std::max(lengthT - (lengthS - s) * skip, 0);
+    int t_end = lengthT - (lengthS - s - 1);
+    for(int t = t_start; t < t_end; ++t) {
+      double score = SCORE(s, t + skip - 1);
+      int best = 0;
+      double best_score = 0;
+      for(int i = 0; i < skip; ++i) {
+        double cur = score + (previous[t + i] + tdps[skip - 1 - i]);
+        if(i == 0 || cur < best_score) {
+          best = i;
+          best_score = cur;
+        }
+      }
+      fwdScore[(size_t) s * width + t + skip - 1] = best_score;
+      bt[(size_t) s * width + t + skip - 1] = skip - 1 - best;
+    }
+  }
+#undef SCORE
+
+  // backtrack
+  int t = lengthT - 1;
+  attention[(lengthS - 1) * out_stride] = lengthT - 1;
+  labelling[(lengthS - 1) * out_stride] = seq.transcription[(seq.length_y - 1) * seq.trans_stride];
+  for(int s = lengthS - 2; s >= 0; --s) {
+    int col = t + skip - 1;
+    if(col < 0)
+      col += width;  // Python index semantics
+    if(col < 0 || col >= width)
+      return ALIGN_VITERBI_ERR_INVALID;
+    int t_new = t - bt[(size_t) (s + 1) * width + col];
+    attention[s * out_stride] = t_new;
+    labelling[s * out_stride] = seq.transcription[(s / nstates) * seq.trans_stride];
+    t = t_new;
+  }
+  return ALIGN_VITERBI_OK;
+}
+
+// See NumpyAlignOp._fullAlignmentSequence(), without silence and with one repetition.
+// alignment has stride out_stride and gets length_x entries.
+static int numpy_align_viterbi(
+    const AlignViterbiSeq& seq, const double* tdp, const double* stdp, int nstates,
+    int* alignment, long out_stride) {
+  const int lengthT = seq.length_x;
+  const int lengthS = seq.length_y * nstates;
+  if(lengthT < 1 || lengthS < 1)
+    return ALIGN_VITERBI_ERR_LENGTH;
+  if(align_viterbi_check_labels(seq) != ALIGN_VITERBI_OK)
+    return ALIGN_VITERBI_ERR_LABEL;
+  // The Python code starts with float32 score arrays, which are replaced by float64 arrays
+  // after the first frame. We keep doubles and round where the Python code stores into float32.
+  std::vector<double> leftScore(lengthS, (double) (float) ALIGN_VITERBI_INF);
+  std::vector<double> rightScore(lengthS, ALIGN_VITERBI_INF);
+  std::vector<int> bt((size_t) lengthT * lengthS, 0);
+  leftScore[0] = align_viterbi_score(seq, 0, 0, nstates);
+
+  for(int t = 1; t < lengthT; ++t) {
+    const bool float32 = t == 1;
+    int* bt_t = &bt[(size_t) t * lengthS];
+    for(int s = 0; s < lengthS; ++s) {
+      double score;
+      int choice;
+      if(s == 0) {
+        score = leftScore[s] + stdp[0];
+        choice = 0;
+      }
+      else if(s == 1) {
+        if(leftScore[s] + tdp[0] < leftScore[s - 1] + stdp[1]) {
+          score = leftScore[s] + tdp[0];
+          choice = 0;
+        }
+        else {
+          score = leftScore[s - 1] + stdp[1];
+          choice = 1;
+        }
+      }
+      else {
+        // s == 2 uses the skip-from-silence transition, the last state the silence loop.
+        double loop = s == 2 ? tdp[0] : (s == lengthS - 1 ? stdp[0] : tdp[0]);
+        double skip = s == 2 ? stdp[2] : tdp[2];
+        double score0 = leftScore[s] + loop;
+        double score1 = leftScore[s - 1] + tdp[1];
+        double score2 = leftScore[s - 2] + skip;
+        if(score0 < score1 && score0 < score2) {
+          score = score0;
+          choice = 0;
+        }
+        else if(score1 < score2) {
+          score = score1;
+          choice = 1;
+        }
+        else {
+          score = score2;
+          choice = 2;
+        }
+      }
+      bt_t[s] = choice;
+      float emission = align_viterbi_score(seq, t, s, nstates);
+      if(float32)
+        rightScore[s] = (float) ((float) score + emission);
+      else
+        rightScore[s] = score + (double) emission;
+    }
+    leftScore.swap(rightScore);
+  }
+
+  // backtrack
+  int s = lengthS - 1;
+  for(int t = lengthT - 1; t >= 0; --t) {
+    alignment[t * out_stride] = seq.transcription[(s / nstates) * seq.trans_stride] + 1;
+    s -= bt[(size_t) t * lengthS + s];
+    if(s < 0)
+      return ALIGN_VITERBI_ERR_INVALID;
+  }
+  return ALIGN_VITERBI_OK;
+}
+
+// See NumpyAlignOp._fullAlignmentSequenceInv(), without silence and with one repetition.
+// alignment has stride out_stride and gets length_x entries.
+static int numpy_align_viterbi_inv(
+    const AlignViterbiSeq& seq, const double* tdp, int skip, int nstates,
+    int* alignment, long out_stride) {
+  const int lengthT = seq.length_x;
+  const int lengthS = seq.length_y * nstates;
+  if(lengthT < 1 || lengthS < 1)
+    return ALIGN_VITERBI_ERR_LENGTH;
+  if(align_viterbi_check_labels(seq) != ALIGN_VITERBI_OK)
+    return ALIGN_VITERBI_ERR_LABEL;
+  const int width = lengthT + skip - 1;
+  std::vector<double> leftScore(width, ALIGN_VITERBI_INF);
+  std::vector<double> rightScore(width, ALIGN_VITERBI_INF);
+  std::vector<int> bt((size_t) lengthS * lengthT, 0);
+#define SCORE(s, col) ((col) < skip - 1 ? ALIGN_VITERBI_INF : (double) align_viterbi_score(seq, (col) - skip + 1, s, nstates))
+  leftScore[skip - 1] = SCORE(0, skip - 1);
+
+  for(int s = 1; s < lengthS; ++s) {
+    for(int t = 0; t < lengthT; ++t) {
+      // Transition i covers the frames t-i+1..t, cum_score is the sum of their scores.
+      double cum_score = 0;
+      int best = 0;
+      double best_score = 0;
+      for(int i = 0; i < skip; ++i) {
+        if(i > 0)
+          cum_score += SCORE(s, t + skip - i);
+        double cur = (cum_score + tdp[i]) + leftScore[t + skip - 1 - i];
+        if(i == 0 || cur < best_score) {
+          best = i;
+          best_score = cur;
+        }
+      }
+      rightScore[t + skip - 1] = best_score;
+      bt[(size_t) s * lengthT + t] = best;
+    }
+    leftScore.swap(rightScore);
+    std::fill(rightScore.begin(), rightScore.end(), ALIGN_VITERBI_INF);
+  }
+#undef SCORE
+
+  // backtrack
+  int t = lengthT - 1;
+  for(int s = lengthS - 1; s >= 0; --s) {
+    int label = seq.transcription[(s / nstates) * seq.trans_stride] + 1;
+    int n = bt[(size_t) s * lengthT + t];
+    for(int span = 0; span < n; ++span) {
+      int t_ = t - span;
+      if(t_ < 0)
+        t_ += lengthT;  // Python index semantics
+      if(t_ < 0)
+        return ALIGN_VITERBI_ERR_INVALID;
+      alignment[t_ * out_stride] = label;
+    }
+    t -= n;
+    if(t < 0)
+      return ALIGN_VITERBI_ERR_INVALID;
+  }
+  // remaining frames
+  for(int span = 0; span <= t; ++span)
+    alignment[span * out_stride] = seq.transcription[0] + 1;
+  return ALIGN_VITERBI_OK;
+}
+
+static const char* align_viterbi_error_str(int err) {
+  switch(err) {
+    case ALIGN_VITERBI_ERR_LENGTH: return "sequence or transcription too short";
+    case ALIGN_VITERBI_ERR_LABEL: return "label index out of range";
+    case ALIGN_VITERBI_ERR_INVALID: return "invalid alignment";
+  }
+  return "unknown error";
+}
+
+// Sum over the time axis of an index matrix (time,batch).
+static inline int align_viterbi_index_len(PyArrayObject* index, int b) {
+  int n = 0;
+  for(npy_intp t = 0; t < PyArray_DIM(index, 0); ++t)
+    n += *(npy_int8*) PyArray_GETPTR2(index, t, b);
+  return n;
+}
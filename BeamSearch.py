@@ -0,0 +1,82 @@
+
+"""
+Batched beam search for the label feedback of RecurrentUnitLayer (see its beam_search option).
+The hypotheses of all sequences are kept in fixed-size arrays with batch * beam_size rows,
+where the rows b * beam_size ... (b + 1) * beam_size - 1 belong to sequence b.
+Thus one decoding step is a few dense operations which can live inside the theano.scan of the layer.
+"""
+
+import numpy
+import theano
+import theano.tensor as T
+
+
+def beam_search_initial_scores(n_rows, beam_size):
+  """
+  :param theano.Variable n_rows: batch * beam_size
+  :param int beam_size:
+  :rtype: theano.Variable
+  :returns (batch*beam,) float32 scores. All beams of a sequence start with the same state,
+  thus only the first one is active, otherwise the first step would select the same label beam_size times.
+  """
+  first = T.eq(T.arange(n_rows) % beam_size, 0)
+  return T.switch(first, numpy.float32(0), numpy.float32(-1e30))
+
+
+def beam_search_step(log_probs, scores, index, beam_size):
+  """
+  One expansion step.
+  :param theano.Variable log_probs: (batch*beam,classes) label log-probabilities of every hypothesis
+  :param theano.Variable scores: (batch*beam,) accumulated log-probabilities of every hypothesis
+  :param theano.Variable index: (batch*beam,) 0 where the sequence is already finished
+  :param int beam_size:
+  :returns scores, labels, parents, all (batch*beam,).
+    Row r of the new beam extends the hypothesis in row parents[r] by labels[r].
+    Rows of finished sequences keep their scores and their hypothesis (parents[r] == r).
+  :rtype: (theano.Variable, theano.Variable, theano.Variable)
+  """
+  n_rows = log_probs.shape[0]
+  n_classes = log_probs.shape[1]
+  n_batch = n_rows // beam_size
+  candidates = (scores.dimshuffle(0, 'x') + log_probs).reshape((n_batch, beam_size * n_classes))
+  # mergesort is stable, thus ties are resolved by the lowest beam and label.
+  best = T.cast(T.argsort(-candidates, axis=1, kind='mergesort')[:, :beam_size], 'int32')  # (batch,beam)
+  new_scores = candidates[T.arange(n_batch).dimshuffle(0, 'x'), best].flatten()
+  best = best.flatten()
+  rows = T.arange(n_rows, dtype='int32')
+  parents = T.cast((rows // beam_size) * beam_size + best // n_classes, 'int32')
+  labels = T.cast(best % n_classes, 'int32')
+  active = T.gt(index, 0)
+  return (T.switch(active, new_scores, scores),
+          T.switch(active, labels, numpy.int32(0)),
+          T.switch(active, parents, rows))
+
+
+def beam_search_backtrack(scores, parents, beam_size):
+  """
+  :param theano.Variable scores: (time,batch*beam) scores after every step, see beam_search_step()
+  :param theano.Variable parents: (time,batch*beam) parents of every step, see beam_search_step()
+  :param int beam_size:
+  :rtype: theano.Variable
+  :returns (time,batch) int32. the row of the best final hypothesis of every sequence for every step
+  """
+  n_batch = scores.shape[1] // beam_size
+  best = T.argmax(scores[-1].reshape((n_batch, beam_size)), axis=1)
+  best = T.cast(best + T.arange(n_batch) * beam_size, 'int32')
+  rows, _ = theano.scan(lambda parents_t, rows_t: parents_t[rows_t],
+                        sequences=[parents[::-1]], outputs_info=[best])
+  # rows[k] is the row for step time - 2 - k, the last one is before the first step
+  return T.concatenate([best.dimshuffle('x', 0), rows[:-1]], axis=0)[::-1]
+
+
+def beam_search_gather(x, rows):
+  """
+  :param theano.Variable x: (time,batch*beam,...)
+  :param theano.Variable rows: (time,batch), e.g. from beam_search_backtrack()
+  :rtype: theano.Variable
+  :returns (time,batch,...), x[t, rows[t, b]]
+  """
+  flat_rows = (T.arange(x.shape[0]).dimshuffle(0, 'x') * x.shape[1] + rows).flatten()
+  x_flat = x.reshape([x.shape[0] * x.shape[1]] + [x.shape[i] for i in range(2, x.ndim)], ndim=x.ndim - 1)
+  return x_flat[flat_rows].reshape([rows.shape[0], rows.shape[1]] + [x.shape[i] for i in range(2, x.ndim)],
+                                   ndim=x.ndim)
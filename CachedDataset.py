@@ -26,6 +26,7 @@ class CachedDataset(Dataset):
     self._seq_index = []; """ :type: list[int] """  # Via init_seq_order().
     self._index_map = range(len(self._seq_index))
     self._seq_lengths = []; """ :type: list[(int,int)] """  # uses real seq idx
+    self._seq_lengths_data = None; """ :type: numpy.ndarray | None """  # cached "data" lengths, see init_seq_order()
     self.tags = []; """ :type: list[str] """  # uses real seq idx
     self.tag_idx = {}; ":type: dict[str,int] "  # map of tag -> real-seq-idx
     self.targets = {}
@@ -58,7 +59,9 @@ class CachedDataset(Dataset):
     if seq_list:
       seq_index = [self.tag_idx[tag] for tag in seq_list]
     else:
-      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, lambda s: self._seq_lengths[s][0])
+      if self._seq_lengths_data is None or len(self._seq_lengths_data) != len(self._seq_lengths):
+        self._seq_lengths_data = numpy.array([l[0] for l in self._seq_lengths], dtype="int64")
+      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, self._seq_lengths_data[:self.num_seqs])
 
     if self._seq_index == seq_index:
       return False
@@ -1,6 +1,7 @@
 
 
 from Dataset import Dataset, DatasetSeq
+from collections import deque
 import math
 
 
@@ -28,25 +29,28 @@ class CachedDataset2(Dataset):
       epoch = 1
     self.expected_load_seq_start = 0
     self.reached_final_seq = False
-    self.added_data = []; " :type: list[DatasetSeq] "
+    self.added_data = deque(); " :type: deque[DatasetSeq] "  # ordered by seq_idx
+    self._added_data_by_seq_idx = {}; " :type: dict[int,DatasetSeq] "  # for fast lookup in _get_seq()
     self._num_timesteps_accumulated = 0
     self._num_seqs = None
     self.epoch = epoch
     return True
 
+  def _add_seqs(self, seqs):
+    """
+    :param list[DatasetSeq] seqs: with increasing seq_idx, after the ones in self.added_data
+    """
+    for seq in seqs:
+      self.added_data.append(seq)
+      self._added_data_by_seq_idx[seq.seq_idx] = seq
+
   def _cleanup_old_seqs(self, seq_idx_end):
-    i = 0
-    while i < len(self.added_data):
-      if self.added_data[i].seq_idx >= seq_idx_end:
-        break
-      i += 1
-    del self.added_data[:i]
+    while self.added_data and self.added_data[0].seq_idx < seq_idx_end:
+      seq = self.added_data.popleft()
+      del self._added_data_by_seq_idx[seq.seq_idx]
 
   def _get_seq(self, seq_idx):
-    for data in self.added_data:
-      if data.seq_idx == seq_idx:
-        return data
-    return None
+    return self._added_data_by_seq_idx.get(seq_idx)
 
   def is_cached(self, start, end):
     # Always False, to force that we call self._load_seqs().
@@ -78,7 +82,7 @@ class CachedDataset2(Dataset):
     seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
     seqs = filter(None, seqs)  # We might not know the num seqs in advance.
     self._num_timesteps_accumulated += sum([seq.num_frames for seq in seqs])
-    self.added_data += seqs
+    self._add_seqs(seqs)
 
   def is_less_than_num_seqs(self, n):
     if n < self.expected_load_seq_start:
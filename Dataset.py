@@ -194,7 +194,8 @@ class Dataset(object):
      such as 'default' (= as-is), 'sorted' or 'random'. 'sorted' also uses the sequence length.
     :param int epoch: for 'random', this determines the random seed
     :type num_seqs: int
-    :param get_seq_len: function (originalSeqIdx: int) -> int
+    :param get_seq_len: function (originalSeqIdx: int) -> int, or array of the seq lengths (originalSeqIdx -> len)
+    :type get_seq_len: ((int) -> int) | numpy.ndarray | None
     :rtype: list[int]
     """
     assert num_seqs > 0
@@ -202,25 +203,28 @@ class Dataset(object):
     if self.seq_ordering == 'default':
       pass  # Keep order as-is.
     elif self.seq_ordering == 'sorted':
-      assert get_seq_len
-      seq_index.sort(key=get_seq_len)  # sort by length
+      seq_lens = self._get_seq_lens_array(num_seqs, get_seq_len)
+      # A stable sort, i.e. the same order as list.sort().
+      seq_index = numpy.argsort(seq_lens, kind='mergesort').tolist()  # sort by length
     elif self.seq_ordering.startswith('laplace'):
-      assert get_seq_len
+      seq_lens = self._get_seq_lens_array(num_seqs, get_seq_len)
       tmp = self.seq_ordering.split(':')
       bins = int(tmp[1]) if len(tmp) > 1 else 2
       nth = int(tmp[2]) if len(tmp) > 2 else 1
       rnd_seed = ((epoch - 1) / nth + 1) if epoch else 1
       rnd = Random(rnd_seed)
       rnd.shuffle(seq_index)
+      seq_index = numpy.array(seq_index, dtype="int64")
       out_index = []
       for i in xrange(bins):
         if i == bins - 1:
           part = seq_index[i * len(seq_index) / bins:]
         else:
           part = seq_index[i * len(seq_index) / bins:(i + 1) * len(seq_index) / bins]
-        part.sort(key=get_seq_len,reverse=(i%2==1))
-        out_index += part
-      seq_index = out_index
+        part_lens = seq_lens[part]
+        # Stable sorts. Descending like list.sort(reverse=True), i.e. equal lengths keep their order.
+        out_index.append(part[numpy.argsort(-part_lens if i % 2 == 1 else part_lens, kind='mergesort')])
+      seq_index = numpy.concatenate(out_index).tolist()
     elif self.seq_ordering.startswith('random'):
       tmp = self.seq_ordering.split(':')
       nth = int(tmp[1]) if len(tmp) > 1 else 1
@@ -232,6 +236,20 @@ class Dataset(object):
       assert False, "invalid batching specified: " + self.seq_ordering
     return seq_index
 
+  @staticmethod
+  def _get_seq_lens_array(num_seqs, get_seq_len):
+    """
+    :param int num_seqs:
+    :param get_seq_len: see get_seq_order_for_epoch()
+    :return: seq lengths, originalSeqIdx -> len
+    :rtype: numpy.ndarray
+    """
+    assert get_seq_len is not None
+    if isinstance(get_seq_len, numpy.ndarray):
+      assert get_seq_len.shape == (num_seqs,)
+      return get_seq_len
+    return numpy.fromiter((get_seq_len(i) for i in xrange(num_seqs)), dtype="int64", count=num_seqs)
+
   def init_seq_order(self, epoch=None, seq_list=None):
     """
     :type epoch: int|None
@@ -270,7 +270,13 @@ class Device(object):
     else:
       theano_flags["device"] = self.name
     theano_flags["force_device"] = True
-    env_update = {"THEANO_FLAGS": ",".join(["%s=%s" % (key, value) for (key, value) in sorted(theano_flags.items())])}
+    env_update = {}
+    # Multi-threaded CPU NativeOp kernels via OpenMP. See NativeOp.cpp.
+    native_op_num_threads = self.config.int("native_op_num_threads", 0) if self.config else 0
+    if native_op_num_threads > 0 and theano_flags["device"] == "cpu":
+      theano_flags["openmp"] = True
+      env_update["OMP_NUM_THREADS"] = str(native_op_num_threads)
+    env_update["THEANO_FLAGS"] = ",".join(["%s=%s" % (key, value) for (key, value) in sorted(theano_flags.items())])
     self.proc = AsyncTask(
       func=self.process,
       name="Device %s proc" % self.name,
@@ -325,6 +331,7 @@ class Device(object):
     import theano.tensor as T
     import h5py
     self.T = T
+    init_start_time = time.time()
     self.seq_train_parallel_control = None  # type: SeqTrainParallelControlDevHost. will be set via SprintErrorSignals
     self.network_task = config.value('task', 'train')
     eval_flag = self.network_task in ['eval', 'forward', 'daemon']
@@ -350,6 +357,11 @@ class Device(object):
     if self.testnet_share_params:
       testnet_all_params = self.testnet.get_all_params_vars()
       assert len(testnet_all_params) == 0
+    if config.bool("flat_params", False):
+      # All params as views into one buffer, thus the param syncs with the host are single bulk copies.
+      self.trainnet.init_flat_params()
+      if not self.testnet_share_params:
+        self.testnet.init_flat_params()
     if config.has('load'):
       model = h5py.File(config.value('load', ''), "r")
       if 'update_step'in model.attrs:
@@ -367,6 +379,12 @@ class Device(object):
     if self.trainnet.loss in ('ctc','ce_ctc', 'hmm'):
       self.cp = theano.shared(numpy.zeros((1, 1), dtype = theano.config.floatX), borrow=True, name='cp')
       self.c = T.cast(self.cp, 'int32')
+    self.function_cache = None
+    if config.value("theano_function_cache", None):
+      from TheanoUtil import CompiledFunctionCache
+      key = CompiledFunctionCache.make_key(self._function_cache_key_parts(
+        config, update_specs=update_specs, train_param_args=train_param_args))
+      self.function_cache = CompiledFunctionCache(config.value("theano_function_cache", None), key=key)
     if self.network_task in ['train', 'theano_graph']:
       gparams = []
       exclude = []
@@ -377,16 +395,31 @@ class Device(object):
         self.gradient_norm = 0
       else:
         self.gradient_norm = None
-      for pi, param in enumerate(self.trainnet.train_params_vars):
-        if log.verbose[4]: progress_bar(float(pi) / len(self.trainnet.train_params_vars), "calculating gradients ...")
+      # Calculate all gradients in one go. This is much faster than a T.grad call per param
+      # because the backprop graph is traversed only once.
+      grad_params = []
+      for param in self.trainnet.train_params_vars:
+        if hasattr(param, 'custom_update'):
+          continue
+        if update_specs['layers'] and param.layer.name not in update_specs['layers']:
+          continue
+        grad_params.append(param)
+      if log.verbose[4]: progress_bar(0.0, "calculating gradients ...")
+      if grad_params:
+        all_grads = T.grad(self.trainnet.get_objective(), grad_params,
+                           known_grads=OrderedDict(self.trainnet.known_grads),
+                           disconnected_inputs="ignore", return_disconnected="None")
+        all_grads = dict(zip(grad_params, all_grads))
+      else:
+        all_grads = {}
+      for param in self.trainnet.train_params_vars:
         if hasattr(param,'custom_update'):
           gparam = param.custom_update
-        elif update_specs['layers'] and param.layer.name not in update_specs['layers']: #param.name == "encoder_data" or param.name == "W_cls_output_output" or param.name == "W_rec_output":
+        elif param not in all_grads: #param.name == "encoder_data" or param.name == "W_cls_output_output" or param.name == "W_rec_output":
           gparam = 0
         else:
-          try:
-            gparam = T.grad(self.trainnet.get_objective(), param, known_grads=OrderedDict(self.trainnet.known_grads))
-          except theano.gradient.DisconnectedInputError:
+          gparam = all_grads[param]
+          if gparam is None:  # disconnected
             gparam = 0
         if gparam == 0:
           exclude.append(param)
@@ -448,7 +481,7 @@ class Device(object):
         #mode_with_gpu = theano.compile.mode.get_default_mode().including('gpuarray').excluding('gpu')
         self.updater.initVars(self.trainnet, self.gradients)
         #print self.updater.getUpdateList()
-        self.trainer = theano.function(inputs=[self.block_start, self.block_end],
+        self.trainer = self._compile_function(inputs=[self.block_start, self.block_end],
                                        outputs=outputs,
                                        givens=train_givens,
                                        updates=self.updater.getUpdateList(),
@@ -462,7 +495,7 @@ class Device(object):
         assert len(gparams_outputs_format) == len(gparams)
         self.train_outputs_format += gparams_outputs_format
         outputs += gparams
-        self.trainer = theano.function(inputs=[self.block_start, self.block_end],
+        self.trainer = self._compile_function(inputs=[self.block_start, self.block_end],
                                        outputs=outputs,
                                        givens=train_givens,
                                        no_default_updates=False,
@@ -473,7 +506,7 @@ class Device(object):
       self.test_outputs_format += ["error:" + out for out in sorted(self.testnet.errors.keys())]
       test_outputs = [self.testnet.costs[out] for out in sorted(self.testnet.costs.keys())]
       test_outputs += [self.testnet.errors[out] for out in sorted(self.testnet.errors.keys())]
-      self.tester = theano.function(inputs=[self.block_start, self.block_end],
+      self.tester = self._compile_function(inputs=[self.block_start, self.block_end],
                                     outputs=test_outputs,
                                     givens=test_givens,
                                     on_unused_input=config.value('theano_on_unused_input', 'ignore'),
@@ -486,7 +519,7 @@ class Device(object):
       self.test_outputs_format += ["error:" + out for out in sorted(self.testnet.errors.keys())]
       test_outputs = [self.testnet.costs[out] for out in sorted(self.testnet.costs.keys())]
       test_outputs += [self.testnet.errors[out] for out in sorted(self.testnet.errors.keys())]
-      self.tester = theano.function(inputs=[self.block_start, self.block_end],
+      self.tester = self._compile_function(inputs=[self.block_start, self.block_end],
                                     outputs=test_outputs,
                                     givens=test_givens,
                                     on_unused_input=config.value('theano_on_unused_input', 'ignore'),
@@ -634,27 +667,88 @@ class Device(object):
           source.append(self.testnet.hidden[param].alignment[0].dimshuffle(0,1,'x') * idx)
         else:
           assert False, "invalid extraction: " + extract
-      self.extractor = theano.function(inputs = [],
+      self.extractor = self._compile_function(inputs = [],
                                        outputs = source if len(source) == 1 else [T.concatenate(source, axis=-1)],
                                        givens = givens,
                                        on_unused_input=config.value('theano_on_unused_input', 'ignore'),
                                        name = "extractor")
 
     elif self.network_task == 'classify':
-      self.classifier = theano.function(inputs = [],
-                                        outputs = [T.argmax(self.testnet.get_layer('output').p_y_given_x, axis = 1)],
+      layer = self.testnet.get_layer('output')
+      index = layer.output_index()
+      p_y_given_x = layer.p_y_given_x
+      if p_y_given_x.ndim == 2:
+        p_y_given_x = p_y_given_x.reshape((index.shape[0], index.shape[1], p_y_given_x.shape[1]))
+      # Format (time,batch), like the extractions, see EngineTask.ClassificationTaskThread.
+      self.classifier = self._compile_function(inputs = [],
+                                        outputs = [T.argmax(p_y_given_x, axis = 2)],
                                         givens = self.make_input_givens(self.testnet),
+                                        on_unused_input=config.value('theano_on_unused_input', 'ignore'),
                                         name = "classifier")
 
     elif self.network_task == 'analyze':
-      self.analyzer = theano.function(inputs = [],
-                                      outputs = [self.testnet.get_layer('output').p_y_given_x],
-                                              #+ [self.testnet.jacobian],
-                                              #+ [hidden.output for hidden in self.network.hidden]
-                                              #+ [hidden.output for hidden in self.network.reverse_hidden],
+      layer = self.testnet.get_layer('output')
+      p_y_given_x = layer.p_y_given_x.reshape((-1, layer.p_y_given_x.shape[-1]))
+      # Everything in format (time*batch,), see EngineTask.AnalyzeTaskThread.
+      self.analyzer = self._compile_function(inputs = [],
+                                      outputs = [T.argmax(p_y_given_x, axis = 1), layer.y_data_flat, layer.index.flatten()],
                                       givens = self.make_input_givens(self.testnet),
+                                      on_unused_input=config.value('theano_on_unused_input', 'ignore'),
                                       name = "analyzer")
 
+    if self.function_cache:
+      print >> log.v3, "Device %s: initialized in %.2f sec, theano_function_cache: %i hits, %i misses, dir %s" % (
+        self.name, time.time() - init_start_time,
+        self.function_cache.num_hits, self.function_cache.num_misses, self.function_cache.cache_dir)
+    else:
+      print >> log.v4, "Device %s: initialized in %.2f sec" % (self.name, time.time() - init_start_time)
+
+  # Config keys which don't influence the computation graph. Used for the theano_function_cache key.
+  FunctionCacheIgnoredConfigKeys = {
+    "train", "dev", "eval", "load", "model", "task", "device", "multiprocessing", "log", "log_verbosity",
+    "num_epochs", "save_interval", "start_epoch", "start_batch", "batch_size", "max_seqs", "max_seq_length",
+    "chunking", "cache_size", "window", "learning_rate", "learning_rates", "learning_rate_control",
+    "learning_rate_file", "newbob_relative_error_threshold", "newbob_learning_rate_decay", "output_file",
+    "theano_function_cache"}
+
+  def _function_cache_key_parts(self, config, update_specs, train_param_args):
+    """
+    :param Config.Config config:
+    :return: everything the compiled functions of this device depend on. see TheanoUtil.CompiledFunctionCache
+    :rtype: dict[str]
+    """
+    import theano
+    from Util import describe_crnn_version, describe_theano_version
+    theano_flags = {}
+    for key in ["device", "floatX", "mode", "linker", "optimizer", "optimizer_including", "optimizer_excluding",
+                "optimizer_requiring", "cast_policy", "nvcc.fastmath"]:
+      try:
+        theano_flags[key] = str(reduce(getattr, key.split("."), theano.config))
+      except AttributeError:
+        pass
+    return {
+      "network": self.trainnet.to_json(),
+      "loss": self.trainnet.loss,
+      "task": self.network_task,
+      "update_specs": update_specs,
+      "train_param_args": train_param_args,
+      "device_type": self.name[0:3],
+      "theano_flags": theano_flags,
+      "theano_version": describe_theano_version(),
+      "crnn_version": describe_crnn_version(),
+      "config": {key: value for (key, value) in config.dict.items() if key not in self.FunctionCacheIgnoredConfigKeys},
+      "config_typed": {key: value for (key, value) in config.typed_dict.items()
+                       if key not in self.FunctionCacheIgnoredConfigKeys}}
+
+  def _compile_function(self, **kwargs):
+    """
+    Like theano.function, but uses the compiled function cache, if enabled via the "theano_function_cache" option.
+    """
+    if self.function_cache:
+      return self.function_cache.function(**kwargs)
+    import theano
+    return theano.function(**kwargs)
+
   def compute_run(self, task):
     compute_start_time = time.time()
     self.compute_start_time = compute_start_time
@@ -912,28 +1006,14 @@ class Device(object):
         if self.updater:
           self.updater.setLearningRate(learning_rate)
       elif cmd == "set-net-params":  # via self.set_net_params()
-        our_params_trainnet = self.trainnet.get_all_params_vars()
-        our_params_testnet = self.testnet.get_all_params_vars()
-        assert isinstance(our_params_trainnet, list)
-        params_len = input_queue.recv()
-        params = [input_queue.recv_bytes() for i in range(params_len)]
+        # All params in a single message, see LayerNetwork.get_flat_params().
+        params = numpy.fromstring(input_queue.recv_bytes(), dtype='float32')
         assert input_queue.recv() == "end-set-net-params"
-        assert len(params) == len(our_params_trainnet)
+        self.trainnet.set_flat_params(params)
         if self.testnet_share_params:
-          assert len(our_params_testnet) == 0
+          assert len(self.testnet.get_all_params_vars()) == 0
         else:
-          assert len(params) == len(our_params_testnet)
-        for i in range(params_len):
-          param_str = params[i]
-          param = numpy.fromstring(param_str, dtype='float32')
-          our_p_train = our_params_trainnet[i]
-          our_param_shape = our_p_train.get_value(borrow=True, return_internal_type=True).shape
-          assert numpy.prod(our_param_shape) == numpy.prod(param.shape)
-          #assert numpy.isfinite(param).all()
-          converted = param.reshape(our_param_shape)
-          our_p_train.set_value(converted)
-          if not self.testnet_share_params:
-            our_params_testnet[i].set_value(converted)
+          self.testnet.set_flat_params(params)
       elif cmd == 'get-num-updates':
         if self.updater:
           output_queue.send(int(self.updater.i.get_value()))
@@ -941,14 +1021,10 @@ class Device(object):
           output_queue.send(0)
       elif cmd == "get-net-train-params":  # via self.get_net_train_params()
         output_queue.send("net-train-params")
-        output_queue.send(len(network_params))
-        for p in network_params:
-          output_queue.send_bytes(p)
+        output_queue.send_bytes(network_params)
         output_queue.send("end-get-net-train-params")
       elif cmd == "sync-net-train-params":
-        network_params = []
-        for p in self.trainnet.get_all_params_vars():
-          network_params.append(numpy.asarray(p.get_value(), dtype='float32').tostring())
+        network_params = self.trainnet.get_flat_params().tostring()
       elif cmd == "task":  # via self.run()
         task = input_queue.recv()
         try:
@@ -977,35 +1053,39 @@ class Device(object):
     if not self.blocking:
       self.input_queue.send("sync-net-train-params")
 
-  def get_net_train_params(self, network):
+  def get_net_train_params_flat(self, network):
+    """
+    :type network: Network.LayerNetwork
+    :returns all params of the device network, as one flat array, see LayerNetwork.get_flat_params()
+    :rtype: numpy.ndarray
+    """
     if self.blocking:
-      return [v.get_value(borrow=True, return_internal_type=True) for v in self.trainnet.get_all_params_vars()]
+      return self.trainnet.get_flat_params()
     else:
       assert self.main_pid == os.getpid()
       self.input_queue.send("get-net-train-params")
       r = self.output_queue.recv()
       assert r == "net-train-params"
-      param_count = self.output_queue.recv()
-      assert param_count == len(network.get_all_params_vars())
-      raw = [self.output_queue.recv_bytes() for i in range(param_count)]
+      res = numpy.fromstring(self.output_queue.recv_bytes(), dtype='float32')
       assert self.output_queue.recv() == "end-get-net-train-params"
-      vars = network.get_all_params_vars()
-      res = []
-      assert len(vars) == len(raw)
-      for p,q in zip(vars, raw):
-        res.append(numpy.fromstring(q, dtype='float32').reshape(p.get_value().shape))
       return res
 
+  def get_net_train_params(self, network):
+    """
+    :type network: Network.LayerNetwork
+    :returns all params of the device network, in the order of network.get_all_params_vars()
+    :rtype: list[numpy.ndarray]
+    """
+    return network.split_flat_params(self.get_net_train_params_flat(network))
+
   def set_net_encoded_params(self, network_params):
     """
-    :type network_params: list[numpy.ndarray]
+    :param numpy.ndarray network_params: all params as one flat array, see LayerNetwork.get_flat_params()
     This updates *all* params, not just the train params.
     """
     assert not self.blocking
     self.input_queue.send("set-net-params")
-    self.input_queue.send(len(network_params))
-    for p in network_params:
-      self.input_queue.send_bytes(p.astype('float32').tostring())
+    self.input_queue.send_bytes(numpy.asarray(network_params, dtype='float32').tostring())
     self.input_queue.send("end-set-net-params")
 
   def set_net_params(self, network):
@@ -1019,8 +1099,7 @@ class Device(object):
         self.testnet.set_params_by_dict(network.get_params_dict())
     else:
       assert self.main_pid == os.getpid()
-      self.set_net_encoded_params([
-        numpy.asarray(p.get_value()) for p in network.get_all_params_vars()])
+      self.set_net_encoded_params(network.get_flat_params())
 
   def is_device_proc(self):
     if self.blocking:
@@ -1221,7 +1300,13 @@ class Device(object):
     assert not self.wait_for_result_call
     self.wait_for_result_call = True
     if self.blocking:
-      self.output, self.outputs_format = self.compute_run(task)
+      try:
+        self.output, self.outputs_format = self.compute_run(task)
+      except Exception:
+        # Like the "error" reply of the device proc in the non-blocking case. result() will return None.
+        print >> log.v1, "Device %s: %s failed" % (self.name, task)
+        sys.excepthook(*sys.exc_info())
+        self.output, self.outputs_format = None, None
     else:
       assert self.main_pid == os.getpid()
       self.output = None
@@ -1255,6 +1340,7 @@ class Device(object):
     self.result_called_count += 1
     if self.blocking:
       assert self.result_called_count == self.run_called_count
+      self.wait_for_result_call = False
       return self.output, self.outputs_format
     else:
       assert self.main_pid == os.getpid()
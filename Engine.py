@@ -7,7 +7,8 @@ from collections import OrderedDict
 import h5py
 import json
 from Network import LayerNetwork
-from EngineTask import TrainTaskThread, EvalTaskThread, HDFForwardTaskThread, ClassificationTaskThread, PriorEstimationTaskThread
+from EngineTask import TrainTaskThread, EvalTaskThread, HDFForwardTaskThread, ClassificationTaskThread, \
+  AnalyzeTaskThread, PriorEstimationTaskThread
 import SprintCache
 from Log import log
 from Updater import Updater
@@ -48,6 +49,7 @@ class Engine:
     self.dataset_batches = {}
     self.pretrain = None; " :type: Pretrain.Pretrain "
     self.init_train_epoch_posthook = None
+    self.flat_params = False
 
   @classmethod
   def config_get_final_epoch(cls, config):
@@ -216,6 +218,7 @@ class Engine:
   def init_network_from_config(self, config):
     self.pretrain = pretrainFromConfig(config)
     self.max_seqs = config.int('max_seqs', -1)
+    self.flat_params = config.bool('flat_params', False)
 
     epoch, model_epoch_filename = self.get_epoch_model(config)
     assert model_epoch_filename or self.start_epoch
@@ -265,6 +268,8 @@ class Engine:
       last_model_hdf.close()
       EngineUtil.maybe_subtract_priors(network, self.train_data, config)
 
+    if self.flat_params:
+      network.init_flat_params()
     self.network = network
 
     if config.has('dump_json'):
@@ -417,6 +422,8 @@ class Engine:
         self.pretrain.copy_params_from_old_network(new_network, old_network)
       self.network = new_network
       self.network.declare_train_params(**self.pretrain.get_train_param_args_for_epoch(self.epoch))
+      if self.flat_params:
+        self.network.init_flat_params()
       # Use constant learning rate.
       self.learning_rate = self.pretrain_learning_rate
       self.learning_rate_control.setDefaultLearningRateForEpoch(self.epoch, self.learning_rate)
@@ -552,7 +559,8 @@ class Engine:
 
   # example (http):
   # classify: curl -X POST http://localhost:3333/classify -H "Content-Type: application/json" -d '{"data":[[-0.7, 0.98],[0.62, 1.3]], "classes" : [0,0]}'
-  # result: (GET) http://localhost:3333/hash
+  # result: (GET) http://localhost:3333/result/hash
+  # metrics: (GET) http://localhost:3333/stats
   #
   # example (rpc/python):
   # import jsonrpclib
@@ -560,54 +568,23 @@ class Engine:
   # ret = rpc.classify({"data":[[23],[0]], "classes" : [0,0], "classes-1" : [0,0], "classes-2" : [0,0], "classes-3" : [0,0], "classes-4" : [0,0]})
   # print rpc.result(ret['result']['hash'])
 
-  def daemon(self):
-    network = self.network
-    devices = self.devices
-    classifiers = {}
-
-    def _classify(params):
-      ret = { }
-      output_dim = {}
-      hash = hashlib.new('ripemd160')
-      hash.update(json.dumps(params))
-      hash = hash.hexdigest()
-      for k in params:
-        try:
-          params[k] = numpy.asarray(params[k], dtype='float32')
-          if k != 'data':
-            output_dim[k] = network.n_out[k] # = [network.n_in,2] if k == 'data' else network.n_out[k]
-        except Exception:
-          if k != 'data' and not k in network.n_out:
-            ret['error'] = 'unknown target: %s' % k
-          else:
-            ret['error'] = 'unable to convert %s to an array from value %s' % (k,str(params[k]))
-          break
-      if not 'error' in ret:
-        data = StaticDataset(data=[params], output_dim=output_dim)
-        data.init_seq_order()
-        try:
-          data = StaticDataset(data=[params], output_dim=output_dim)
-          data.init_seq_order()
-        except Exception:
-          ret['error'] = "invalid data: %s" % params
-        else:
-          batches = data.generate_batches(recurrent_net=network.recurrent,
-                                          batch_size=sys.maxsize, max_seqs=1)
-          if not hash in classifiers:
-            classifiers[hash] = ClassificationTaskThread(network, devices, data, batches)
-            classifiers[hash].json_params = params
-            print >> log.v3, "classifier started:", hash
-          ret['result'] = { 'hash' : hash }
-      return ret
-
-    def _result(hash):
-      if not classifiers[hash].isAlive():
-        return { 'result' : { k : classifiers[hash].result[k].tolist() for k in classifiers[hash].result } }
-      else:
-        return { 'error' : "classification in progress"}
-
+  def daemon(self, config):
+    """
+    Serves classification requests. The seqs of all requests are batched, see EngineDaemon.InferenceServer.
+    :type config: Config.Config
+    """
+    from EngineDaemon import InferenceServer
+    server = InferenceServer.from_config(config, network=self.network, devices=self.devices)
+    print >> log.v3, "classifier batching: max_seqs %i, max_frames %i, max_wait %f sec" % (
+      server.max_seqs, server.max_frames, server.max_wait)
 
     class RequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+      def _send_json(self, ret):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(ret))
+
       def do_POST(self):
         if len(self.path) == 0:
           self.send_response(404)
@@ -625,48 +602,35 @@ class Engine:
             except Exception:
               ret['error'] = 'unable to decode object'
             else:
-              ret.update(_classify(params))
+              ret.update(server.submit(params))
           else:
             ret['error'] = 'invalid header: %s' % ctype
         else:
           ret['error'] = 'invalid command: %s' % self.path
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.wfile.write("\n")
-        self.wfile.write(json.dumps(ret))
-        self.end_headers()
+        self._send_json(ret)
 
       def do_GET(self):
         if len(self.path.replace('/', '')) == 0:
           self.send_response(200)
+          return
+        ret = { 'error' : "" }
+        path = self.path[1:].split('/')
+        if path[0] in ['result'] and len(path) >= 2:
+          ret = server.get_result(path[1])
+        elif path[0] in ['stats']:
+          ret = {'result': server.get_stats()}
         else:
-          if len(self.path) == 0:
-            self.send_response(404)
-            return
-          ret = { 'error' : "" }
-          self.path = self.path[1:].split('/')
-          if self.path[0] in ['result']:
-            if self.path[1] in classifiers:
-              if not classifiers[self.path[1]].isAlive():
-                ret['result'] = { k : classifiers[self.path[1]].result[k].tolist() for k in classifiers[self.path[1]].result }
-              else:
-                ret['error'] = "classification in progress"
-            else:
-              ret['error'] = "unknown hash: " % self.path[1]
-          else:
-            ret['error'] = "invalid command: %s" % self.path[0]
-          self.send_response(200)
-          self.send_header('Content-Type', 'application/json')
-          self.wfile.write("\n")
-          self.wfile.write(json.dumps(ret))
-          self.end_headers()
+          ret['error'] = "invalid command: %s" % path[0]
+        self._send_json(ret)
 
       def log_message(self, format, *args): pass
     class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
       pass
 
-    httpd = ThreadingServer(("", 3333), RequestHandler)
-    print >> log.v3, "httpd listening on port", 3333
+    port = config.int('daemon_port', 3333)
+    rpc_port = config.int('daemon_rpc_port', 3334)
+    httpd = ThreadingServer(("", port), RequestHandler)
+    print >> log.v3, "httpd listening on port", port
     try:
       from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer # https://pypi.python.org/pypi/jsonrpclib/0.1.6
     except Exception:
@@ -674,51 +638,58 @@ class Engine:
     else:
       from thread import start_new_thread
       start_new_thread(httpd.serve_forever, ())
-      server = SimpleJSONRPCServer(('localhost', 3334))
-      server.register_function(_classify, 'classify')
-      server.register_function(_result, 'result')
-      print >> log.v3, "json-rpc listening on port", 3334
-      server.serve_forever()
-
-  def classify(self, data, output_file):
-    out = open(output_file, 'w')
+      server_rpc = SimpleJSONRPCServer(('localhost', rpc_port))
+      server_rpc.register_function(server.submit, 'classify')
+      server_rpc.register_function(server.get_result, 'result')
+      server_rpc.register_function(server.get_stats, 'stats')
+      print >> log.v3, "json-rpc listening on port", rpc_port
+      server_rpc.serve_forever()
+
+  def classify(self, data, output_file, batch_size=0):
+    """
+    Writes the most likely class of every frame, one line per seq in the seq order of the dataset:
+    the seq tag, followed by the class labels.
+    :type data: Dataset.Dataset
+    :type output_file: str
+    :param int batch_size: max frames per batch, see Dataset.generate_batches()
+    """
     batches = data.generate_batches(recurrent_net=self.network.recurrent,
-                                    batch_size=data.num_timesteps, max_seqs=1)
-    forwarder = ClassificationTaskThread(self.network, self.devices, data, batches)
+                                    batch_size=batch_size,
+                                    max_seqs=self.max_seqs)
+    forwarder = ClassificationTaskThread(self.network, self.devices, data, batches, task='classify')
     forwarder.join()
-    print >> out, forwarder.output
+    assert forwarder.finalized, "classification failed"
+    labels = data.labels.get("classes")
+    out = open(output_file, 'w')
+    for tag in sorted(forwarder.result.keys(), key=forwarder.seq_order.get):
+      classes = forwarder.result[tag][0].flatten()
+      print >> out, tag, " ".join([labels[c] if labels else str(c) for c in classes])
     out.close()
 
-  def analyze(self, device, data, statistics):
-    num_labels = len(data.labels)
+  def analyze(self, data, statistics, batch_size=0):
+    """
+    :type data: Dataset.Dataset
+    :param list[str] statistics: e.g. "confusion_matrix", "confusion_list", "error", "mle"
+    :param int batch_size: max frames per batch, see Dataset.generate_batches()
+    :return: the confusion matrix, format (real class, predicted class)
+    :rtype: numpy.ndarray
+    """
+    labels = data.labels.get("classes") or [str(i) for i in range(data.num_outputs["classes"][0])]
     if "mle" in statistics:
-      mle_labels = list(OrderedDict.fromkeys([ label.split('_')[0] for label in data.labels ]))
-      mle_map = [mle_labels.index(label.split('_')[0]) for label in data.labels]
-      num_mle_labels = len(mle_labels)
-      confusion_matrix = numpy.zeros((num_mle_labels, num_mle_labels), dtype = 'int32')
+      mle_labels = list(OrderedDict.fromkeys([ label.split('_')[0] for label in labels ]))
+      mle_map = numpy.array([mle_labels.index(label.split('_')[0]) for label in labels], dtype='int32')
+      num_classes = len(mle_labels)
     else:
-      confusion_matrix = numpy.zeros((num_labels, num_labels), dtype = 'int32')
-    batches = data.generate_batches(self.network.recurrent, data.num_timesteps, 1)
-    num_data_batches = len(batches)
-    num_batches = 0
-    # TODO: This code is broken.
-    while num_batches < num_data_batches:
-      alloc_devices = self.allocate_devices(data, batches, num_batches)
-      for batch, device in enumerate(alloc_devices):
-        device.run('analyze', batch, self.network)
-        result, _ = device.result()
-        max_c = numpy.argmax(result[0], axis=1)
-        if self.network.recurrent:
-          real_c = device.targets[:,device.batch_start[batch] : device.batch_start[batch + 1]].flatten()
-        else:
-          real_c = device.targets[device.batch_start[batch] : device.batch_start[batch + 1]].flatten()
-        for i in range(max_c.shape[0]):
-          #print real_c[i], max_c[i], len(confusion_matrix[0])
-          if "mle" in statistics:
-            confusion_matrix[mle_map[int(real_c[i])], mle_map[int(max_c[i])]] += 1
-          else:
-            confusion_matrix[real_c[i], max_c[i]] += 1
-      num_batches += len(alloc_devices)
+      mle_map = None
+      num_classes = len(labels)
+    batches = data.generate_batches(recurrent_net=self.network.recurrent,
+                                    batch_size=batch_size,
+                                    max_seqs=self.max_seqs)
+    analyzer = AnalyzeTaskThread(self.network, self.devices, data, batches,
+                                 num_classes=num_classes, class_map=mle_map)
+    analyzer.join()
+    confusion_matrix = analyzer.confusion_matrix
+    num_frames = float(confusion_matrix.sum())
     if "confusion_matrix" in statistics:
       print >> log.v1, "confusion matrix:"
       for i in range(confusion_matrix.shape[0]):
@@ -735,12 +706,13 @@ class Engine:
             if "mle" in statistics:
               top.append([mle_labels[i] + " -> " + mle_labels[j], confusion_matrix[i,j]])
             else:
-              top.append([data.labels[i] + " -> " + data.labels[j], confusion_matrix[i,j]])
+              top.append([labels[i] + " -> " + labels[j], confusion_matrix[i,j]])
       top.sort(key = lambda x: x[1], reverse = True)
-      for i in range(n):
-        print >> log.v1, top[i][0], top[i][1], str(100 * top[i][1] / float(data.num_timesteps)) + "%"
+      for i in range(min(n, len(top))):
+        print >> log.v1, top[i][0], top[i][1], str(100 * top[i][1] / num_frames) + "%"
     if "error" in statistics:
-      print >> log.v1, "error:", 1.0 - sum([confusion_matrix[i,i] for i in range(confusion_matrix.shape[0])]) / float(data.num_timesteps)
+      print >> log.v1, "error:", 1.0 - numpy.trace(confusion_matrix) / num_frames
+    return confusion_matrix
 
   def compute_priors(self, dataset, config):
     from Dataset import Dataset
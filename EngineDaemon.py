@@ -0,0 +1,366 @@
+
+"""
+Batched inference service for the "daemon" task (Engine.daemon()).
+Incoming sequences are queued. A single worker thread collects them into dynamic batches,
+limited by a number of seqs, a number of frames and a latency budget,
+and runs them on the already initialized devices.
+The results are kept in a bounded cache with TTL eviction, and can be fetched by their hash.
+"""
+
+import sys
+import time
+import threading
+import hashlib
+import json
+from collections import OrderedDict, deque
+import numpy
+try:
+  import Queue
+except ImportError:  # Python3
+  import queue as Queue
+from Log import log
+
+
+class ResultCache:
+  """
+  Bounded dict with TTL eviction. Thread-safe.
+  The least recently added entries are evicted first if we have more than max_entries.
+  """
+
+  def __init__(self, max_entries=1000, ttl=600.0):
+    """
+    :param int max_entries: max number of entries
+    :param float ttl: time to live of an entry in seconds. <= 0 means infinite
+    """
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self._entries = OrderedDict(); " :type: dict[str,(float,object)] "  # key -> (time added, value)
+    self.num_evicted = 0
+
+  def _evict(self, now):
+    if self.ttl > 0:
+      while self._entries:
+        key, (t, _) = next(iter(self._entries.items()))
+        if now - t < self.ttl:
+          break
+        del self._entries[key]
+        self.num_evicted += 1
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+      self.num_evicted += 1
+
+  def set(self, key, value):
+    with self.lock:
+      now = time.time()
+      self._entries.pop(key, None)
+      self._entries[key] = (now, value)
+      self._evict(now)
+
+  def get(self, key, default=None):
+    with self.lock:
+      self._evict(time.time())
+      if key not in self._entries:
+        return default
+      return self._entries[key][1]
+
+  def __contains__(self, key):
+    with self.lock:
+      self._evict(time.time())
+      return key in self._entries
+
+  def __len__(self):
+    with self.lock:
+      self._evict(time.time())
+      return len(self._entries)
+
+
+class LatencyStats:
+  """
+  Keeps the last latencies and calculates percentiles over them. Thread-safe.
+  """
+
+  def __init__(self, window=1000):
+    """
+    :param int window: number of the last latencies we keep
+    """
+    self.lock = threading.Lock()
+    self.latencies = deque(maxlen=window)
+    self.count = 0
+
+  def add(self, latency):
+    """
+    :param float latency: in seconds
+    """
+    with self.lock:
+      self.latencies.append(latency)
+      self.count += 1
+
+  def percentile(self, q):
+    """
+    :param float q: in [0,100]
+    :rtype: float|None
+    """
+    with self.lock:
+      if not self.latencies:
+        return None
+      return float(numpy.percentile(list(self.latencies), q))
+
+
+class InferenceRequest:
+  def __init__(self, hash, params):
+    """
+    :param str hash: see InferenceServer.make_hash()
+    :param dict[str,numpy.ndarray] params: data-key -> data, e.g. "data" -> (time,dim)
+    """
+    self.hash = hash
+    self.params = params
+    self.num_frames = params["data"].shape[0]
+    self.start_time = time.time()
+    self.done = threading.Event()
+    self.result = None; " :type: dict[str,numpy.ndarray]|None "
+    self.error = None; " :type: str|None "
+
+
+class InferenceServer:
+  """
+  Collects the submitted seqs into batches and forwards them through the network.
+  See Engine.daemon() for the HTTP and JSON-RPC frontend.
+  """
+
+  def __init__(self, network, devices, max_seqs=16, max_frames=10000, max_wait=0.01,
+               cache_max_entries=1000, cache_ttl=600.0):
+    """
+    :param Network.LayerNetwork network:
+    :param list[Device.Device] devices:
+    :param int max_seqs: max number of seqs per batch
+    :param int max_frames: max number of frames per batch
+    :param float max_wait: latency budget in seconds. how long we wait for further seqs for a batch
+    :param int cache_max_entries: max number of results we keep
+    :param float cache_ttl: time in seconds how long we keep a result
+    """
+    self.network = network
+    self.devices = devices
+    self.max_seqs = max(max_seqs, 1)
+    self.max_frames = max(max_frames, 1)
+    self.max_wait = max_wait
+    self.queue = Queue.Queue()
+    self.results = ResultCache(max_entries=cache_max_entries, ttl=cache_ttl)
+    # Failures are not cached as results. We only keep the error message for get_result(),
+    # and a new submit() of the same seq tries again.
+    self.errors = ResultCache(max_entries=cache_max_entries, ttl=cache_ttl)
+    self.in_progress = {}; " :type: dict[str,InferenceRequest] "
+    self.lock = threading.Lock()
+    self.latency = LatencyStats()
+    self.num_batches = 0
+    self.num_seqs = 0
+    self.num_errors = 0
+    self.active = True
+    self.thread = threading.Thread(target=self._worker_loop, name="InferenceServer")
+    self.thread.daemon = True
+    self.thread.start()
+
+  @classmethod
+  def from_config(cls, config, network, devices):
+    """
+    :param Config.Config config:
+    :type network: Network.LayerNetwork
+    :type devices: list[Device.Device]
+    :rtype: InferenceServer
+    """
+    max_seqs = config.int('daemon_max_seqs', config.int('max_seqs', -1))
+    if max_seqs <= 0:
+      max_seqs = 16
+    max_frames = config.int('daemon_max_frames', config.int('batch_size', 0))
+    if max_frames <= 0:
+      max_frames = 10000
+    return cls(network=network, devices=devices,
+               max_seqs=max_seqs, max_frames=max_frames,
+               max_wait=config.float('daemon_max_wait', 0.01),
+               cache_max_entries=config.int('daemon_cache_max_entries', 1000),
+               cache_ttl=config.float('daemon_cache_ttl', 600.0))
+
+  @staticmethod
+  def make_hash(params):
+    """
+    :param dict params: JSON-serializable
+    :rtype: str
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps(params, sort_keys=True))
+    return h.hexdigest()
+
+  def submit(self, params):
+    """
+    :param dict[str] params: data-key -> JSON-like array. at least "data" is needed
+    :return: dict with either "result" -> {"hash": hash}, or "error"
+    :rtype: dict[str]
+    """
+    hash = self.make_hash(params)
+    arrays = {}
+    for k in params:
+      if k != 'data' and k not in self.network.n_out:
+        return {'error': 'unknown target: %s' % k}
+      try:
+        arrays[k] = numpy.asarray(params[k], dtype='float32')
+      except Exception:
+        return {'error': 'unable to convert %s to an array from value %s' % (k, str(params[k]))}
+    if 'data' not in arrays or arrays['data'].ndim != 2 or arrays['data'].shape[0] == 0:
+      return {'error': "invalid data: %s" % params}
+    if arrays['data'].shape[1] != self.network.n_in:
+      return {'error': "invalid data dimension %i, expected %i" % (arrays['data'].shape[1], self.network.n_in)}
+    for k, v in arrays.items():
+      if k == 'data':
+        continue
+      dim, ndim = self.network.n_out[k]
+      if v.ndim != ndim or v.shape[0] != arrays['data'].shape[0] or (ndim == 2 and v.shape[1] != dim):
+        return {'error': "invalid shape %r of target %s, expected %i frames with dim %i" % (
+          v.shape, k, arrays['data'].shape[0], dim)}
+    with self.lock:
+      if hash not in self.in_progress and hash not in self.results:
+        req = InferenceRequest(hash=hash, params=arrays)
+        self.in_progress[hash] = req
+        self.queue.put(req)
+        print >> log.v4, "classifier queued:", hash
+    return {'result': {'hash': hash}}
+
+  def get_result(self, hash):
+    """
+    :param str hash: from submit()
+    :rtype: dict[str]
+    """
+    res = self.results.get(hash)
+    if res is not None:
+      return {'result': {k: v.tolist() for (k, v) in res.items()}}
+    with self.lock:
+      if hash in self.in_progress:
+        return {'error': "classification in progress"}
+    error = self.errors.get(hash)
+    if error is not None:
+      return {'error': error}
+    return {'error': "unknown hash: %s" % hash}
+
+  def get_stats(self):
+    """
+    :return: metrics, such as queue depth and latency percentiles
+    :rtype: dict[str]
+    """
+    p50 = self.latency.percentile(50)
+    p99 = self.latency.percentile(99)
+    return {
+      'queue_depth': self.queue.qsize(),
+      'in_progress': len(self.in_progress),
+      'num_batches': self.num_batches,
+      'num_seqs': self.num_seqs,
+      'num_errors': self.num_errors,
+      'avg_seqs_per_batch': float(self.num_seqs) / max(self.num_batches, 1),
+      'latency_p50': p50,
+      'latency_p99': p99,
+      'cache_entries': len(self.results),
+      'cache_evicted': self.results.num_evicted}
+
+  def stop(self):
+    self.active = False
+    self.thread.join()
+
+  def _collect_batch(self, pending):
+    """
+    :param list[InferenceRequest] pending: requests which we got from the queue but did not fit in the last batch.
+      will be modified
+    :return: requests for the next batch, or None if we got nothing
+    :rtype: list[InferenceRequest]|None
+    """
+    while not pending:
+      if not self.active:
+        return None
+      try:
+        pending.append(self.queue.get(timeout=0.1))
+      except Queue.Empty:
+        continue
+    first = pending.pop(0)
+    reqs = [first]
+    num_frames = first.num_frames
+    # All seqs in one dataset need the same data-keys.
+    keys = sorted(first.params.keys())
+    deadline = first.start_time + self.max_wait
+    idx = 0
+    while len(reqs) < self.max_seqs and num_frames < self.max_frames:
+      if idx < len(pending):
+        req = pending[idx]
+      else:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+        try:
+          req = self.queue.get(timeout=timeout)
+        except Queue.Empty:
+          break
+        pending.append(req)
+      if sorted(req.params.keys()) == keys and num_frames + req.num_frames <= self.max_frames:
+        reqs.append(req)
+        num_frames += req.num_frames
+        pending.pop(idx)
+      else:
+        idx += 1
+    return reqs
+
+  def _run_batch(self, reqs):
+    """
+    :param list[InferenceRequest] reqs:
+    :return: tag -> output, see ClassificationTaskThread
+    :rtype: dict[str,numpy.ndarray]
+    """
+    from GeneratingDataset import StaticDataset
+    from EngineTask import ClassificationTaskThread
+    output_dim = {k: self.network.n_out[k] for k in reqs[0].params if k != 'data'}
+    data = StaticDataset(data=[req.params for req in reqs], output_dim=output_dim)
+    data.init_seq_order()
+    batches = data.generate_batches(recurrent_net=self.network.recurrent,
+                                    batch_size=self.max_frames, max_seqs=self.max_seqs)
+    forwarder = ClassificationTaskThread(self.network, self.devices, data, batches, fatal_exceptions=False)
+    forwarder.join()
+    if not forwarder.finalized:
+      raise Exception("classification failed")
+    return forwarder.result
+
+  def _run_reqs(self, reqs):
+    """
+    :param list[InferenceRequest] reqs:
+    :return: per request the output, or None if it failed
+    :rtype: list[numpy.ndarray|None]
+    """
+    try:
+      result = self._run_batch(reqs)
+    except Exception as exc:
+      print >> log.v2, "classifier failed on batch with %i seqs: %s" % (len(reqs), exc)
+      sys.excepthook(*sys.exc_info())
+      if len(reqs) == 1:
+        return [None]
+      # Retry one by one, so that only the bad seqs fail.
+      return sum([self._run_reqs([req]) for req in reqs], [])
+    # StaticDataset uses the default seq tags.
+    return [result.get("seq-%i" % i) for i in range(len(reqs))]
+
+  def _worker_loop(self):
+    pending = []
+    while self.active:
+      reqs = self._collect_batch(pending)
+      if not reqs:
+        continue
+      print >> log.v5, "classifier running batch with %i seqs, %i frames, queue depth %i" % (
+        len(reqs), sum([req.num_frames for req in reqs]), self.queue.qsize())
+      outputs = self._run_reqs(reqs)
+      for req, res in zip(reqs, outputs):
+        if res is None:
+          req.error = "classification failed"
+          self.num_errors += 1
+          self.errors.set(req.hash, req.error)
+        else:
+          req.result = {"seq-0": res}
+          self.results.set(req.hash, req.result)
+        with self.lock:
+          del self.in_progress[req.hash]
+        req.done.set()
+        self.latency.add(time.time() - req.start_time)
+      self.num_batches += 1
+      self.num_seqs += len(reqs)
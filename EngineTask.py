@@ -4,15 +4,17 @@ import sys
 import threading
 import time
 import theano
-from EngineUtil import assign_dev_data
+from EngineUtil import assign_dev_data, average_flat_params
 from Log import log
 from Util import hms, progress_bar, terminal_size, hdf5_strings, interrupt_main, NumbersDict
 from Device import Device
 from TaskSystem import ProcConnectionDied
 from math import ceil
+from collections import deque
 
 
 class TaskThread(threading.Thread):
+    fatal_exceptions = True  # whether an exception in run_inner() interrupts the main thread
     def __init__(self, task, network, devices, data, batches, eval_batch_size=0, start_batch=0, share_batches = False, report_prefix=None, exclude=None, epoch=None):
       """
       :type task: str
@@ -200,6 +202,7 @@ class TaskThread(threading.Thread):
         self.parent = parent
         self.devices_batches_idx = None
         self.run_start_batch_idx = None
+        self.run_devices_batches = None
         self.eval_info = None; " :type: dict[str] | None "
         self.allocated = False
         self.processing = False
@@ -239,7 +242,7 @@ class TaskThread(threading.Thread):
           self.parent.device_crash_batch = self.run_start_batch_idx
           self.crashed = True
           return False
-        assert len(device_results) == len(self.alloc_devices) == len(self.devices_batches)
+        assert len(device_results) == len(self.alloc_devices) == len(self.run_devices_batches)
 
         if outputs_format and any([k.startswith("gparam:") for k in outputs_format]):
           # WARNING: this code is untested and likely broken!
@@ -263,7 +266,7 @@ class TaskThread(threading.Thread):
             self.parent.updater.update()
             self.alloc_devices[i].set_net_params(self.parent.network)
 
-        self.result = { 'batchess': self.devices_batches, 'results': device_results, 'result_format': outputs_format, 'num_frames': self.num_frames }
+        self.result = { 'batchess': self.run_devices_batches, 'results': device_results, 'result_format': outputs_format, 'num_frames': self.num_frames }
         self.eval_info = self.parent.evaluate(**self.result)
         self.parent.lock.acquire()
         self.print_process()
@@ -294,6 +297,8 @@ class TaskThread(threading.Thread):
 
       def device_run(self):
         batch_idx = self.run_start_batch_idx = self.devices_batches_idx
+        # The next allocate() can happen already while we are in finish(), thus keep a reference.
+        self.run_devices_batches = self.devices_batches
         assert len(self.alloc_devices) == len(self.devices_batches)
         for device, batches in zip(self.alloc_devices, self.devices_batches):
           if self.parent.network.recurrent:
@@ -390,7 +395,9 @@ class TaskThread(threading.Thread):
             print("")
         finally:
           # Exceptions are fatal. If we can recover, we should handle it in run_inner().
-          interrupt_main()
+          # Callers which handle a failed task themselves (self.finalized == False) can disable that.
+          if self.fatal_exceptions:
+            interrupt_main()
 
     def run_inner(self):
       self.start_time = time.time()
@@ -411,7 +418,6 @@ class TaskThread(threading.Thread):
       num_device_runs = 1 if self.share_batches else len(self.devices)
       deviceRuns = [ self.DeviceBatchRun(self, [self.devices[i]] if not self.share_batches else self.devices) for i in range(num_device_runs) ]
 
-      results = { 'batchess': [], 'results': [], 'num_frames' : NumbersDict(0) }
       run_frames = NumbersDict(0)
 
       crashed = False
@@ -429,23 +435,19 @@ class TaskThread(threading.Thread):
             crashed = True
             break
           if deviceRuns[i].finished:
-            results['batchess'] += deviceRuns[i].result['batchess'][:]
-            results['results'] += deviceRuns[i].result['results'][:]
-            results['result_format'] = deviceRuns[i].result['result_format']
+            # The results were already handled via self.evaluate() in DeviceBatchRun.finish().
+            # Don't collect them here, they can be big (e.g. in forwarding).
             deviceRuns[i].finished = False
         if crashed:
           break
 
         if run_frames.max_value() >= self.eval_batch_size or not self.batches.has_more():
           if all(not (dev.finished or dev.allocated or dev.processing) for dev in deviceRuns):
-            results['num_frames'] = run_frames
             self.num_frames += run_frames
             if self.share_batches: run_frames *= len(self.devices)
             self.reduce(run_frames)
             self.eval_batch_idx += 1
             run_frames = NumbersDict(0)
-            results['batchess'] = []
-            results['results'] = []
             for device in self.devices:
               device.num_frames = 0
               device.num_updates = 0
@@ -593,43 +595,31 @@ class TrainTaskThread(TaskThread):
     for device in self.devices:
       device.sync_net_train_params()
     try:
-      basenet = self.network.get_all_params_vars()
-      consnet = [numpy.zeros(p.get_value().shape, dtype='float32') for p in basenet]
+      # All params as flat arrays, thus the transfer and the averaging are bulk operations.
+      basenet = self.network.get_flat_params()
       hypnets = []
-      nparams = len(basenet)
-      encoded = []
       #pipe = self.CopyManager(self.devices)
       #hypnets = pipe.copy_from_device()
       for device in self.devices:
-        hypnets.append([ p for p in device.get_net_train_params(self.network) ])
-        assert len(hypnets[-1]) == len(basenet)
+        hypnets.append(device.get_net_train_params_flat(self.network))
+        assert hypnets[-1].shape == basenet.shape
       if len(hypnets) == 0:
         consnet = basenet
       elif len(hypnets) == 1:
         consnet = hypnets[0]
       else:
         # consensus via average
-        for i in range(nparams):
-          num_updates = { dev.name : dev.num_updates for net,dev in zip(hypnets,self.devices) if numpy.sum(abs(net[i] - basenet[i].get_value())) > numpy.float32(0) }
-          tot_updates = sum(num_updates.values())
-          #num_updates = numpy.sum([ dev.num_updates for net,dev in zip(hypnets,self.devices) ])
-          #ndevs = len([ dev for dev in self.devices if abs(numpy.sum(net[i] - basenet[i].get_value())) > 0.0001 ])
-          #consnet[i] = basenet[i].get_value() + numpy.sum([(net[i] - basenet[i].get_value()) * (float(device.num_frames) / num_frames) for net,dev in zip(hypnets,self.devices) if basenet[i].layer.name in dev.update_specs['layers']], axis = 0)
-          if tot_updates:
-            consnet[i] = basenet[i].get_value() + numpy.sum([ (net[i] - basenet[i].get_value()) * (float(num_updates[dev.name]) / tot_updates) for net,dev in zip(hypnets,self.devices) if dev.name in num_updates ], axis = 0)
-          else:
-            print >> log.v3, "warning: no update available for parameter", basenet[i]
-            consnet[i] = basenet[i].get_value()
-          #consnet[i] = basenet[i].get_value() + ndevs * numpy.sum([ (net[i] - basenet[i].get_value()) * (float(device.num_frames) / nframes) for net,dev in zip(hypnets,self.devices) ], axis = 0)
+        params = self.network.get_all_params_vars()
+        consnet, no_update = average_flat_params(
+          basenet, hypnets, num_updates=[dev.num_updates for dev in self.devices],
+          sizes=[p.get_value(borrow=True, return_internal_type=True).size for p in params])
+        for i in numpy.flatnonzero(no_update):
+          print >> log.v3, "warning: no update available for parameter", params[i]
       self.network.update_step = sum([ dev.get_num_updates() for dev in self.devices ]) / len(self.devices)
-      for p, q in zip(self.network.get_all_params_vars(), consnet):
-        p_shape = p.get_value(borrow=True, return_internal_type=True).shape
-        assert p_shape == q.shape
-        p.set_value(q)
-        encoded.append(q)
+      self.network.set_flat_params(consnet)
       if len(hypnets) > 1:
         for device in self.devices:
-          device.set_net_encoded_params(encoded)
+          device.set_net_encoded_params(consnet)
     except Exception as e:
       print >> log.v3, "network synchronization failed: ", e.message
       if log.v4:
@@ -654,10 +644,112 @@ class EvalTaskThread(TaskThread):
       for device in self.devices:
         device.set_net_params(self.network)
 
+class HDFForwardWriter(threading.Thread):
+    """
+    Writes the forwarded seqs into the HDF file in a separate thread.
+    The HDF datasets are chunked and resized geometrically, so we don't resize them for every seq.
+    The seqs must be added in the final order.
+    """
+
+    def __init__(self, cache, max_queue_size=100, growth_factor=2.0):
+      """
+      :param h5py.File cache: output HDF file
+      :param int max_queue_size: max number of seqs in the queue. add() blocks if it is full
+      :param float growth_factor: for the geometric resizing of the HDF datasets
+      """
+      threading.Thread.__init__(self, name="HDFForwardWriter")
+      import Queue
+      import h5py
+      self.daemon = True
+      self.cache = cache
+      self.queue = Queue.Queue(maxsize=max_queue_size)
+      self.growth_factor = growth_factor
+      self.num_seqs = 0
+      self.num_timesteps = 0
+      self.num_times = 0
+      self.inputs = None
+      self.seq_lengths = cache.create_dataset("seqLengths", (0,), dtype='i', maxshape=(None,), chunks=True)
+      self.tags = cache.create_dataset("seqTags", (0,), dtype=h5py.special_dtype(vlen=str), maxshape=(None,), chunks=True)
+      self.times = None
+      self.exception = None
+      self.start()
+
+    def _ensure_size(self, dataset, size):
+      """
+      :param h5py.Dataset dataset:
+      :param int size: min size of axis 0
+      """
+      if dataset.shape[0] < size:
+        dataset.resize(max(size, int(dataset.shape[0] * self.growth_factor)), axis=0)
+
+    def add(self, tag, features, times=None):
+      """
+      :param str tag: seq tag
+      :param numpy.ndarray features: (time,dim)
+      :param list[(float,float)]|None times: start/end times of the seq, if available
+      """
+      if self.exception:
+        raise self.exception
+      self.queue.put((tag, features, times))
+
+    def _write(self, tag, features, times):
+      if self.inputs is None:
+        self.inputs = self.cache.create_dataset(
+          "inputs", (0, features.shape[1]), dtype='f', maxshape=(None, None), chunks=True)
+      if self.inputs.shape[1] < features.shape[1]:
+        self.inputs.resize(features.shape[1], axis=1)
+      self._ensure_size(self.inputs, self.num_timesteps + features.shape[0])
+      self.inputs[self.num_timesteps:self.num_timesteps + features.shape[0], :features.shape[1]] = features
+      self.num_timesteps += features.shape[0]
+      self._ensure_size(self.seq_lengths, self.num_seqs + 1)
+      self.seq_lengths[self.num_seqs] = features.shape[0]
+      self._ensure_size(self.tags, self.num_seqs + 1)
+      self.tags[self.num_seqs] = tag
+      self.num_seqs += 1
+      if times is not None and len(times) > 0:
+        if self.times is None:
+          self.times = self.cache.create_dataset("times", (0, 2), dtype='f', maxshape=(None, 2), chunks=True)
+        self._ensure_size(self.times, self.num_times + len(times))
+        self.times[self.num_times:self.num_times + len(times)] = times
+        self.num_times += len(times)
+
+    def run(self):
+      try:
+        while True:
+          item = self.queue.get()
+          if item is None:
+            break
+          self._write(*item)
+      except Exception as exc:
+        self.exception = exc
+        sys.excepthook(*sys.exc_info())
+        # Consume the rest so that add() and close() never block.
+        while self.queue.get() is not None:
+          pass
+
+    def close(self):
+      """
+      Waits until all seqs are written and shrinks the HDF datasets to their final size.
+      """
+      self.queue.put(None)
+      self.join()
+      if self.exception:
+        raise self.exception
+      if self.inputs is not None:
+        self.inputs.resize(self.num_timesteps, axis=0)
+        self.cache.attrs['inputPattSize'] = self.inputs.shape[1]
+      self.seq_lengths.resize(self.num_seqs, axis=0)
+      self.tags.resize(self.num_seqs, axis=0)
+      if self.times is not None:
+        self.times.resize(self.num_times, axis=0)
+      self.cache.attrs['numSeqs'] = self.num_seqs
+      self.cache.attrs['numTimesteps'] = self.num_timesteps
+
+
 class HDFForwardTaskThread(TaskThread):
     def __init__(self, network, devices, data, batches, cache, merge={}):
-      super(HDFForwardTaskThread, self).__init__('extract', network, devices, data, batches, eval_batch_size=1)
-      self.tags = []
+      # No eval_batch_size limit, so that all devices are busy.
+      # All the HDF writing is done in evaluate(), i.e. we don't need reduce().
       self.merge = merge
       self.cache = cache
       self.network = network
@@ -673,80 +765,148 @@ class HDFForwardTaskThread(TaskThread):
         cache.attrs['numSeqs'] = data.num_seqs
       except Exception:
         cache.attrs['numSeqs'] = 1
-        self.seq_lengths = cache.create_dataset("seqLengths", (cache.attrs['numSeqs'],), dtype='i', maxshape=(None,))
       else:
-        self.seq_lengths = cache.create_dataset("seqLengths", (cache.attrs['numSeqs'],), dtype='i')
         self.seq_dims = cache.create_dataset("seqDims", (cache.attrs['numSeqs'], 1), dtype='i')
       try:
         self.targets = { k: cache.create_dataset("targets/data/" + k, (data.get_num_timesteps(),), dtype='i') for k in data.get_target_list() }
       except Exception:
         self.targets = None
-      self.times = []
+      # Several devices can finish in any order, thus we keep the order of allocation
+      # and the finished seqs which we cannot write yet.
+      self.reorder_lock = threading.Lock()
+      self.seq_order = deque(); " :type: deque[int] "  # seq idx in order of allocation, not yet written
+      self.seq_infos = {}; " :type: dict[int,(str,list[(float,float)]|None)] "  # seq idx -> tag, times
+      self.pending_seqs = {}; " :type: dict[int,(str,numpy.ndarray,list[(float,float)]|None)] "
+      if data.chunk_size > 0:
+        print >> log.v1, "WARNING: Dataset uses chunking. Forwarding expects whole seqs. You might want to disable that."
+      self.writer = HDFForwardWriter(cache)
+      super(HDFForwardTaskThread, self).__init__('extract', network, devices, data, batches)
 
     def initialize(self):
       self.toffset = 0
 
+    def assign_dev_data(self, device, batches):
+      success, num_batches = super(HDFForwardTaskThread, self).assign_dev_data(device, batches)
+      # The dataset might not keep the seqs until we get the outputs, so get the tags and times now.
+      with self.reorder_lock:
+        offset_slice = 0
+        for batch in batches[:num_batches]:
+          for seq in batch.seqs:
+            self.seq_order.append(seq.seq_idx)
+            self.seq_infos[seq.seq_idx] = (device.tags[seq.batch_slice + offset_slice], self._get_times(seq.seq_idx))
+          offset_slice += batch.num_slices
+      return success, num_batches
+
     def finalize(self):
-      hdf5_strings(self.cache, 'seqTags', self.tags)
-      if self.times:
-        times = self.cache.create_dataset("times", (len(self.times), 2), dtype='f')
-        times[...] = self.times
-      self.cache.attrs['numSeqs'] = self.num_seqs
+      assert not self.pending_seqs
+      self.writer.close()
+      self.num_seqs = self.writer.num_seqs
+      self.toffset = self.writer.num_timesteps
+      self.finalized = True
+
+    def _get_seq_features(self, features, batch_num_frames, seq, slice_idx):
+      """
+      :param numpy.ndarray features: (time,batch,dim)
+      :param int batch_num_frames: max num frames of the input data in this batch
+      :param EngineBatch.BatchSeqCopyPart seq:
+      :param int slice_idx: the slice of the seq in features
+      :rtype: numpy.ndarray
+      """
+      if features.shape[0] == batch_num_frames:
+        o = seq.batch_frame_offset["data"]
+        return features[o:o + seq.frame_length["data"], slice_idx]
+      # The network changes the time length. Strip the padding.
+      seqfeats = features[:, slice_idx]
+      if features.shape[1] > 1:
+        seqfeats = seqfeats[~numpy.all(seqfeats == 0, axis=1)]
+      if seqfeats.shape[0] == 0:
+        seqfeats = features[:, slice_idx]
+      return seqfeats
 
     def evaluate(self, batchess, results, result_format, num_frames):
-      features = numpy.concatenate(results, axis=1)[0]
-      if not "inputs" in self.cache:
-        self.inputs = self.cache.create_dataset("inputs", (self.cache.attrs['numSeqs'], features.shape[-1]), dtype='f', maxshape=(None, None))
-      # Currently we support just a single dev with a single batch.
-      assert len(batchess) == 1
-      assert len(batchess[0]) == 1
-      batch = batchess[0][0]
-      tt = 0
-      feats = []
-      self.num_seqs += batch.get_num_seqs()
-      for seq_idx in range(batch.start_seq,batch.end_seq):
-        if self.network.recurrent:
-          seqfeats = features[:,seq_idx - batch.start_seq,:]
-          if batch.end_seq - batch.start_seq > 1:
-            seqfeats = seqfeats[~numpy.all(seqfeats == 0,axis=1)]
-          if seqfeats.shape[0] == 0:
-            seqfeats = features[:,seq_idx - batch.start_seq,:]
-        else:
-          seqfeats = features[seq_idx - batch.start_seq]
-        print >> log.v5, "extracting", seqfeats.shape[-1], "features over", seqfeats.shape[0], "time steps for sequence", self.data.get_tag(seq_idx)
-        self.cache.attrs['numTimesteps'] += seqfeats.shape[0]
-        tt += seqfeats.shape[0]
-        #self.seq_dims[seq_idx] = [seqfeats.shape[1]]
-        if self.seq_lengths.shape[0] <= seq_idx:
-          self.seq_lengths.resize(seq_idx+1,axis=0)
-        self.seq_lengths[seq_idx] = seqfeats.shape[0]
-        #self.inputs[self.toffset:self.toffset + seqfeats.shape[0]] = numpy.asarray(seqfeats)
-        feats.append(seqfeats)
-        self.tags.append(self.data.get_tag(seq_idx))
-        try:
-          times = self.data.get_times(seq_idx)
-          self.times.extend(times)
-        except Exception:
-          pass
-        if self.inputs.shape[1] < seqfeats.shape[1]:
-          self.inputs.resize(seqfeats.shape[1], axis=1)
-      if self.inputs.shape[0] < self.toffset + tt:
-        self.inputs.resize(self.toffset + tt, axis = 0)
-      self.inputs[self.toffset:self.toffset + tt] = numpy.concatenate(feats,axis=0)
-      self.cache.attrs['inputPattSize'] = self.inputs.shape[1]
-      self.toffset += tt
+      assert len(batchess) == len(results)
+      seqs = {}
+      for batches, outputs in zip(batchess, results):
+        features = outputs[0]
+        if features.ndim == 2:  # (time,dim), e.g. non-recurrent
+          features = features[:, None]
+        batch_num_frames = max([batch.max_num_frames_per_slice["data"] for batch in batches])
+        offset_slice = 0
+        for batch in batches:
+          for seq in batch.seqs:
+            seqfeats = self._get_seq_features(features, batch_num_frames, seq, seq.batch_slice + offset_slice)
+            with self.reorder_lock:
+              tag, times = self.seq_infos[seq.seq_idx]
+            print >> log.v5, "extracting", seqfeats.shape[-1], "features over", seqfeats.shape[0], "time steps for sequence", tag
+            seqs[seq.seq_idx] = (tag, seqfeats, times)
+          offset_slice += batch.num_slices
+      with self.reorder_lock:
+        self.pending_seqs.update(seqs)
+        while self.seq_order and self.seq_order[0] in self.pending_seqs:
+          seq_idx = self.seq_order.popleft()
+          self.writer.add(*self.pending_seqs.pop(seq_idx))
+          self.seq_infos.pop(seq_idx, None)
+
+    def _get_times(self, seq_idx):
+      try:
+        return self.data.get_times(seq_idx)
+      except Exception:
+        return None
 
 
 class ClassificationTaskThread(TaskThread):
-    def __init__(self, network, devices, data, batches):
-      super(ClassificationTaskThread, self).__init__('extract', network, devices, data, batches, eval_batch_size=1)
+    def __init__(self, network, devices, data, batches, task='extract', fatal_exceptions=True):
+      """
+      :param str task: "extract" for the extractions, or "classify" for the most likely class of every frame
+      :param bool fatal_exceptions: if False, an exception only leaves self.finalized == False, see TaskThread.run()
+      """
+      self.fatal_exceptions = fatal_exceptions
       self.result = {}
+      self.seq_order = {}; " :type: dict[str,int] "
+      super(ClassificationTaskThread, self).__init__(task, network, devices, data, batches, eval_batch_size=1)
 
     def evaluate(self, batchess, results, result_format, num_frames):
-      assert len(batchess) == 1
-      assert len(batchess[0]) == 1
-      assert batchess[0][0].get_num_seqs() == 1
-      self.result[self.data.get_tag(batchess[0][0].start_seq)] = numpy.concatenate(results, axis=1)
+      """
+      Splits the outputs of all devices into the single seqs.
+      The result per seq tag is of format (extraction,time,1,dim), like for a batch with a single seq.
+      """
+      assert len(batchess) == len(results)
+      for batches, outputs in zip(batchess, results):
+        offset_slice = 0
+        for batch in batches:
+          for seq in batch.seqs:
+            o = seq.batch_frame_offset["data"]
+            q = seq.batch_slice + offset_slice
+            l = seq.frame_length["data"]
+            tag = self.data.get_tag(seq.seq_idx)
+            self.result[tag] = numpy.array([output[o:o + l, q:q + 1] for output in outputs])
+            self.seq_order[tag] = seq.seq_idx
+          offset_slice += batch.num_slices
+
+
+class AnalyzeTaskThread(TaskThread):
+    def __init__(self, network, devices, data, batches, num_classes, class_map=None):
+      """
+      :param int num_classes: size of the confusion matrix
+      :param numpy.ndarray|None class_map: maps the network output classes to the confusion matrix classes
+      """
+      self.num_classes = num_classes
+      self.class_map = class_map
+      self.confusion_matrix = numpy.zeros((num_classes, num_classes), dtype='int32')
+      super(AnalyzeTaskThread, self).__init__('analyze', network, devices, data, batches)
+
+    def evaluate(self, batchess, results, result_format, num_frames):
+      """
+      Accumulates the confusion matrix. The device returns the predicted and the real classes
+      and the index, all in format (time*batch,), see Device.initialize().
+      """
+      for max_c, real_c, index in results:
+        mask = index > 0
+        max_c, real_c = max_c[mask], real_c[mask]
+        if self.class_map is not None:
+          max_c, real_c = self.class_map[max_c], self.class_map[real_c]
+        counts = numpy.bincount(real_c * self.num_classes + max_c, minlength=self.num_classes ** 2)
+        self.confusion_matrix += counts.reshape(self.num_classes, self.num_classes).astype('int32')
 
 
 class PriorEstimationTaskThread(TaskThread):
@@ -108,3 +108,49 @@ def maybe_subtract_priors(network, train, config):
     b_softmax = l[0]
     b_softmax.set_value(b_softmax.get_value() - prior_scale * numpy.log(priors))
     print >> log.v3, "subtracting priors with prior_scale", prior_scale
+
+
+def average_flat_params(base, nets, num_updates, sizes, chunk_size=2 ** 16):
+  """
+  Model averaging over the devices, for all params at once.
+  Every param gets the update of every device which has changed it,
+  weighted by the number of updates of the device.
+  :param numpy.ndarray base: 1D, all params before the updates, see LayerNetwork.get_flat_params()
+  :param list[numpy.ndarray] nets: 1D like base, the params of every device
+  :param list[int] num_updates: number of updates of every device
+  :param list[int] sizes: size of every param in the flat arrays
+  :param int chunk_size: we work on chunks of whole params of about this size, which fit into the CPU cache
+  :returns the averaged params (1D like base), and a bool array which marks the params without any update
+  :rtype: (numpy.ndarray, numpy.ndarray)
+  """
+  sizes = numpy.array(sizes, dtype="int64")
+  offsets = numpy.concatenate([[0], numpy.cumsum(sizes)])
+  assert offsets[-1] == base.shape[0]
+  num_updates = numpy.array(num_updates, dtype="float64")
+  avg = numpy.array(base, dtype="float32")
+  no_update = numpy.zeros((len(sizes),), dtype="bool")
+  p_start = 0
+  while p_start < len(sizes):
+    p_end = numpy.searchsorted(offsets, offsets[p_start] + chunk_size)
+    p_end = min(max(p_end, p_start + 1), len(sizes))
+    start, end = offsets[p_start], offsets[p_end]
+    chunk_sizes = sizes[p_start:p_end]
+    non_empty = chunk_sizes > 0
+    starts = offsets[p_start:p_end][non_empty] - start
+    base_chunk = base[start:end]
+    changed = numpy.zeros((len(nets), p_end - p_start), dtype="bool")  # (device,param)
+    if len(starts):
+      for i, net in enumerate(nets):
+        changed[i, non_empty] = numpy.logical_or.reduceat(net[start:end] != base_chunk, starts)
+    weights = changed * num_updates[:, None]
+    total = weights.sum(axis=0)
+    weights /= numpy.maximum(total, 1)
+    for i, net in enumerate(nets):
+      if (weights[i] == weights[i, 0]).all():
+        weight = numpy.float32(weights[i, 0])  # common case, the same for all params
+      else:
+        weight = numpy.repeat(weights[i].astype("float32"), chunk_sizes)
+      avg[start:end] += (net[start:end] - base_chunk) * weight
+    no_update[p_start:p_end] = total == 0
+    p_start = p_end
+  return avg, no_update
@@ -11,7 +11,7 @@ import signal
 from threading import Thread
 from SprintDataset import SprintDataset
 import TaskSystem
-from TaskSystem import Pickler, Unpickler, numpy_copy_and_set_unused
+from TaskSystem import msg_load, numpy_copy_and_set_unused
 from Util import eval_shell_str, interrupt_main
 from Log import log
 
@@ -25,18 +25,24 @@ class ExternSprintDataset(SprintDataset):
   This class is like SprintDataset, except that we will start an external Sprint instance ourselves
   which will forward the data to us over a pipe.
   The Sprint subprocess will use SprintExternInterface to communicate with us.
+  We ask the child for the message protocol (see TaskSystem.MsgProtocols) via the config string.
+  A child which supports it tells us in its "init" message which one it uses for all further messages.
   """
 
-  def __init__(self, sprintTrainerExecPath, sprintConfigStr, partitionEpoch=1, *args, **kwargs):
+  def __init__(self, sprintTrainerExecPath, sprintConfigStr, partitionEpoch=1, msgProtocol="binary", *args, **kwargs):
     """
     :type sprintTrainerExecPath: str
     :type sprintConfigStr: str
+    :param str msgProtocol: "binary" or "pickle". see TaskSystem.MsgProtocols
     """
     super(ExternSprintDataset, self).__init__(*args, **kwargs)
     self.add_data_thread_id = None
     self.sprintTrainerExecPath = sprintTrainerExecPath
     self.sprintConfig = sprintConfigStr
     self.partitionEpoch = partitionEpoch
+    assert msgProtocol in TaskSystem.MsgProtocols
+    self.requestedMsgProtocol = msgProtocol
+    self.msg_protocol = "pickle"  # until negotiated in _start_child
     self._num_seqs = None
     self.child_pid = None
     self.parent_pid = os.getpid()
@@ -97,11 +103,16 @@ class ExternSprintDataset(SprintDataset):
     self.pipe_c2p[1].close()
     self.pipe_p2c[0].close()
     self.child_pid = pid
+    self.msg_protocol = "pickle"
 
     try:
-      initSignal, (inputDim, outputDim, num_segments) = self._read_next_raw()
+      initSignal, initArgs = self._read_next_raw()
       assert initSignal == "init"
+      inputDim, outputDim, num_segments = initArgs[:3]
       assert isinstance(inputDim, int) and isinstance(outputDim, int)
+      if len(initArgs) >= 4:  # newer SprintExternInterface tells us the negotiated protocol
+        assert initArgs[3] in TaskSystem.MsgProtocols
+        self.msg_protocol = initArgs[3]
       # Ignore num_segments. It can be totally different than the real number of sequences.
       self.setDimensions(inputDim, outputDim)
     except Exception:
@@ -127,6 +138,7 @@ class ExternSprintDataset(SprintDataset):
   def _build_sprint_args(self):
     config_str = "action:ExternSprintDataset,c2p_fd:%i,p2c_fd:%i" % (
       self.pipe_c2p[1].fileno(), self.pipe_p2c[0].fileno())
+    config_str += ",msgProtocol:%s" % self.requestedMsgProtocol
     if TaskSystem.SharedMemNumpyConfig["enabled"]:
       config_str += ",EnableAutoNumpySharedMemPickling:True"
     epoch = self.crnnEpoch or 1
@@ -159,7 +171,7 @@ class ExternSprintDataset(SprintDataset):
     return args
 
   def _read_next_raw(self):
-    dataType, args = Unpickler(self.pipe_c2p[0]).load()
+    dataType, args = msg_load(self.pipe_c2p[0], protocol=self.msg_protocol)
     return dataType, args
 
   def _join_child(self, wait=True, expected_exit_status=None):
@@ -1,6 +1,7 @@
 
 from Dataset import Dataset, DatasetSeq, convert_data_dims
 from Util import class_idx_seq_to_1_of_k
+from collections import deque
 import numpy
 
 
@@ -33,22 +34,17 @@ class GeneratingDataset(Dataset):
     self._num_timesteps = 0
     self.reached_final_seq = False
     self.expected_load_seq_start = 0
-    self.added_data = []; " :type: list[DatasetSeq] "
+    self.added_data = deque(); " :type: deque[DatasetSeq] "  # ordered by seq_idx
+    self._added_data_by_seq_idx = {}; " :type: dict[int,DatasetSeq] "  # for fast lookup in _get_seq()
     return True
 
   def _cleanup_old_seqs(self, seq_idx_end):
-    i = 0
-    while i < len(self.added_data):
-      if self.added_data[i].seq_idx >= seq_idx_end:
-        break
-      i += 1
-    del self.added_data[:i]
+    while self.added_data and self.added_data[0].seq_idx < seq_idx_end:
+      seq = self.added_data.popleft()
+      del self._added_data_by_seq_idx[seq.seq_idx]
 
   def _get_seq(self, seq_idx):
-    for data in self.added_data:
-      if data.seq_idx == seq_idx:
-        return data
-    return None
+    return self._added_data_by_seq_idx.get(seq_idx)
 
   def is_cached(self, start, end):
     # Always False, to force that we call self._load_seqs().
@@ -76,7 +72,9 @@ class GeneratingDataset(Dataset):
       self.reached_final_seq = True
     seqs = [self.generate_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
     self._num_timesteps += sum([seq.num_frames for seq in seqs])
-    self.added_data += seqs
+    for seq in seqs:
+      self.added_data.append(seq)
+      self._added_data_by_seq_idx[seq.seq_idx] = seq
 
   def generate_seq(self, seq_idx):
     """
@@ -1,5 +1,9 @@
 
+import os
 import sys
+import shutil
+import tempfile
+from array import array
 from Dataset import DatasetSeq
 from CachedDataset2 import CachedDataset2
 import gzip
@@ -20,6 +24,7 @@ class LmDataset(CachedDataset2):
                log_skipped_seqs=False, **kwargs):
     """
     :param str corpus_file: Bliss XML or line-based txt. optionally can be gzip.
+      Or the prefix of a pre-tokenized corpus, see TokenCorpus and create_token_corpus().
     :param dict | None phone_info: if you want to get phone seqs, dict with lexicon_file etc. see PhoneSeqGenerator
     :param str | None orth_symbols_file: list of orthography symbols, if you want to get orth symbol seqs
     :param str | None orth_replace_map_file: JSON file with replacement dict for orth symbols
@@ -28,7 +33,21 @@ class LmDataset(CachedDataset2):
     """
     super(LmDataset, self).__init__(**kwargs)
 
-    if orth_symbols_file:
+    token_corpus = None
+    if TokenCorpus.exists(corpus_file):
+      assert not phone_info, "a pre-tokenized corpus contains orth symbol seqs"
+      assert not orth_replace_map_file, "already applied in the pre-tokenized corpus"
+      token_corpus = TokenCorpus(corpus_file)
+      if orth_symbols_file:
+        assert open(orth_symbols_file).read().splitlines() == token_corpus.symbols, (
+          "orth symbols of the pre-tokenized corpus %r differ from %r" % (corpus_file, orth_symbols_file))
+
+    if token_corpus:
+      self.orth_symbols_map = None
+      self.orth_symbols = token_corpus.symbols
+      self.labels["data"] = token_corpus.symbols
+      self.seq_gen = None
+    elif orth_symbols_file:
       assert not phone_info
       orth_symbols = open(orth_symbols_file).read().splitlines()
       self.orth_symbols_map = {sym: i for (i, sym) in enumerate(orth_symbols)}
@@ -62,13 +81,17 @@ class LmDataset(CachedDataset2):
     for i in range(add_random_phone_seqs):
       self.num_outputs["random%i" % i] = self.num_outputs["data"]
 
-    if _is_bliss(corpus_file):
-      iter_f = _iter_bliss
+    if token_corpus:
+      print >> log.v4, "LmDataset, using pre-tokenized corpus", corpus_file
+      self.orths = token_corpus; " :type: list[str]|TokenCorpus "
     else:
-      iter_f = _iter_txt
-    self.orths = []
-    print >> log.v4, "LmDataset, loading file", corpus_file
-    iter_f(corpus_file, self.orths.append)
+      if _is_bliss(corpus_file):
+        iter_f = _iter_bliss
+      else:
+        iter_f = _iter_txt
+      self.orths = []
+      print >> log.v4, "LmDataset, loading file", corpus_file
+      iter_f(corpus_file, self.orths.append)
     # It's only estimated because we might filter some out or so.
     self._estimated_num_seqs = len(self.orths) // self.partition_epoch
 
@@ -86,7 +109,7 @@ class LmDataset(CachedDataset2):
                        len(self.orths) * (epoch % self.partition_epoch) // self.partition_epoch:
                        len(self.orths) * ((epoch % self.partition_epoch) + 1) // self.partition_epoch]
     self.seq_order = self.get_seq_order_for_epoch(
-      epoch=epoch, num_seqs=len(self.orths_epoch), get_seq_len=lambda i: len(self.orths_epoch[i]))
+      epoch=epoch, num_seqs=len(self.orths_epoch), get_seq_len=lambda i: self._get_orth_len(self.orths_epoch[i]))
     self.next_orth_idx = 0
     self.next_seq_idx = 0
     self.num_skipped = 0
@@ -95,6 +118,19 @@ class LmDataset(CachedDataset2):
       self.seq_gen.random_seed(epoch)
     return True
 
+  def _get_orth_len(self, orth):
+    """
+    :param str|numpy.ndarray orth: entry of self.orths
+    :return: seq len for the seq ordering. the num of orth symbols if we have them,
+      thus the text corpus and the TokenCorpus give the same order.
+    :rtype: int
+    """
+    if isinstance(orth, numpy.ndarray):  # from TokenCorpus
+      return orth.shape[0]
+    if self.orth_symbols:
+      return len(_orth_to_symbols(orth, self.orth_replace_map))
+    return len(orth)
+
   def _collect_single_seq(self, seq_idx):
     """
     :type seq_idx: int
@@ -108,9 +144,13 @@ class LmDataset(CachedDataset2):
       assert self.next_seq_idx == seq_idx, "We expect that we iterate through all seqs."
       orth = self.orths_epoch[self.seq_order[self.next_orth_idx]]
       self.next_orth_idx += 1
-      if orth == "</s>": continue  # special sentence end symbol. empty seq, ignore.
 
-      if self.seq_gen:
+      if isinstance(orth, numpy.ndarray):  # from TokenCorpus
+        data = numpy.array(orth, dtype=self.dtype)
+
+      elif orth == "</s>": continue  # special sentence end symbol. empty seq, ignore.
+
+      elif self.seq_gen:
         try:
           phones = self.seq_gen.generate_seq(orth)
         except KeyError as e:
@@ -122,14 +162,7 @@ class LmDataset(CachedDataset2):
         data = self.seq_gen.seq_to_class_idxs(phones, dtype=self.dtype)
 
       elif self.orth_symbols:
-        orth_syms = parse_orthography(orth)
-        orth_syms = sum([self.orth_replace_map.get(s, [s]) for s in orth_syms], [])
-        i = 0
-        while i < len(orth_syms) - 1:
-          if orth_syms[i:i+2] == [" ", " "]:
-            orth_syms[i:i+2] = [" "]  # collapse two spaces
-          else:
-            i += 1
+        orth_syms = _orth_to_symbols(orth, self.orth_replace_map)
         try:
           data = numpy.array(map(self.orth_symbols_map.__getitem__, orth_syms), dtype=self.dtype)
         except KeyError as e:
@@ -152,6 +185,143 @@ class LmDataset(CachedDataset2):
       return DatasetSeq(seq_idx=seq_idx, features=data, targets=targets)
 
 
+def _orth_to_symbols(orth, orth_replace_map):
+  """
+  :param str orth:
+  :param dict[str,list[str]] orth_replace_map:
+  :rtype: list[str]
+  """
+  orth_syms = parse_orthography(orth)
+  orth_syms = sum([orth_replace_map.get(s, [s]) for s in orth_syms], [])
+  i = 0
+  while i < len(orth_syms) - 1:
+    if orth_syms[i:i+2] == [" ", " "]:
+      orth_syms[i:i+2] = [" "]  # collapse two spaces
+    else:
+      i += 1
+  return orth_syms
+
+
+class TokenCorpus:
+  """
+  Pre-tokenized corpus for LmDataset, i.e. the orth symbol idx seqs, created by create_token_corpus().
+  All seqs are stored in one flat array, and an offset array gives the start of every seq.
+  These are .npy files which we memory-map, thus loading is instant,
+  only the accessed parts are read, and several processes share the pages.
+  Files:
+    <prefix>.tokens.npy: 1D, all seqs concatenated
+    <prefix>.offsets.npy: 1D int64, num_seqs + 1 entries
+    <prefix>.symbols.txt: the orth symbols, like orth_symbols_file
+  Behaves like a list of the seqs, also slicing is supported.
+  """
+
+  def __init__(self, prefix, _start=0, _end=None, _arrays=None):
+    """
+    :param str prefix: see above
+    """
+    self.prefix = prefix
+    if _arrays:
+      self.tokens, self.offsets, self.symbols = _arrays
+    else:
+      self.tokens = numpy.load(prefix + ".tokens.npy", mmap_mode="r")
+      self.offsets = numpy.load(prefix + ".offsets.npy", mmap_mode="r")
+      self.symbols = open(prefix + ".symbols.txt").read().splitlines()
+    self.start = _start
+    self.end = (self.offsets.shape[0] - 1) if _end is None else _end
+
+  @classmethod
+  def exists(cls, prefix):
+    """
+    :param str prefix:
+    :rtype: bool
+    """
+    return os.path.exists(prefix + ".offsets.npy")
+
+  def __len__(self):
+    return self.end - self.start
+
+  def __getitem__(self, item):
+    """
+    :param int|slice item:
+    :return: token idx seq (read-only view), or TokenCorpus for a slice
+    :rtype: numpy.ndarray|TokenCorpus
+    """
+    if isinstance(item, slice):
+      start, end, step = item.indices(len(self))
+      assert step == 1
+      return TokenCorpus(self.prefix, _start=self.start + start, _end=self.start + max(start, end),
+                         _arrays=(self.tokens, self.offsets, self.symbols))
+    if item < 0:
+      item += len(self)
+    if not 0 <= item < len(self):
+      raise IndexError("TokenCorpus index %i out of range" % item)
+    seq_idx = self.start + item
+    return self.tokens[self.offsets[seq_idx]:self.offsets[seq_idx + 1]]
+
+
+def create_token_corpus(corpus_file, orth_symbols_file, output_prefix, orth_replace_map_file=None,
+                        log_skipped_seqs=False):
+  """
+  Converts a corpus into the TokenCorpus format, in the same way as LmDataset does with orth_symbols_file.
+  Seqs with unknown orth symbols are skipped.
+
+  :param str corpus_file: Bliss XML or line-based txt. optionally can be gzip
+  :param str orth_symbols_file: list of orthography symbols
+  :param str output_prefix: see TokenCorpus
+  :param str|None orth_replace_map_file: JSON file with replacement dict for orth symbols
+  :param bool log_skipped_seqs: log skipped seqs
+  :return: num seqs, num skipped seqs
+  :rtype: (int,int)
+  """
+  orth_symbols = open(orth_symbols_file).read().splitlines()
+  orth_symbols_map = {sym: i for (i, sym) in enumerate(orth_symbols)}
+  dtype = numpy.dtype("int8" if len(orth_symbols) <= 256 else "int32")  # same as in LmDataset
+  orth_replace_map = {}
+  if orth_replace_map_file:
+    orth_replace_map = {key: parse_orthography_into_symbols(v)
+                        for (key, v) in load_json(filename=orth_replace_map_file).items()}
+  seq_lens = array("i")
+  num_skipped = [0]
+  tokens_tmp_filename = output_prefix + ".tokens.tmp"
+  tokens_tmp_file = open(tokens_tmp_filename, "wb")
+
+  def callback(orth):
+    if orth == "</s>": return  # see LmDataset
+    orth_syms = _orth_to_symbols(orth, orth_replace_map)
+    try:
+      data = numpy.array(map(orth_symbols_map.__getitem__, orth_syms), dtype=dtype)
+    except KeyError as e:
+      if log_skipped_seqs:
+        print >> log.v4, "create_token_corpus: skipping sequence %r because of missing orth symbol: %s" % (
+                         "".join(orth_syms), e)
+      num_skipped[0] += 1
+      return
+    tokens_tmp_file.write(data.tobytes())
+    seq_lens.append(data.shape[0])
+
+  print >> log.v4, "create_token_corpus, loading file", corpus_file
+  if _is_bliss(corpus_file):
+    _iter_bliss(corpus_file, callback)
+  else:
+    _iter_txt(corpus_file, callback)
+  tokens_tmp_file.close()
+
+  offsets = numpy.zeros((len(seq_lens) + 1,), dtype="int64")
+  if seq_lens:
+    numpy.cumsum(numpy.frombuffer(seq_lens, dtype="int32"), dtype="int64", out=offsets[1:])
+  with open(output_prefix + ".tokens.npy", "wb") as f:
+    numpy.lib.format.write_array_header_1_0(
+      f, {"descr": numpy.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (int(offsets[-1]),)})
+    with open(tokens_tmp_filename, "rb") as tokens_tmp_file:
+      shutil.copyfileobj(tokens_tmp_file, f)
+  os.remove(tokens_tmp_filename)
+  numpy.save(output_prefix + ".offsets.npy", offsets)
+  shutil.copyfile(orth_symbols_file, output_prefix + ".symbols.txt")
+  print >> log.v4, "create_token_corpus: wrote %s.*, %i seqs, %i tokens, %i skipped" % (
+                   output_prefix, len(seq_lens), offsets[-1], num_skipped[0])
+  return len(seq_lens), num_skipped[0]
+
+
 def _is_bliss(filename):
   try:
     corpus_file = open(filename, 'rb')
@@ -259,15 +429,100 @@ class AllophoneState:
     return not self == other
 
 
+def _cached_parse(filename, cache_dir, kind, parse):
+  """
+  Parsing big lexicons etc. can take minutes. Thus we store the parsed result in a binary (pickle) cache file,
+  keyed by the path, size and mtime of the source file, and load that on later runs.
+  Unpickling can execute arbitrary code, thus we only use a cache dir which is owned by us
+  and not writable by others. We create it with mode 0700.
+
+  :param str filename: the source file
+  :param str|None cache_dir: where to store the cache files, e.g. "~/.cache/returnn". None -> no caching
+  :param str kind: e.g. "lexicon". part of the cache filename
+  :param ()->dict[str] parse: parses the source file. the result must be picklable
+  :rtype: dict[str]
+  """
+  if not cache_dir:
+    return parse()
+  import cPickle
+  import hashlib
+  st = os.stat(filename)
+  key = hashlib.sha1(repr((os.path.abspath(filename), st.st_size, st.st_mtime, _CacheVersion))).hexdigest()
+  cache_dir = os.path.expanduser(cache_dir)
+  cache_filename = os.path.join(cache_dir, "%s-%s.pkl" % (kind, key))
+  if os.path.isdir(cache_dir) and not _is_private_dir(cache_dir):
+    print >> log.v3, "Not using %s cache dir %s, it must be owned by us and not writable by others." % (
+      kind, cache_dir)
+    return parse()
+  if os.path.exists(cache_filename):
+    try:
+      with open(cache_filename, "rb") as f:
+        res = cPickle.load(f)
+      print >> log.v4, "Loaded %s %s from cache %s" % (kind, filename, cache_filename)
+      return res
+    except Exception as e:
+      print >> log.v3, "Cannot load %s cache %s: %s. Parsing again." % (kind, cache_filename, e)
+  res = parse()
+  try:
+    if not os.path.isdir(cache_dir):
+      try:
+        os.makedirs(cache_dir, 0o700)
+      except OSError:  # maybe created by another process in the meantime
+        if not os.path.isdir(cache_dir):
+          raise
+    # Write to a temp file first and then rename (atomic), because several processes might do this at the same time.
+    fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, prefix=kind, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        cPickle.dump(res, f, cPickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_filename, cache_filename)
+    except Exception:
+      os.remove(tmp_filename)
+      raise
+  except Exception as e:
+    print >> log.v3, "Cannot store %s cache %s: %s" % (kind, cache_filename, e)
+  else:
+    print >> log.v4, "Stored %s cache %s" % (kind, cache_filename)
+  return res
+
+
+def _is_private_dir(path):
+  """
+  :param str path: existing directory
+  :return: whether it is owned by the current user and not writable by group or others
+  :rtype: bool
+  """
+  st = os.stat(path)
+  return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+_CacheVersion = 1  # increase when the parsed format of Lexicon or StateTying changes
+
+
 class Lexicon:
 
-  def __init__(self, filename):
+  def __init__(self, filename, cache_dir=None):
+    """
+    :param str filename: lexicon XML file, optionally gzipped
+    :param str|None cache_dir: for the parsed lexicon, see _cached_parse()
+    """
+    res = _cached_parse(filename, cache_dir=cache_dir, kind="lexicon", parse=lambda: self._parse(filename))
+    self.phonemes = res["phonemes"]; " :type: dict[str,dict[str]] "
+    self.lemmas = res["lemmas"]; " :type: dict[str,dict[str]] "
+
+  @staticmethod
+  def _parse(filename):
+    """
+    :param str filename: lexicon XML file
+    :return: dict with phonemes, lemmas
+    :rtype: dict[str,dict[str,dict[str]]]
+    """
     print >> log.v4, "Loading lexicon", filename
     lex_file = open(filename, 'rb')
     if filename.endswith(".gz"):
       lex_file = gzip.GzipFile(fileobj=lex_file)
-    self.phonemes = {}
-    self.lemmas = {}
+    phonemes = {}
+    lemmas = {}
 
     context = iter(etree.iterparse(lex_file, events=('start', 'end')))
     _, root = next(context)  # get root element
@@ -284,39 +539,57 @@ class Lexicon:
             variation = elem.find("variation").text.strip()
           else:
             variation = "context"  # default
-          assert symbol not in self.phonemes
+          assert symbol not in phonemes
           assert variation in ["context", "none"]
-          self.phonemes[symbol] = {"index": len(self.phonemes), "symbol": symbol, "variation": variation}
+          phonemes[symbol] = {"index": len(phonemes), "symbol": symbol, "variation": variation}
           root.clear()  # free memory
         elif elem.tag == "phoneme-inventory":
-          print >> log.v4, "Finished phoneme inventory, %i phonemes" % len(self.phonemes)
+          print >> log.v4, "Finished phoneme inventory, %i phonemes" % len(phonemes)
           root.clear()  # free memory
         elif elem.tag == "lemma":
           for orth_elem in elem.findall("orth"):
             orth = (orth_elem.text or "").strip()
             phons = [{"phon": e.text.strip(), "score": float(e.attrib.get("score", 0))} for e in elem.findall("phon")]
-            assert orth not in self.lemmas
-            self.lemmas[orth] = {"orth": orth, "phons": phons}
+            assert orth not in lemmas
+            lemmas[orth] = {"orth": orth, "phons": phons}
           root.clear()  # free memory
-    print >> log.v4, "Finished whole lexicon, %i lemmas" % len(self.lemmas)
+    print >> log.v4, "Finished whole lexicon, %i lemmas" % len(lemmas)
+    return {"phonemes": phonemes, "lemmas": lemmas}
 
 
 class StateTying:
-  def __init__(self, state_tying_file):
-    self.allo_map = {}  # allophone-state-str -> class-idx
-    self.class_map = {}  # class-idx -> set(allophone-state-str)
+  def __init__(self, state_tying_file, cache_dir=None):
+    """
+    :param str state_tying_file: text file, every line is "<allophone-state-str> <class-idx>"
+    :param str|None cache_dir: for the parsed state tying, see _cached_parse()
+    """
+    res = _cached_parse(state_tying_file, cache_dir=cache_dir, kind="state-tying",
+                        parse=lambda: self._parse(state_tying_file))
+    self.allo_map = res["allo_map"]  # allophone-state-str -> class-idx
+    self.class_map = res["class_map"]  # class-idx -> set(allophone-state-str)
+    self.num_classes = len(self.class_map)
+
+  @staticmethod
+  def _parse(state_tying_file):
+    """
+    :param str state_tying_file:
+    :return: dict with allo_map, class_map
+    :rtype: dict[str,dict]
+    """
+    allo_map = {}
+    class_map = {}
     ls = open(state_tying_file).read().splitlines()
     for l in ls:
       allo_str, class_idx_str = l.split()
       class_idx = int(class_idx_str)
-      assert allo_str not in self.allo_map
-      self.allo_map[allo_str] = class_idx
-      self.class_map.setdefault(class_idx, set()).add(allo_str)
-    min_class_idx = min(self.class_map.keys())
-    max_class_idx = max(self.class_map.keys())
+      assert allo_str not in allo_map
+      allo_map[allo_str] = class_idx
+      class_map.setdefault(class_idx, set()).add(allo_str)
+    min_class_idx = min(class_map.keys())
+    max_class_idx = max(class_map.keys())
     assert min_class_idx == 0
-    assert max_class_idx == len(self.class_map) - 1, "some classes are not represented"
-    self.num_classes = len(self.class_map)
+    assert max_class_idx == len(class_map) - 1, "some classes are not represented"
+    return {"allo_map": allo_map, "class_map": class_map}
 
 
 class PhoneSeqGenerator:
@@ -324,7 +597,8 @@ class PhoneSeqGenerator:
                allo_num_states=3, allo_context_len=1,
                state_tying_file=None,
                add_silence_beginning=0.1, add_silence_between_words=0.1, add_silence_end=0.1,
-               repetition=0.9, silence_repetition=0.95):
+               repetition=0.9, silence_repetition=0.95,
+               cache_dir=None):
     """
     :param str lexicon_file: lexicon XML file
     :param int allo_num_states: how much HMM states per allophone (all but silence)
@@ -335,8 +609,10 @@ class PhoneSeqGenerator:
     :param float add_silence_end: prob of adding silence at end
     :param float repetition: prob of repeating an allophone
     :param float silence_repetition: prob of repeating the silence allophone
+    :param str|None cache_dir: where we cache the parsed lexicon and state tying, e.g. "~/.cache/returnn".
+      None (default) -> no caching
     """
-    self.lexicon = Lexicon(lexicon_file)
+    self.lexicon = Lexicon(lexicon_file, cache_dir=cache_dir)
     self.phonemes = sorted(self.lexicon.phonemes.keys(), key=lambda s: self.lexicon.phonemes[s]["index"])
     self.rnd = Random(0)
     self.allo_num_states = allo_num_states
@@ -349,7 +625,7 @@ class PhoneSeqGenerator:
     self.si_lemma = self.lexicon.lemmas["[SILENCE]"]
     self.si_phone = self.si_lemma["phons"][0]["phon"]
     if state_tying_file:
-      self.state_tying = StateTying(state_tying_file)
+      self.state_tying = StateTying(state_tying_file, cache_dir=cache_dir)
     else:
       self.state_tying = None
 
@@ -19,6 +19,7 @@ class MetaDataset(CachedDataset2):
                datasets,
                data_map, data_dims,
                data_dtypes=None,
+               load_seqs_num_threads=1,
                window=1, **kwargs):
     """
     :param str seq_list_file: filename. line-separated
@@ -28,9 +29,11 @@ class MetaDataset(CachedDataset2):
       Should contain 'data' as key. Also defines the target-list, which is all except 'data'.
     :param dict[str,(int,int)] data_dims: self-data-key -> data-dimension, len(shape) (1 ==> sparse repr).
     :param dict[str,str] data_dtypes: self-data-key -> dtype. automatic if not specified
+    :param int load_seqs_num_threads: if > 1, the sub-datasets load their seqs concurrently in that many threads
     """
     assert window == 1  # not implemented
     super(MetaDataset, self).__init__(**kwargs)
+    self.load_seqs_num_threads = load_seqs_num_threads
     assert self.shuffle_frames_of_nseqs == 0  # not implemented. anyway only for non-recurrent nets
 
     self.seq_list_original = open(seq_list_file).read().splitlines()
@@ -41,7 +44,7 @@ class MetaDataset(CachedDataset2):
     self.dataset_keys = set([m[0] for m in self.data_map.values()]); ":type: set[str]"
     self.data_keys = set(self.data_map.keys()); ":type: set[str]"
     assert "data" in self.data_keys
-    self.target_list = sorted(self.data_keys - ["data"])
+    self.target_list = sorted(self.data_keys - {"data"})
 
     data_dims = convert_data_dims(data_dims)
     self.data_dims = data_dims
@@ -72,6 +75,7 @@ class MetaDataset(CachedDataset2):
   def init_seq_order(self, epoch=None, seq_list=None):
     need_reinit = self.epoch is None or self.epoch != epoch
     super(MetaDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
+    self._num_seqs = len(seq_list) if seq_list else len(self.seq_list_original)  # reset by CachedDataset2
     if not need_reinit:
       return False
 
@@ -90,8 +94,9 @@ class MetaDataset(CachedDataset2):
     return True
 
   def _load_seqs(self, start, end):
+    end = min(end, self.num_seqs)  # end can be more than num_seqs, see CachedDataset2._load_seqs()
+    _load_sub_datasets(self, [(dataset, start, end) for dataset in self.datasets.values()])
     for dataset in self.datasets.values():
-      dataset.load_seqs(start, end)
       for seq_idx in range(start, end):
         self._check_dataset_seq(dataset, seq_idx)
     super(MetaDataset, self)._load_seqs(start=start, end=end)
@@ -364,6 +369,7 @@ class CombinedDataset(CachedDataset2):
                datasets,
                data_map, data_dims,
                data_dtypes=None,
+               load_seqs_num_threads=1,
                window=1, **kwargs):
     """
     :param dict[str,dict[str]] datasets: dataset-key -> dataset-kwargs. including keyword 'class' and maybe 'files'
@@ -371,9 +377,11 @@ class CombinedDataset(CachedDataset2):
       Should contain 'data' as key. Also defines the target-list, which is all except 'data'.
     :param dict[str,(int,int)] data_dims: self-data-key -> data-dimension, len(shape) (1 ==> sparse repr).
     :param dict[str,str] data_dtypes: self-data-key -> dtype. automatic if not specified
+    :param int load_seqs_num_threads: if > 1, the sub-datasets load their seqs concurrently in that many threads
     """
     assert window == 1  # not implemented
     super(CombinedDataset, self).__init__(**kwargs)
+    self.load_seqs_num_threads = load_seqs_num_threads
     assert self.shuffle_frames_of_nseqs == 0  # not implemented. anyway only for non-recurrent nets
 
     self.rnd = Random(self.epoch)
@@ -446,6 +454,8 @@ class CombinedDataset(CachedDataset2):
     assert seq_list is None, "seq_list not supported for %s" % self.__class__
     need_reinit = self.epoch is None or self.epoch != epoch
     super(CombinedDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
+    if self.know_num_seqs_beforehand:  # reset by CachedDataset2.init_seq_order()
+      self._num_seqs = sum([ds.num_seqs for ds in self.datasets.values()])
     if not need_reinit:
       return False
 
@@ -552,6 +562,7 @@ class CombinedDataset(CachedDataset2):
 #    print self.dataset_seq_idxs,start,end
     requested_seqs = self.dataset_seq_idxs[start:end]
 
+    sub_loads = []
     for i in range(len(self.datasets)):
       dataset = self.datasets[self.dataset_idxs[i]]
       sub_requested_seqs = [s[1] for s in requested_seqs if s[0]==i]
@@ -560,7 +571,8 @@ class CombinedDataset(CachedDataset2):
       if sub_requested_seqs == []:
         continue
       sub_start, sub_end = min(sub_requested_seqs), max(sub_requested_seqs)
-      dataset.load_seqs(sub_start, sub_end+1)
+      sub_loads.append((dataset, sub_start, sub_end+1))
+    _load_sub_datasets(self, sub_loads)
     super(CombinedDataset, self)._load_seqs(start=start, end=end)
 
   def _check_dataset_seq(self, dataset, seq_idx): # TODO this check makes no sense here
@@ -692,7 +704,7 @@ class ChunkShuffleDataset(CachedDataset2):
     tag = "%s.%i" % (original_tag, seq_idx)
     seq = DatasetSeq(seq_idx=seq_idx, features=features, targets=data, seq_tag=tag)
     self._num_timesteps_accumulated += seq.num_frames
-    self.added_data += [seq]
+    self._add_seqs([seq])
 
   def _shuffle(self):
     start_seq_idx = self.added_data[0].seq_idx
@@ -703,12 +715,14 @@ class ChunkShuffleDataset(CachedDataset2):
       start_idx = self.load_seqs_end - start_seq_idx
       assert self.added_data[start_idx].seq_idx == self.load_seqs_end
       start_seq_idx = self.load_seqs_end
-    sublist = self.added_data[start_idx:]
+    sublist = list(self.added_data)[start_idx:]
     self.rng.shuffle(sublist)
     for i, seq in enumerate(sublist):
       seq.seq_idx = i + start_seq_idx
     assert sublist[-1].seq_idx == end_seq_idx
-    self.added_data[start_idx:] = sublist
+    for _ in sublist:
+      self.added_data.pop()
+    self._add_seqs(sublist)
 
   def _add_more(self):
     """
@@ -793,6 +807,53 @@ class ChunkShuffleDataset(CachedDataset2):
     return self.dataset.get_target_list()
 
 
+def _load_sub_datasets(parent, sub_loads):
+  """
+  Calls load_seqs() of the sub-datasets. The sub-datasets are independent of each other,
+  so with parent.load_seqs_num_threads > 1, we do that concurrently in that many threads,
+  and we wait for the slowest one instead of the sum of all.
+  In the sub-datasets, the time is mostly spent in I/O (HDF) or waiting for other processes (Sprint),
+  thus threads are enough.
+  The threads only live during this call. Starting them is cheap compared to the loading,
+  and we don't keep any threads around once the dataset is not used anymore.
+
+  :param MetaDataset|CombinedDataset parent: has load_seqs_num_threads
+  :param list[(Dataset,int,int)] sub_loads: (dataset, start, end) for dataset.load_seqs()
+  """
+  if parent.load_seqs_num_threads <= 1 or len(sub_loads) <= 1:
+    for dataset, start, end in sub_loads:
+      dataset.load_seqs(start, end)
+    return
+  import sys
+  from threading import Thread, Lock
+  lock = Lock()
+  queue = list(reversed(sub_loads))  # we pop() from the end
+  errors = []  # sys.exc_info() of the failed loads
+
+  def worker():
+    while True:
+      with lock:
+        if not queue or errors:
+          return
+        dataset, start, end = queue.pop()
+      try:
+        dataset.load_seqs(start, end)
+      except BaseException:
+        with lock:
+          errors.append(sys.exc_info())
+
+  num_threads = min(parent.load_seqs_num_threads, len(sub_loads))
+  threads = [Thread(target=worker, name="load_seqs") for _ in range(num_threads - 1)]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  worker()  # the current thread takes part as well
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+
+
 def _simple_to_bool(v):
   if v == 0: v = False
   if v == 1: v = True
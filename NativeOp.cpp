@@ -21,6 +21,7 @@
 #define Ndarray_NDIM(x) (x->nd)
 #define Ndarray_DIM_Type int
 #define Ndarray_SIZE CudaNdarray_SIZE
+#define Ndarray_IS_C_CONTIGUOUS CudaNdarray_is_c_contiguous
 // PyObject *CudaNdarray_NewDims(int nd, const inttype * dims), uninitialized
 #define Ndarray_NewDims CudaNdarray_NewDims
 // PyObject * CudaNdarray_Copy(const CudaNdarray * self);
@@ -56,6 +57,8 @@
 #define DEF_KERNEL __global__
 #define start_dev_kernel(kernel, args) \
 	(kernel<<<DIM_GRID,DIM_BLOCK>>>  args);
+// Only differs for the CPU, where it disables the multi-threading.
+#define start_dev_kernel_serial start_dev_kernel
 
 static const char *_cudaGetErrorEnum(cublasStatus_t error) {
 	switch (error) {
@@ -117,6 +120,7 @@ static void _cudaHandleError(cublasStatus_t status, const char *file, int line)
 #define Ndarray_NDIM PyArray_NDIM
 #define Ndarray_DIM_Type npy_intp
 #define Ndarray_SIZE PyArray_SIZE
+#define Ndarray_IS_C_CONTIGUOUS PyArray_IS_C_CONTIGUOUS
 #define Ndarray_NewDims(nd, dims) (PyArray_SimpleNew(nd, dims, NPY_FLOAT32))
 #define Ndarray_Copy(x) (PyArray_FromArray(x, NULL, NPY_ARRAY_OUT_ARRAY | NPY_ARRAY_ENSURECOPY))
 #define Ndarray_memcpy(y, x, size) (memcpy(y, x, size))
@@ -139,9 +143,29 @@ static void _cudaHandleError(cublasStatus_t status, const char *file, int line)
 			&m_, &n_, &k_, alpha, A, &lda_, B, &ldb_, beta, C, &ldc_); \
 	}
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 #define DEF_KERNEL
+
+// With OpenMP (compiled with -fopenmp, see NativeOp.c_compile_args()),
+// we run the kernel in parallel, one CPU thread per CUDA block.
+// All our kernels use grid-stride loops, i.e. every thread handles the indices
+//   threadIdx.x + blockDim.x * blockIdx.x + k * gridDim.x * blockDim.x,
+// so they cover the whole range for any number of threads.
+// Use start_dev_kernel_serial for kernels which are not safe to run in parallel,
+// e.g. if different indices can write to the same output (non-atomic "+=").
+#ifdef _OPENMP
 #define start_dev_kernel(kernel, args) \
+	_Pragma("omp parallel") \
 	{ for(_KernelLoop loop; !loop.finished(); loop.next()) { kernel args; } }
+#else
+#define start_dev_kernel(kernel, args) \
+	{ for(_KernelLoop loop(true); !loop.finished(); loop.next()) { kernel args; } }
+#endif
+#define start_dev_kernel_serial(kernel, args) \
+	{ for(_KernelLoop loop(true); !loop.finished(); loop.next()) { kernel args; } }
 
 struct vec3 {
 	int x; int y; int z;
@@ -152,23 +176,32 @@ vec3 gridDim;
 vec3 blockDim;
 vec3 threadIdx;
 vec3 blockIdx;
+#ifdef _OPENMP
+#pragma omp threadprivate(gridDim, blockDim, threadIdx, blockIdx)
+#endif
 
 struct _KernelLoop {
-	_KernelLoop() {
-		// When we can choose whatever we want here, this loops becomes trivial,
+	_KernelLoop(bool serial = false) {
+		// Every CPU thread is one block with a single thread.
+		// In the serial case, or without OpenMP, this loop becomes trivial,
 		// there will only be one iteration.
 		gridDim.reset(); gridDim.x = 1;
 		blockDim.reset(); blockDim.x = 1;
 		threadIdx.reset();
 		blockIdx.reset();
+#ifdef _OPENMP
+		if(!serial) {
+			gridDim.x = omp_get_num_threads();
+			blockIdx.x = omp_get_thread_num();
+		}
+#endif
 	}
 	bool finished() {
-		// TODO: Also block idx but doesn't matter with the constants above.
 		// TODO: Also y/z but doesn't matter with the constants above.
 		return threadIdx.x >= blockDim.x;
 	}
 	void next() {
-		// TODO: Also blockIdx and y/z, but doesn't matter with the constants above.
+		// TODO: Also y/z, but doesn't matter with the constants above.
 		threadIdx.x++;
 	}
 };
@@ -285,3 +318,16 @@ void affine_global(Ndarray* A, Ndarray* B, /*out*/Ndarray* C,
 	Ndarray_sgemm(transB, transA, B_dim[1], A_dim[0], A_dim[1], &alpha, data_B, ldB,
 		data_A, ldA, &beta, data_C, B_dim[1]);
 }
+
+//C = A*B + beta*C, on raw row-major matrices with row strides (leading dims) ldA, ldB, ldC.
+//A is (rows,k) or (k,rows) if transposed, B is (k,cols) or (cols,k) if transposed, C is (rows,cols).
+//This allows to operate on column blocks of a matrix, e.g. on some of the gates.
+void affine_raw(const float* A, int ldA, bool transpose_A,
+                const float* B, int ldB, bool transpose_B,
+                /*out*/float* C, int ldC,
+                int rows, int cols, int k, float beta = 1.0) {
+	char transA = transpose_A ? 'T' : 'N';
+	char transB = transpose_B ? 'T' : 'N';
+	const float alpha = 1;
+	Ndarray_sgemm(transB, transA, cols, rows, k, &alpha, B, ldB, A, ldA, &beta, C, ldC);
+}
@@ -309,7 +309,7 @@ class NativeOp(theano.Op):
     return self.code_version
 
   def c_support_code(self):
-    base_src = open(os.path.dirname(__file__) + "/NativeOp.cpp").read()
+    base_src = open(os.path.dirname(os.path.abspath(__file__)) + "/NativeOp.cpp").read()
     return "\n\n".join([
       T.blas.blas_header_text(),
       "#define CUDA 0",
@@ -319,8 +319,25 @@ class NativeOp(theano.Op):
   def c_libraries(self):
     return T.blas.ldflags()
 
+  @classmethod
+  def use_openmp(cls):
+    """
+    :return: whether we compile the CPU kernels with OpenMP, i.e. multi-threaded. see NativeOp.cpp.
+      This is controlled by the Theano flag "openmp", and the number of threads by OMP_NUM_THREADS.
+    :rtype: bool
+    """
+    if not theano.config.openmp:
+      return False
+    from theano.gof.op import OpenMPOp
+    if OpenMPOp.gxx_support_openmp is None:
+      OpenMPOp.gxx_support_openmp = OpenMPOp.test_gxx_support()
+    return OpenMPOp.gxx_support_openmp
+
   def c_compile_args(self):
-    return T.blas.ldflags(libs=False, flags=True)
+    args = T.blas.ldflags(libs=False, flags=True)
+    if self.use_openmp():
+      args = args + ["-fopenmp"]
+    return args
 
   def c_lib_dirs(self):
     return T.blas.ldflags(libs=False, libs_dir=True)
@@ -446,8 +463,12 @@ class GpuNativeOp(NativeOp, theano.sandbox.cuda.GpuOp):
         return v
     return gpu_contiguous(v)
 
+  @classmethod
+  def use_openmp(cls):
+    return False
+
   def c_support_code(self):
-    src = open(os.path.dirname(__file__) + "/NativeOp.cpp").read()
+    src = open(os.path.dirname(os.path.abspath(__file__)) + "/NativeOp.cpp").read()
     return "\n\n".join([
       "#define CUDA 1",
       src,
@@ -770,6 +791,409 @@ class LstmGenericBase(NativeOpGenBase):
   code_version = ()
 
 
+class VanillaRnnGenericBase(NativeOpGenBase):
+  """
+  Simple tanh RNN: h_t = tanh(z_t + h_{t-1} * V_h).
+  Where the index is 0, the previous state is kept.
+  inputs:
+    :param Z: input. 3d (time,batch,dim)
+    :param V_h: recurrent matrix. 2d (dim,dim)
+    :param h0: initial state. 2d (batch,dim)
+    :param i: index. 2d (time,batch) -> 0 or 1
+  outputs:
+    :param Y: output. 3d (time,batch,dim)
+  """
+  in_info = (
+    {"name": "Z", "ndim": 3, "shape": (None, None, None), "need_contiguous": True,
+     "want_inplace": 0,
+     "bw_out_var": {"shape": ((2, 0), (2, 1), (0, 0))}},  # see grad_input_map() for indices
+    {"name": "V_h", "ndim": 2, "shape": (None, None), "need_contiguous": True},
+    {"name": "h0", "ndim": 2, "shape": (None, None), "need_contiguous": True},
+    {"name": "i", "ndim": 2, "shape": (None, None), "need_contiguous": True,
+     "gradient": "disconnected"}
+  )
+  out_info = (
+    {"name": "Y", "ndim": 3, "shape": ((0, 0), (0, 1), (0, 2)), "need_contiguous": True,
+     "bw_grad_var": {"want_inplace": "dummy_out"}},
+  )
+
+  @classmethod
+  def grad_input_map(cls, Z, V_h, h0, i,  Y,  DY):
+    return (V_h, h0, i,  Y,  DY)
+
+  @classmethod
+  def map_layer_inputs_to_op(cls, Z, V_h, i):
+    assert Z.ndim == 3
+    assert V_h.ndim == 2
+    assert i.ndim == 2
+    n_batch = Z.shape[1]
+    n_out = V_h.shape[0]
+    h0 = T.zeros((n_batch, n_out), dtype="float32")
+    return Z, V_h, h0, i
+
+  c_extra_support_code = {
+    "vanilla_rnn_kernel": """
+      DEF_KERNEL
+      void vanilla_rnn_kernel(float* data, const float* prev, int n_cells, int n_batch, const float* i) {
+        //data: input + recurrent, overwritten with the output
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          float i_batch = i[idx / n_cells];
+          data[idx] = tanhf(data[idx]) * i_batch + prev[idx] * (1.f - i_batch);
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """,
+    "vanilla_rnn_bwd_kernel": """
+      DEF_KERNEL
+      void vanilla_rnn_bwd_kernel(
+            float* delta, float* epsilon, const float* next_epsilon, const float* Y,
+            int n_cells, int n_batch, const float* i, const float* next_i) {
+        //delta: gradient of the input
+        //epsilon: gradient of the output, plus the recurrent part (later overwritten, see below)
+        //next_epsilon: gradient of the output of the next timestep (or 0 at the right border)
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          int batch_idx = idx / n_cells;
+          float i_batch = i[batch_idx];
+          float eps = epsilon[idx];
+          if(next_epsilon)
+            eps += next_epsilon[idx] * (1.f - next_i[batch_idx]);
+          epsilon[idx] = eps;
+          float y = Y[idx];
+          delta[idx] = (1.f - y * y) * eps * i_batch;
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """,
+    "rnn_keep_state_grad_kernel": """
+      DEF_KERNEL
+      void rnn_keep_state_grad_kernel(float* out, const float* epsilon, int n_cells, int n_batch, const float* i) {
+        //out = epsilon * (1 - i), i.e. the gradient of the initial state where the index is 0
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          out[idx] = epsilon[idx] * (1.f - i[idx / n_cells]);
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """
+  }
+
+  c_fw_code = """
+    // Z*, V_h, h0, i = input_names (*: inplace)
+    // Y = output_names
+    assert(n_inputs == 4);
+    assert(n_outputs == 1);
+    Ndarray* V_h = inputs[1];
+    Ndarray* h0 = inputs[2];
+    Ndarray* i = inputs[3];
+    Ndarray* Y = *outputs[0]; // inplace on Z
+
+    long T = Ndarray_DIMS(i)[0];
+    int n_batch = Ndarray_DIMS(i)[1];
+    int n_cells = Ndarray_DIMS(Y)[2];
+
+    assert(T > 0);
+    for(int x = 0; x < T; ++x) {
+      //Y[x] += Y[x-1]*V_h, or h0*V_h
+      if(x > 0)
+        affine_y_x(x-1, Y,  x, V_h,  x, Y);
+      else
+        affine_y_x(0, h0,  0, V_h,  0, Y);
+
+      start_dev_kernel(vanilla_rnn_kernel, (
+        data_ptr(Y, x),
+        x > 0 ? data_ptr(Y, x - 1) : Ndarray_DEV_DATA(h0),
+        n_cells,
+        n_batch,
+        Ndarray_DEV_DATA(i) + x * n_batch
+      ));
+    }
+  """
+
+  c_bw_code = """
+    // V_h, h0, i,   Y,   DY* = input_names (*: inplace)
+    // DZ, DV_h, Dh0, tmpDY = output_names
+    assert(n_inputs == 5);
+    assert(n_outputs == 4);
+    Ndarray* V_h = inputs[0];
+    Ndarray* h0 = inputs[1];
+    Ndarray* i = inputs[2];
+    Ndarray* Y = inputs[3];
+    Ndarray* DZ = *outputs[0];
+    Ndarray* DV_h = *outputs[1];
+    Ndarray* Dh0 = *outputs[2];
+    Ndarray* tmpDY = *outputs[3]; // (old DY), inplace buffer
+
+    long T = Ndarray_DIMS(i)[0];
+    int n_batch = Ndarray_DIMS(i)[1];
+    int n_cells = Ndarray_DIMS(DZ)[2];
+
+    assert(T > 0);
+    for(int x = T - 1; x >= 0; --x) {
+      // add recurrent
+      bool rightBorder = (x == T - 1);
+      if(!rightBorder)
+        affine_y_x(x+1, DZ,  x, V_h,  x, tmpDY,  false, true);
+
+      start_dev_kernel(vanilla_rnn_bwd_kernel, (
+        data_ptr(DZ, x),
+        data_ptr(tmpDY, x),
+        rightBorder ? 0 : data_ptr(tmpDY, x + 1),
+        data_ptr(Y, x),
+        n_cells,
+        n_batch,
+        Ndarray_DEV_DATA(i) + x * n_batch,
+        rightBorder ? 0 : Ndarray_DEV_DATA(i) + (x + 1) * n_batch
+      ));
+    }
+
+    //Dh0 = DZ[0]*V_h^T + tmpDY[0]*(1-i[0])
+    start_dev_kernel(rnn_keep_state_grad_kernel, (
+      Ndarray_DEV_DATA(Dh0), data_ptr(tmpDY, 0), n_cells, n_batch, Ndarray_DEV_DATA(i)));
+    affine_y_x(0, DZ,  0, V_h,  0, Dh0,  false, true);
+
+    //DV_h = Y[0..end-1]^T * DZ[1..end] + h0^T * DZ[0]
+    affine_global(Y, DZ, DV_h, true, false, 1, 0.0f);
+    affine_y_x(0, h0,  0, DZ,  0, DV_h,  true, false);
+  """
+
+  code_version = ()
+
+
+class GruGenericBase(NativeOpGenBase):
+  """
+  Gated recurrent unit, like NetworkRecurrentLayer.GRU:
+    u_t = sigmoid(z^u_t + h_{t-1} * V^u), r_t = sigmoid(z^r_t + h_{t-1} * V^r),
+    c_t = tanh(z^c_t + (r_t * h_{t-1}) * V_c),
+    h_t = u_t * h_{t-1} + (1 - u_t) * c_t.
+  Where the index is 0, the previous state is kept.
+  inputs:
+    :param Z: {update,reset} gate + candidate input. 3d (time,batch,dim*3)
+    :param V_h: recurrent matrix for the gates. 2d (dim,dim*2)
+    :param V_c: recurrent matrix for the candidate. 2d (dim,dim)
+    :param h0: initial state. 2d (batch,dim)
+    :param i: index. 2d (time,batch) -> 0 or 1
+  outputs:
+    :param Y: output. 3d (time,batch,dim)
+    :param H: gates and candidate. 3d (time,batch,dim*3)
+  """
+  in_info = (
+    {"name": "Z", "ndim": 3, "shape": (None, None, None), "need_contiguous": True,
+     "want_inplace": 1,
+     "bw_out_var": {"shape": ((5, 0), (5, 1), (5, 2))}},  # see grad_input_map() for indices
+    {"name": "V_h", "ndim": 2, "shape": (None, None), "need_contiguous": True},
+    {"name": "V_c", "ndim": 2, "shape": (None, None), "need_contiguous": True},
+    {"name": "h0", "ndim": 2, "shape": (None, None), "need_contiguous": True},
+    {"name": "i", "ndim": 2, "shape": (None, None), "need_contiguous": True,
+     "gradient": "disconnected"}
+  )
+  out_info = (
+    {"name": "Y", "ndim": 3, "shape": ((0, 0), (0, 1), (2, 0)), "need_contiguous": True,
+     "bw_grad_var": {"want_inplace": "dummy_out"}},
+    {"name": "H", "ndim": 3, "shape": ((0, 0), (0, 1), (0, 2)), "need_contiguous": True,
+     "bw_in_var": {"want_inplace": 0}}
+  )
+
+  @classmethod
+  def grad_input_map(cls, Z, V_h, V_c, h0, i,  Y, H,  DY, DH):
+    return (V_h, V_c, h0, i,  Y, H,  DY)
+
+  @classmethod
+  def map_layer_inputs_to_op(cls, Z, V_h, V_c, i):
+    assert Z.ndim == 3
+    assert V_h.ndim == 2
+    assert V_c.ndim == 2
+    assert i.ndim == 2
+    n_batch = Z.shape[1]
+    n_out = V_c.shape[0]
+    h0 = T.zeros((n_batch, n_out), dtype="float32")
+    return Z, V_h, V_c, h0, i
+
+  c_extra_support_code = {
+    "gru_gates_kernel": """
+      DEF_KERNEL
+      void gru_gates_kernel(float* data, const float* prev, float* reset_prev, int n_cells, int n_batch) {
+        //layout:
+        //data[0*n_cells..1*n_cells-1] : update gate
+        //data[1*n_cells..2*n_cells-1] : reset gate
+        //data[2*n_cells..3*n_cells-1] : candidate
+        //repeated for every mini-batch
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          int start = (idx / n_cells) * 3 * n_cells + idx % n_cells;
+          float updGate = 1.f / (1.f + expf(-data[start]));
+          float rstGate = 1.f / (1.f + expf(-data[start + n_cells]));
+          data[start] = updGate;
+          data[start + n_cells] = rstGate;
+          reset_prev[idx] = rstGate * prev[idx];
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """,
+    "gru_output_kernel": """
+      DEF_KERNEL
+      void gru_output_kernel(float* data, const float* prev, float* output, int n_cells, int n_batch, const float* i) {
+        //data: layout as in gru_gates_kernel, gates already calculated
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          int batch_idx = idx / n_cells;
+          int start = batch_idx * 3 * n_cells + idx % n_cells;
+          float i_batch = i[batch_idx];
+          float updGate = data[start];
+          float cand = tanhf(data[start + 2 * n_cells]);
+          data[start + 2 * n_cells] = cand;
+          float h = updGate * prev[idx] + (1.f - updGate) * cand;
+          output[idx] = h * i_batch + prev[idx] * (1.f - i_batch);
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """,
+    "gru_bwd_kernel": """
+      DEF_KERNEL
+      void gru_bwd_kernel(
+            float* delta, const float* prev, const float* epsilon, float* prev_epsilon,
+            int n_cells, int n_batch, const float* i) {
+        //delta: layout as in gru_gates_kernel, initially the gates and the candidate.
+        //  Here we overwrite the update gate and the candidate with their deltas.
+        //epsilon: gradient of the output
+        //prev_epsilon: gradient of the previous output, we add the direct dependencies
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          int batch_idx = idx / n_cells;
+          int start = batch_idx * 3 * n_cells + idx % n_cells;
+          float i_batch = i[batch_idx];
+          float updGate = delta[start];
+          float cand = delta[start + 2 * n_cells];
+          float eps = epsilon[idx] * i_batch;
+          delta[start] = eps * (prev[idx] - cand) * updGate * (1.f - updGate);
+          delta[start + 2 * n_cells] = eps * (1.f - updGate) * (1.f - cand * cand);
+          prev_epsilon[idx] += eps * updGate + epsilon[idx] * (1.f - i_batch);
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """,
+    "gru_bwd_reset_kernel": """
+      DEF_KERNEL
+      void gru_bwd_reset_kernel(
+            float* delta, const float* prev, float* reset_prev_epsilon, float* prev_epsilon,
+            int n_cells, int n_batch) {
+        //delta: see gru_bwd_kernel. Here we overwrite the reset gate with its delta.
+        //reset_prev_epsilon: gradient of reset gate * prev. Overwritten by reset gate * prev.
+        //prev_epsilon: gradient of the previous output, we add the dependency via the reset gate
+        int idx = threadIdx.x + blockDim.x * blockIdx.x;
+        while (idx < n_cells * n_batch) {
+          int start = (idx / n_cells) * 3 * n_cells + idx % n_cells;
+          float rstGate = delta[start + n_cells];
+          float eps = reset_prev_epsilon[idx];
+          delta[start + n_cells] = eps * prev[idx] * rstGate * (1.f - rstGate);
+          prev_epsilon[idx] += eps * rstGate;
+          reset_prev_epsilon[idx] = rstGate * prev[idx];
+          idx += gridDim.x * blockDim.x;
+        }
+      }
+    """
+  }
+
+  c_fw_code = """
+    // Z*, V_h, V_c, h0, i = input_names (*: inplace)
+    // Y, H = output_names
+    assert(n_inputs == 5);
+    assert(n_outputs == 2);
+    Ndarray* V_h = inputs[1];
+    Ndarray* V_c = inputs[2];
+    Ndarray* h0 = inputs[3];
+    Ndarray* i = inputs[4];
+    Ndarray* Y = *outputs[0];
+    Ndarray* H = *outputs[1]; // inplace on Z
+
+    long T = Ndarray_DIMS(i)[0];
+    int n_batch = Ndarray_DIMS(i)[1];
+    int n_cells = Ndarray_DIMS(Y)[2];
+    assert(Ndarray_DIMS(H)[2] == 3 * n_cells); // 2 gates + candidate
+
+    assert(T > 0);
+    for(int x = 0; x < T; ++x) {
+      const float* prev = x > 0 ? data_ptr(Y, x - 1) : Ndarray_DEV_DATA(h0);
+      float* data = data_ptr(H, x);
+
+      //gates: H[x][:,:2*n_cells] += prev*V_h
+      affine_raw(
+        prev, n_cells, false, Ndarray_DEV_DATA(V_h), 2 * n_cells, false,
+        data, 3 * n_cells, n_batch, 2 * n_cells, n_cells);
+      //Y[x] is used as buffer for reset gate * prev
+      start_dev_kernel(gru_gates_kernel, (data, prev, data_ptr(Y, x), n_cells, n_batch));
+
+      //candidate: H[x][:,2*n_cells:] += (reset gate * prev)*V_c
+      affine_raw(
+        data_ptr(Y, x), n_cells, false, Ndarray_DEV_DATA(V_c), n_cells, false,
+        data + 2 * n_cells, 3 * n_cells, n_batch, n_cells, n_cells);
+      start_dev_kernel(gru_output_kernel, (
+        data, prev, data_ptr(Y, x), n_cells, n_batch, Ndarray_DEV_DATA(i) + x * n_batch));
+    }
+  """
+
+  c_bw_code = """
+    // V_h, V_c, h0, i,   Y, H*,   DY* = input_names (*: inplace)
+    // DZ, DV_h, DV_c, Dh0, tmpDY = output_names
+    assert(n_inputs == 7);
+    assert(n_outputs == 5);
+    Ndarray* V_h = inputs[0];
+    Ndarray* V_c = inputs[1];
+    Ndarray* h0 = inputs[2];
+    Ndarray* i = inputs[3];
+    Ndarray* Y = inputs[4];
+    Ndarray* DZ = *outputs[0]; // inplace on H
+    Ndarray* DV_h = *outputs[1];
+    Ndarray* DV_c = *outputs[2];
+    Ndarray* Dh0 = *outputs[3];
+    Ndarray* tmpDY = *outputs[4]; // (old DY), inplace buffer
+
+    long T = Ndarray_DIMS(i)[0];
+    int n_batch = Ndarray_DIMS(i)[1];
+    int n_cells = Ndarray_DIMS(Dh0)[1];
+    assert(Ndarray_DIMS(DZ)[2] == 3 * n_cells); // 2 gates + candidate
+
+    Ndarray_set_zero(DV_h);
+    Ndarray_set_zero(DV_c);
+    Ndarray_set_zero(Dh0);
+
+    assert(T > 0);
+    for(int x = T - 1; x >= 0; --x) {
+      const float* prev = x > 0 ? data_ptr(Y, x - 1) : Ndarray_DEV_DATA(h0);
+      // tmpDY[x-1] has DY[x-1], and we add the recurrent part
+      float* prev_epsilon = x > 0 ? data_ptr(tmpDY, x - 1) : Ndarray_DEV_DATA(Dh0);
+      float* delta = data_ptr(DZ, x);
+      float* epsilon = data_ptr(tmpDY, x);
+
+      start_dev_kernel(gru_bwd_kernel, (
+        delta, prev, epsilon, prev_epsilon, n_cells, n_batch, Ndarray_DEV_DATA(i) + x * n_batch));
+
+      //epsilon is not needed anymore. use it for the gradient of reset gate * prev:
+      //epsilon = delta_candidate*V_c^T
+      affine_raw(
+        delta + 2 * n_cells, 3 * n_cells, false, Ndarray_DEV_DATA(V_c), n_cells, true,
+        epsilon, n_cells, n_batch, n_cells, n_cells, 0.0f);
+      start_dev_kernel(gru_bwd_reset_kernel, (delta, prev, epsilon, prev_epsilon, n_cells, n_batch));
+
+      //DV_c += (reset gate * prev)^T * delta_candidate
+      affine_raw(
+        epsilon, n_cells, true, delta + 2 * n_cells, 3 * n_cells, false,
+        Ndarray_DEV_DATA(DV_c), n_cells, n_cells, n_cells, n_batch);
+      //DV_h += prev^T * delta_gates
+      affine_raw(
+        prev, n_cells, true, delta, 3 * n_cells, false,
+        Ndarray_DEV_DATA(DV_h), 2 * n_cells, n_cells, 2 * n_cells, n_batch);
+      //prev_epsilon += delta_gates*V_h^T
+      affine_raw(
+        delta, 3 * n_cells, false, Ndarray_DEV_DATA(V_h), 2 * n_cells, true,
+        prev_epsilon, n_cells, n_batch, n_cells, 2 * n_cells);
+    }
+  """
+
+  code_version = ()
+
+
 class Chunking(NativeOpGenBase):
   """
   Given an input in 3d (n_time,n_batch,n_dim), we chunk up the time dimension
@@ -1365,7 +1789,7 @@ class SparseToDense(NativeOpGenBase):
     int n_time = Ndarray_DIMS(out_W)[0];
     int n_dim = Ndarray_DIMS(out_W)[2];
 
-    start_dev_kernel(assign_kernel, (
+    start_dev_kernel_serial(assign_kernel, (
       Ndarray_DEV_DATA(out_W),
       Ndarray_DEV_DATA(s0),
       Ndarray_DEV_DATA(s1),
@@ -1673,7 +2097,7 @@ class CrossEntropySoftmaxAndGradientZSparse(NativeOpGenBase):
       Ndarray_DEV_DATA(z), Ndarray_DEV_DATA(out_max_z), Ndarray_DEV_DATA(z_mask),
       n_dim, n_time * n_batch
     ));
-    start_dev_kernel(ce_sm_grad_kernel, (
+    start_dev_kernel_serial(ce_sm_grad_kernel, (
       Ndarray_DEV_DATA(out_ce), Ndarray_DEV_DATA(out_grad_z),
       Ndarray_DEV_DATA(z), Ndarray_DEV_DATA(out_max_z), Ndarray_DEV_DATA(z_mask),
       Ndarray_DEV_DATA(s0), Ndarray_DEV_DATA(s1), Ndarray_DEV_DATA(w), Ndarray_DEV_DATA(s_mask),
@@ -1700,6 +2124,209 @@ def crossentropy_softmax_and_gradient_z_sparse__slow(z, z_mask, y_target_t, y_ta
   return ce, grad_z
 
 
+class FusedUpdateBase(NativeOpGenBase):
+  """
+  Base for the fused optimizer update steps, see the Updater option fused_update.
+  A single op does the update of all given params.
+  For every param, the inputs are the param, its gradient and the optimizer state (state_names),
+  all of the same shape. The last input is the vector of hyper params (hyper_names), which is shared by all params.
+  The outputs are the new param and the new state for every param, and they are inplace on the inputs.
+  Thus every element is read and written once, and there is only one node in the graph for all params.
+  """
+  state_names = None
+  hyper_names = None
+
+  @classmethod
+  def make_op(cls, ndims):
+    """
+    :param list[int] ndims: ndim of every param
+    :rtype: NativeOp
+    """
+    in_info = []
+    out_info = []
+    for k, ndim in enumerate(ndims):
+      param_in_idx = len(in_info)
+      for name in ["param", "grad"] + list(cls.state_names):
+        info = {"name": "%s_%i" % (name, k), "ndim": ndim, "shape": (None,) * ndim, "gradient": "disconnected"}
+        if name == "grad":
+          info["need_contiguous"] = True
+        else:
+          info["want_inplace"] = len(out_info)
+          out_info.append({"name": "%s_new_%i" % (name, k), "ndim": ndim,
+                           "shape": tuple([(param_in_idx, i) for i in range(ndim)])})
+        in_info.append(info)
+    in_info.append({"name": "hyper", "ndim": 1, "shape": (len(cls.hyper_names),), "need_contiguous": True,
+                    "gradient": "disconnected"})
+    return NativeOp(in_info=in_info, out_info=out_info,
+                    c_fw_code=cls.c_fw_code,
+                    c_extra_support_code=cls.c_extra_support_code,
+                    name=cls.__name__)
+
+
+class AdamUpdate(FusedUpdateBase):
+  """
+  Fused Adam update step, see FusedUpdateBase.
+  The learning rate in hyper already includes the bias correction.
+  """
+  state_names = ("m", "v")
+  hyper_names = ("learning_rate", "beta1", "beta2", "offset")
+
+  c_extra_support_code = {
+    "adam_update_kernel": """
+    DEF_KERNEL
+    void adam_update_kernel(long n, float* param, float* grad, float* m, float* v, float* hyper) {
+      float lr = hyper[0], beta1 = hyper[1], beta2 = hyper[2], offset = hyper[3];
+      long idx = threadIdx.x + blockDim.x * blockIdx.x;
+      while(idx < n) {
+        float g = grad[idx];
+        float m_t = beta1 * m[idx] + (1.f - beta1) * g;
+        float v_t = beta2 * v[idx] + (1.f - beta2) * g * g;
+        m[idx] = m_t;
+        v[idx] = v_t;
+        param[idx] -= lr * m_t / (sqrtf(v_t) + offset);
+        idx += gridDim.x * blockDim.x;
+      }
+    }
+    """
+  }
+
+  c_fw_code = """
+    int n_params = n_outputs / 3;
+    assert_cmp(n_inputs, ==, n_params * 4 + 1);
+    Ndarray* hyper = inputs[n_inputs - 1];
+    for(int k = 0; k < n_params; ++k) {
+      Ndarray* param = *outputs[k * 3];
+      Ndarray* grad = inputs[k * 4 + 1];
+      Ndarray* m = *outputs[k * 3 + 1];
+      Ndarray* v = *outputs[k * 3 + 2];
+      if(!Ndarray_IS_C_CONTIGUOUS(param) || !Ndarray_IS_C_CONTIGUOUS(m) || !Ndarray_IS_C_CONTIGUOUS(v)) {
+        PyErr_SetString(PyExc_ValueError, "AdamUpdate: param and state must be C-contiguous");
+        %(fail)s;
+      }
+      start_dev_kernel(adam_update_kernel, (
+        Ndarray_SIZE(param), Ndarray_DEV_DATA(param), Ndarray_DEV_DATA(grad),
+        Ndarray_DEV_DATA(m), Ndarray_DEV_DATA(v), Ndarray_DEV_DATA(hyper)));
+    }
+  """
+
+
+class AdadeltaUpdate(FusedUpdateBase):
+  """
+  Fused Adadelta update step, see FusedUpdateBase.
+  """
+  state_names = ("eg2", "edx2", "dx")
+  hyper_names = ("learning_rate", "decay", "offset")
+
+  c_extra_support_code = {
+    "adadelta_update_kernel": """
+    DEF_KERNEL
+    void adadelta_update_kernel(long n, float* param, float* grad, float* eg2, float* edx2, float* dx, float* hyper) {
+      float lr = hyper[0], decay = hyper[1], offset = hyper[2];
+      long idx = threadIdx.x + blockDim.x * blockIdx.x;
+      while(idx < n) {
+        float g = grad[idx];
+        float eg2_t = decay * eg2[idx] + (1.f - decay) * g * g;
+        float dx_t = -g * sqrtf(edx2[idx] + offset) / sqrtf(eg2_t + offset);
+        eg2[idx] = eg2_t;
+        edx2[idx] = decay * edx2[idx] + (1.f - decay) * dx_t * dx_t;
+        dx[idx] = dx_t;
+        param[idx] += lr * dx_t;
+        idx += gridDim.x * blockDim.x;
+      }
+    }
+    """
+  }
+
+  c_fw_code = """
+    int n_params = n_outputs / 4;
+    assert_cmp(n_inputs, ==, n_params * 5 + 1);
+    Ndarray* hyper = inputs[n_inputs - 1];
+    for(int k = 0; k < n_params; ++k) {
+      Ndarray* param = *outputs[k * 4];
+      Ndarray* grad = inputs[k * 5 + 1];
+      Ndarray* eg2 = *outputs[k * 4 + 1];
+      Ndarray* edx2 = *outputs[k * 4 + 2];
+      Ndarray* dx = *outputs[k * 4 + 3];
+      if(!Ndarray_IS_C_CONTIGUOUS(param) || !Ndarray_IS_C_CONTIGUOUS(eg2) ||
+         !Ndarray_IS_C_CONTIGUOUS(edx2) || !Ndarray_IS_C_CONTIGUOUS(dx)) {
+        PyErr_SetString(PyExc_ValueError, "AdadeltaUpdate: param and state must be C-contiguous");
+        %(fail)s;
+      }
+      start_dev_kernel(adadelta_update_kernel, (
+        Ndarray_SIZE(param), Ndarray_DEV_DATA(param), Ndarray_DEV_DATA(grad),
+        Ndarray_DEV_DATA(eg2), Ndarray_DEV_DATA(edx2), Ndarray_DEV_DATA(dx), Ndarray_DEV_DATA(hyper)));
+    }
+  """
+
+
+class RmspropUpdate(FusedUpdateBase):
+  """
+  Fused RMSProp update step, see FusedUpdateBase.
+  """
+  state_names = ("accumulator",)
+  hyper_names = ("learning_rate", "rho", "epsilon")
+
+  c_extra_support_code = {
+    "rmsprop_update_kernel": """
+    DEF_KERNEL
+    void rmsprop_update_kernel(long n, float* param, float* grad, float* accumulator, float* hyper) {
+      float lr = hyper[0], rho = hyper[1], epsilon = hyper[2];
+      long idx = threadIdx.x + blockDim.x * blockIdx.x;
+      while(idx < n) {
+        float g = grad[idx];
+        float acc = rho * accumulator[idx] + (1.f - rho) * g * g;
+        accumulator[idx] = acc;
+        param[idx] -= lr * g / (sqrtf(acc) + epsilon);
+        idx += gridDim.x * blockDim.x;
+      }
+    }
+    """
+  }
+
+  c_fw_code = """
+    int n_params = n_outputs / 2;
+    assert_cmp(n_inputs, ==, n_params * 3 + 1);
+    Ndarray* hyper = inputs[n_inputs - 1];
+    for(int k = 0; k < n_params; ++k) {
+      Ndarray* param = *outputs[k * 2];
+      Ndarray* grad = inputs[k * 3 + 1];
+      Ndarray* accumulator = *outputs[k * 2 + 1];
+      if(!Ndarray_IS_C_CONTIGUOUS(param) || !Ndarray_IS_C_CONTIGUOUS(accumulator)) {
+        PyErr_SetString(PyExc_ValueError, "RmspropUpdate: param and state must be C-contiguous");
+        %(fail)s;
+      }
+      start_dev_kernel(rmsprop_update_kernel, (
+        Ndarray_SIZE(param), Ndarray_DEV_DATA(param), Ndarray_DEV_DATA(grad),
+        Ndarray_DEV_DATA(accumulator), Ndarray_DEV_DATA(hyper)));
+    }
+  """
+
+
+def fused_update(op_class, params, grads, states, hyper):
+  """
+  :param type op_class: FusedUpdateBase subclass, e.g. AdamUpdate
+  :param list[theano.Variable] params:
+  :param list[theano.Variable] grads: same shapes as params
+  :param list[list[theano.Variable]] states: for every param, the state vars (op_class.state_names)
+  :param list hyper: scalars (op_class.hyper_names)
+  :returns for every param, the new param and the list of new state vars
+  :rtype: list[(theano.Variable, list[theano.Variable])]
+  """
+  assert len(params) == len(grads) == len(states)
+  assert len(hyper) == len(op_class.hyper_names)
+  op = op_class.make_op([p.ndim for p in params])
+  inputs = []
+  for param, grad, state in zip(params, grads, states):
+    assert len(state) == len(op_class.state_names)
+    inputs += [param, grad] + list(state)
+  inputs += [T.stack([T.cast(h, "float32") for h in hyper])]
+  outputs = [T.patternbroadcast(out, param.broadcastable)
+             for out, param in zip(make_var_tuple(op(*inputs)),
+                                   [v for param, state in zip(params, states) for v in [param] + list(state)])]
+  n = 1 + len(op_class.state_names)
+  return [(outputs[i * n], outputs[i * n + 1:(i + 1) * n]) for i in range(len(params))]
+
+
 class FastBaumWelchOp(NativeOpGenBase):
   """
   inputs:
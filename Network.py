@@ -100,6 +100,7 @@ class LayerNetwork(object):
     self.calc_steps = []
     self.base_network = base_network
     self.shared_params_network = shared_params_network
+    self.flat_params = None; " :type: numpy.ndarray | None.  see init_flat_params() "
 
   @classmethod
   def from_config_topology(cls, config, mask=None, **kwargs):
@@ -688,6 +689,81 @@ class LayerNetwork(object):
         params[p_name] = param
     return params
 
+  def init_flat_params(self):
+    """
+    Moves all params (get_all_params_vars()) into one contiguous float32 buffer, self.flat_params,
+    and lets the shared vars use views into it.
+    Then get_flat_params() and set_flat_params() are single bulk operations.
+    This only works for params in host memory. Otherwise we keep the params as they are.
+    """
+    params = self.get_all_params_vars()
+    values = [p.get_value(borrow=True, return_internal_type=True) for p in params]
+    if not all([isinstance(v, numpy.ndarray) and v.dtype == numpy.float32 for v in values]):
+      print >> log.v3, "flat params: not all params are float32 numpy arrays, cannot use flat params"
+      return
+    self.flat_params_shapes = [v.shape for v in values]
+    self.flat_params = numpy.empty((sum([v.size for v in values]),), dtype="float32")
+    self.flat_params_views = self.split_flat_params(self.flat_params)
+    for p, value, view in zip(params, values, self.flat_params_views):
+      view[...] = value
+      p.set_value(view, borrow=True)
+    print >> log.v4, "flat params: %i params in one buffer of %i floats" % (len(params), self.flat_params.size)
+
+  def _attach_flat_params(self, copy):
+    """
+    Theano functions or set_value() can replace the value of a shared var by a new array
+    instead of writing into its view of self.flat_params. Point such shared vars back to their view.
+    :param bool copy: whether to copy the current value into the buffer
+    """
+    for p, view in zip(self.get_all_params_vars(), self.flat_params_views):
+      value = p.get_value(borrow=True, return_internal_type=True)
+      if value.ctypes.data == view.ctypes.data:
+        continue
+      if copy:
+        view[...] = value
+      p.set_value(view, borrow=True)
+
+  def split_flat_params(self, flat):
+    """
+    :param numpy.ndarray flat: 1D, e.g. from get_flat_params()
+    :returns views into flat, one for every param in get_all_params_vars(), in the shape of the param
+    :rtype: list[numpy.ndarray]
+    """
+    if self.flat_params is not None:
+      shapes = self.flat_params_shapes
+    else:
+      shapes = [p.get_value(borrow=True, return_internal_type=True).shape for p in self.get_all_params_vars()]
+    offsets = numpy.cumsum([0] + [int(numpy.prod(shape)) for shape in shapes])
+    assert flat.shape == (offsets[-1],), "flat params size mismatch, expected %i, got %s" % (offsets[-1], flat.shape)
+    return [flat[start:end].reshape(shape) for start, end, shape in zip(offsets[:-1], offsets[1:], shapes)]
+
+  def get_flat_params(self):
+    """
+    :returns all params (get_all_params_vars()), concatenated as a flat float32 array.
+      With init_flat_params(), this is self.flat_params itself, i.e. no copy. Otherwise it is a new array.
+    :rtype: numpy.ndarray
+    """
+    if self.flat_params is not None:
+      self._attach_flat_params(copy=True)
+      return self.flat_params
+    values = [numpy.asarray(p.get_value(), dtype="float32").ravel() for p in self.get_all_params_vars()]
+    if not values:
+      return numpy.zeros((0,), dtype="float32")
+    return numpy.concatenate(values)
+
+  def set_flat_params(self, flat):
+    """
+    :param numpy.ndarray flat: 1D, all params, like from get_flat_params()
+    """
+    if self.flat_params is not None:
+      assert flat.shape == self.flat_params.shape, \
+        "flat params size mismatch, expected %s, got %s" % (self.flat_params.shape, flat.shape)
+      self._attach_flat_params(copy=False)
+      self.flat_params[...] = flat
+      return
+    for p, value in zip(self.get_all_params_vars(), self.split_flat_params(flat)):
+      p.set_value(value)
+
   def save_hdf(self, model, epoch):
     """
     :type model: h5py.File
@@ -9,6 +9,7 @@ from math import sqrt
 from OpLSTM import LSTMOpInstance
 from OpBLSTM import BLSTMOpInstance
 import RecurrentTransform
+import BeamSearch
 import json
 
 
@@ -34,10 +35,10 @@ class Unit(Container):
     """
     self.parent = parent
 
-  def scan(self, x, z, non_sequences, i, outputs_info, W_re, W_in, b, go_backwards=False, truncate_gradient=-1):
+  def scan(self, x, z, non_sequences, i, outputs_info, W_re, W_in, b, go_backwards=False, truncate_gradient=-1,
+           step=None):
     """
     Executes the iteration over the time axis (usually with theano.scan)
-    :param step: python function to be executed
     :param x: unmapped input tensor in (time,batch,dim) shape
     :param z: same as x but already transformed to self.n_in
     :param non_sequences: see theano.scan
@@ -48,6 +49,7 @@ class Unit(Container):
     :param b: input bias
     :param go_backwards: whether to scan the sequence from 0 to T or from T to 0
     :param truncate_gradient: see theano.scan
+    :param step: python function to be executed, self.step by default
     :return:
     """
     self.outputs_info = outputs_info
@@ -62,7 +64,7 @@ class Unit(Container):
     except Exception:
       self.xc = z if not x else T.concatenate(x, axis = -1)
 
-    outputs, _ = theano.scan(self.step,
+    outputs, _ = theano.scan(step or self.step,
                              #strict = True,
                              truncate_gradient = truncate_gradient,
                              go_backwards = go_backwards,
@@ -79,17 +81,29 @@ class VANILLA(Unit):
   def __init__(self, n_units,  **kwargs):
     super(VANILLA, self).__init__(n_units, n_units, n_units, n_units, 1)
 
-  def step(self, i_t, x_t, z_t, z_p, h_p):
+  def step(self, i_t, x_t, z_t, h_p):
     """
     performs one iteration of the recursion
     :param i_t: index at time step t
     :param x_t: raw input at time step t
     :param z_t: mapped input at time step t
-    :param z_p: previous input from time step t-1
     :param h_p: previous hidden activation from time step t-1
-    :return:
+    :return: hidden activation at time step t. where the index is 0, it is h_p
     """
-    return [ T.tanh(z_t + z_p) ]
+    i_t = i_t.dimshuffle(0, 'x')
+    return T.tanh(z_t + T.dot(h_p, self.W_re)) * i_t + h_p * (1 - i_t)
+
+
+class VANILLAN(VANILLA):
+  """
+  Same as VANILLA, but uses the fused kernel of NativeOp.VanillaRnnGenericBase instead of theano.scan.
+  It does not support recurrent transforms.
+  """
+  def scan(self, x, z, non_sequences, i, outputs_info, W_re, W_in, b, go_backwards = False, truncate_gradient = -1):
+    assert isinstance(self.parent.recurrent_transform, RecurrentTransform.DummyTransform)
+    from NativeOp import VanillaRnnGenericBase
+    op = VanillaRnnGenericBase.make_op()
+    return [ op(z[::-(2 * go_backwards - 1)], W_re, outputs_info[0], i[::-(2 * go_backwards - 1)]) ]
 
 
 class LSTME(Unit):
@@ -300,6 +314,38 @@ class LSTMB(Unit):
 BLSTM = LSTMB # alternative name
 
 
+class LSTMN(Unit):
+  """
+  Same as LSTME, but uses the fused kernel of NativeOp.LstmGenericBase instead of theano.scan.
+  That kernel also has a CPU implementation, thus this is used on CPU for the auto selection.
+  It does not support recurrent transforms.
+  Note that the cell state (act[1]) is only the final state, like for LSTMP.
+  """
+  def __init__(self, n_units, **kwargs):
+    super(LSTMN, self).__init__(n_units, n_units * 4, n_units, n_units * 4, 2)
+
+  def to_native_gate_order(self, v):
+    """
+    LSTME uses the order (input gate, forget gate, output gate, net input) in the last axis,
+    the kernel expects (net input, input gate, forget gate, output gate).
+    """
+    n = self.n_units
+    if v.ndim == 2:
+      return T.concatenate([v[:, 3 * n:], v[:, :3 * n]], axis=1)
+    return T.concatenate([v[:, :, 3 * n:], v[:, :, :3 * n]], axis=2)
+
+  def scan(self, x, z, non_sequences, i, outputs_info, W_re, W_in, b, go_backwards = False, truncate_gradient = -1):
+    assert isinstance(self.parent.recurrent_transform, RecurrentTransform.DummyTransform)
+    from NativeOp import LstmGenericBase
+    from TheanoUtil import make_var_tuple
+    W_re = self.to_native_gate_order(W_re)
+    z = self.to_native_gate_order(z[::-(2 * go_backwards - 1)])
+    z = T.inc_subtensor(z[0], T.dot(outputs_info[0], W_re))
+    op = LstmGenericBase.make_op()
+    Y, H, d = make_var_tuple(op(z, W_re, outputs_info[1], i[::-(2 * go_backwards - 1)]))
+    return [ Y, d.dimshuffle('x',0,1) ]
+
+
 class LSTMC(Unit):
   """
   The same implementation as above, but it executes a theano function (recurrent transform)
@@ -360,12 +406,27 @@ class GRU(Unit):
     self.W_reset = theano.shared(value=values, borrow=True, name = "W_reset")
     self.params['W_reset'] = self.W_reset
 
-  def step(self, i_t, x_t, z_t, z_p, h_p):
+  def step(self, i_t, x_t, z_t, h_p):
     CI, GR, GU = [T.tanh, T.nnet.sigmoid, T.nnet.sigmoid]
+    z_p = T.dot(h_p, self.W_re)
     u_t = GU(z_t[:,:self.slice] + z_p[:,:self.slice])
     r_t = GR(z_t[:,self.slice:2*self.slice] + z_p[:,self.slice:2*self.slice])
-    h_c = CI(z_t[:,2*self.slice:] + self.dot(r_t * h_p, self.W_reset))
-    return u_t * h_p + (1 - u_t) * h_c
+    h_c = CI(z_t[:,2*self.slice:] + T.dot(r_t * h_p, self.W_reset))
+    i_t = i_t.dimshuffle(0, 'x')
+    return (u_t * h_p + (1 - u_t) * h_c) * i_t + h_p * (1 - i_t)
+
+
+class GRUN(GRU):
+  """
+  Same as GRU, but uses the fused kernel of NativeOp.GruGenericBase instead of theano.scan.
+  It does not support recurrent transforms.
+  """
+  def scan(self, x, z, non_sequences, i, outputs_info, W_re, W_in, b, go_backwards = False, truncate_gradient = -1):
+    assert isinstance(self.parent.recurrent_transform, RecurrentTransform.DummyTransform)
+    from NativeOp import GruGenericBase
+    op = GruGenericBase.make_op()
+    Y, H = op(z[::-(2 * go_backwards - 1)], W_re, self.W_reset, outputs_info[0], i[::-(2 * go_backwards - 1)])
+    return [ Y ]
 
 
 class SRU(Unit):
@@ -375,12 +436,14 @@ class SRU(Unit):
   def __init__(self, n_units, **kwargs):
     super(SRU, self).__init__(n_units, n_units * 3, n_units, n_units * 3, 1)
 
-  def step(self, i_t, x_t, z_t, z_p, h_p):
+  def step(self, i_t, x_t, z_t, h_p):
     CI, GR, GU = [T.tanh, T.nnet.sigmoid, T.nnet.sigmoid]
+    z_p = T.dot(h_p, self.W_re)
     u_t = GU(z_t[:,:self.slice] + z_p[:,:self.slice])
     r_t = GR(z_t[:,self.slice:2*self.slice] + z_p[:,self.slice:2*self.slice])
     h_c = CI(z_t[:,2*self.slice:3*self.slice] + r_t * z_p[:,2*self.slice:3*self.slice])
-    return  u_t * h_p + (1 - u_t) * h_c
+    i_t = i_t.dimshuffle(0, 'x')
+    return (u_t * h_p + (1 - u_t) * h_c) * i_t + h_p * (1 - i_t)
 
 
 class RecurrentUnitLayer(Layer):
@@ -424,6 +487,7 @@ class RecurrentUnitLayer(Layer):
                lm = False,
                force_lm = False,
                droplm = 1.0,
+               beam_search = 0,
                forward_weights_init=None,
                bias_random_init_forget_shift=0.0,
                **kwargs):
@@ -434,7 +498,8 @@ class RecurrentUnitLayer(Layer):
     :param truncation: gradient truncation
     :param sampling: scan every nth frame only
     :param encoder: list of encoder layers used as initalization for the hidden state
-    :param unit: cell type (one of 'lstm', 'vanilla', 'gru', 'sru')
+    :param unit: cell type (one of 'lstm', 'vanilla', 'gru', 'sru'). 'lstm', 'vanilla' and 'gru' select the fused
+      NativeOp kernels if possible
     :param n_dec: absolute number of steps to unfold the network if integer, else relative number of steps from encoder
     :param recurrent_transform: name of recurrent transform
     :param recurrent_transform_attribs: dictionary containing parameters for a recurrent transform
@@ -453,6 +518,8 @@ class RecurrentUnitLayer(Layer):
     :param lm: activate RNNLM
     :param force_lm: expect previous labels to be given during testing
     :param droplm: probability to take the expected output as predecessor instead of the real one when LM=true
+    :param beam_search: if > 0, the label feedback of attention_lm='hard' does a beam search with this beam size
+      instead of the greedy argmax when not training. see BeamSearch
     :param bias_random_init_forget_shift: initialize forget gate bias of lstm networks with this value
     """
     source_index = None
@@ -461,15 +528,18 @@ class RecurrentUnitLayer(Layer):
       source_index = kwargs['index']
     unit_given = unit
     from Device import is_using_gpu
+    fused = recurrent_transform == 'none' and (not lm or droplm == 0.0)
     if unit == 'lstm':  # auto selection
       if not is_using_gpu():
-        unit = 'lstme'
-      elif recurrent_transform == 'none' and (not lm or droplm == 0.0):
+        unit = 'lstmn' if fused and truncation == -1 else 'lstme'
+      elif fused:
         unit = 'lstmp'
       else:
         unit = 'lstmc'
     elif unit in ("lstmc", "lstmp") and not is_using_gpu():
-      unit = "lstme"
+      unit = 'lstmn' if fused and truncation == -1 else 'lstme'
+    elif unit in ("gru", "vanilla") and fused and truncation == -1:
+      unit += 'n'  # NativeOp kernel
     if n_out is None:
       assert encoder
       n_out = sum([enc.attrs['n_out'] for enc in encoder])
@@ -491,6 +561,9 @@ class RecurrentUnitLayer(Layer):
     self.set_attr('lm', lm)
     self.set_attr('force_lm', force_lm)
     self.set_attr('droplm', droplm)
+    if beam_search:
+      self.set_attr('beam_search', beam_search)
+    self.beam_search = 0 if self.train_flag else beam_search
     if bias_random_init_forget_shift:
       self.set_attr("bias_random_init_forget_shift", bias_random_init_forget_shift)
     self.set_attr('attention_beam', attention_beam)
@@ -635,6 +708,14 @@ class RecurrentUnitLayer(Layer):
     assert isinstance(recurrent_transform_inst, RecurrentTransform.RecurrentTransformBase)
     unit.recurrent_transform = recurrent_transform_inst
     self.recurrent_transform = recurrent_transform_inst
+    if self.beam_search:
+      assert self.network, "beam search needs the network inputs"
+      assert attention_lm == 'hard' and hasattr(recurrent_transform_inst, 'lm_logits'), \
+        "beam search needs a recurrent transform with label feedback and attention_lm='hard'"
+      assert set(recurrent_transform_inst.state_vars.keys()) <= {'n', 't'}, \
+        "beam search only supports transforms whose state is the step counter"
+      assert type(unit).scan.__func__ is Unit.scan.__func__, "beam search needs a theano.scan based unit"
+      assert self.attrs['sampling'] == 1 and not force_lm
 
     # scan over sequence
     for s in range(self.attrs['sampling']):
@@ -663,6 +744,12 @@ class RecurrentUnitLayer(Layer):
       if unit.recurrent_transform:
         outputs_info += unit.recurrent_transform.get_sorted_state_vars_initial()
 
+      scan_kwargs = {}
+      if self.beam_search:
+        # scores of the hypotheses, labels and parents of every step
+        outputs_info += [BeamSearch.beam_search_initial_scores(num_batches, self.beam_search), None, None]
+        scan_kwargs['step'] = self.beam_search_step
+
       index_f = T.cast(index, theano.config.floatX)
       unit.set_parent(self)
       outputs = unit.scan(x=sources,
@@ -674,7 +761,10 @@ class RecurrentUnitLayer(Layer):
                           W_in=self.W_in,
                           b=self.b,
                           go_backwards=direction == -1,
-                          truncate_gradient=self.attrs['truncation'])
+                          truncate_gradient=self.attrs['truncation'],
+                          **scan_kwargs)
+      if self.beam_search:
+        outputs = self.beam_search_decode(outputs)
 
       if not isinstance(outputs, list):
         outputs = [outputs]
@@ -717,6 +807,51 @@ class RecurrentUnitLayer(Layer):
     self.make_output(self.act[0][::direction or 1])
     self.params.update(unit.params)
 
+  def beam_search_step(self, i_t, x_t, z_t, *args):
+    """
+    Wraps unit.step() for beam search decoding, see BeamSearch.
+    Every row is one hypothesis. The rows of the recurrent states are reordered to their parent hypotheses,
+    and the embeddings of the selected labels are fed in instead of the greedy one of the recurrent transform.
+    :param args: unit.n_act activations, the transform state vars and the scores of the hypotheses
+    :returns the outputs of unit.step(), the new scores, the labels and the parents of the rows
+    """
+    n_act = self.unit.n_act
+    states = list(args[:-1])
+    log_probs = T.log(T.nnet.softmax(self.recurrent_transform.lm_logits(states[0])))
+    scores, labels, parents = BeamSearch.beam_search_step(log_probs, args[-1], i_t, self.beam_search)
+    states[:n_act] = [state[parents] for state in states[:n_act]]
+    outputs = self.unit.step(i_t, x_t, z_t + self.W_lm_out[labels], *states)
+    if not isinstance(outputs, (list, tuple)):
+      outputs = [outputs]
+    return list(outputs) + [scores, labels, parents]
+
+  def beam_search_decode(self, outputs):
+    """
+    :param list[theano.Variable] outputs: outputs of the scan with beam_search_step()
+    :returns the activations of the best hypothesis of every sequence, followed by the transform state vars
+    :rtype: list[theano.Variable]
+    The scan is done with every sequence repeated beam_search times.
+    Everything in the layer which depends on the batch is derived from the network inputs,
+    thus we just replace them in the final graph. The outputs of the source and base layers are
+    replaced as well, so that e.g. the encoder is still calculated only once per sequence.
+    """
+    tiled = {}
+    for k, index in self.network.j.items():
+      for v in [index, self.network.y.get(k)]:
+        if isinstance(v, theano.Variable):
+          tiled[v] = T.repeat(v, self.beam_search, axis=1)
+    for layer in self.sources + (self.base or []):
+      if isinstance(layer, Layer):
+        for v in [layer.output] + getattr(layer, 'act', []):
+          tiled[v] = T.repeat(v, self.beam_search, axis=1)
+    outputs = theano.clone(outputs, replace=tiled)
+    scores, labels, parents = outputs[-3:]
+    rows = BeamSearch.beam_search_backtrack(scores, parents, self.beam_search)
+    self.beam_labels = BeamSearch.beam_search_gather(labels, rows)  # (time,batch)
+    self.beam_scores = BeamSearch.beam_search_gather(scores, rows)[-1]  # (batch,)
+    n_act = self.unit.n_act
+    return [BeamSearch.beam_search_gather(act, rows) for act in outputs[:n_act]] + outputs[n_act:-3]
+
   def cost(self):
     """
     :rtype: (theano.Variable | None, dict[theano.Variable,theano.Variable] | None)
@@ -4,6 +4,7 @@ from cuda_implementation.OneDToTwoDOp import OneDToTwoDOp
 from cuda_implementation.CropToBatchImageSizeOp import CropToBatchImageSizeInstance, CropToBatchImageSizeZeroInstance
 from cuda_implementation.MultiDirectionalTwoDLSTMOp import MultiDirectionalTwoDLSTMOpInstance
 from cuda_implementation.BiDirectionalTwoDLSTMOp import BidirectionalTwoDLSTMOpInstance
+from cuda_implementation.TwoDLSTMCPUOp import MultiDirectionalTwoDLSTMCPUOpInstance, BidirectionalTwoDLSTMCPUOpInstance
 from cuda_implementation.CuDNNConvHWBCOp import CuDNNConvHWBCOpValidInstance
 from cuda_implementation.PoolHWBCOp import PoolHWBCOp
 from cuda_implementation.FractionalMaxPoolingOp import fmp
@@ -163,10 +164,11 @@ class DeepLSTM(TwoDBaseLayer):
     W2, V_h2, V_v2 = self.create_and_add_2d_lstm_weights(n_in, n_out, "2")
 
     if str(theano.config.device).startswith('cpu'):
-      Y = T.dot(X,W1)[:n_out*2]
+      bidir_op = BidirectionalTwoDLSTMCPUOpInstance
     else:
-      Y1, Y2 = BidirectionalTwoDLSTMOpInstance(X, W1, W2, V_h1, V_h2, V_v1, V_v2, b1, b2, sizes)[:2]
-      Y = T.concatenate([Y1,Y2],axis=3)
+      bidir_op = BidirectionalTwoDLSTMOpInstance
+    Y1, Y2 = bidir_op(X, W1, W2, V_h1, V_h2, V_v1, V_v2, b1, b2, sizes)[:2]
+    Y = T.concatenate([Y1,Y2],axis=3)
 
     Y.name = 'Y'
     self.set_attr('n_out', n_out*2)
@@ -226,26 +228,26 @@ class TwoDLSTMLayer(TwoDBaseLayer):
       W4, V_h4, V_v4 = self.create_and_add_2d_lstm_weights(n_in, n_out, "4")
 
     if str(theano.config.device).startswith('cpu'):
-      Y = T.zeros_like(X)
-      if projection == 'concat':
-        Y = Y.repeat(directions,axis=-1)
+      bidir_op = BidirectionalTwoDLSTMCPUOpInstance
+      multidir_op = MultiDirectionalTwoDLSTMCPUOpInstance
+    else:
+      bidir_op = BidirectionalTwoDLSTMOpInstance
+      multidir_op = MultiDirectionalTwoDLSTMOpInstance
+    if directions <= 2:
+      Y = bidir_op(X, W1, W2, V_h1, V_h2, V_v1, V_v2, b1, b2, sizes)
+    else:
+      Y = multidir_op(X, W1, W2, W3, W4, V_h1, V_h2, V_h3, V_h4,
+                      V_v1, V_v2, V_v3, V_v4, b1, b2, b3, b4, sizes)
+
+    if directions > 1:
+      Y = T.stack(Y[:directions],axis=-1)
+      if projection == 'average':
+        Y = Y.mean(axis=-1)
+      elif projection == 'concat':
+        Y = Y.reshape((Y.shape[0],Y.shape[1],Y.shape[2],Y.shape[3]*Y.shape[4]))
         n_out *= directions
     else:
-      if directions <= 2:
-        Y = BidirectionalTwoDLSTMOpInstance(X, W1, W2, V_h1, V_h2, V_v1, V_v2, b1, b2, sizes)
-      else:
-        Y = MultiDirectionalTwoDLSTMOpInstance(X, W1, W2, W3, W4, V_h1, V_h2, V_h3, V_h4,
-                                                  V_v1, V_v2, V_v3, V_v4, b1, b2, b3, b4, sizes)
-
-      if directions > 1:
-        Y = T.stack(Y[:directions],axis=-1)
-        if projection == 'average':
-          Y = Y.mean(axis=-1)
-        elif projection == 'concat':
-          Y = Y.reshape((Y.shape[0],Y.shape[1],Y.shape[2],Y.shape[3]*Y.shape[4]))
-          n_out *= directions
-      else:
-        Y = Y[0]
+      Y = Y[0]
 
     Y.name = 'Y'
     self.set_attr('n_out', n_out)
@@ -6,16 +6,33 @@ import numpy
 
 
 class NumpyDumpDataset(Dataset):
+  """
+  Reads a dump as written by dump-dataset.py, one file per seq for the features and for the targets,
+  i.e. <prefix><seq-idx>.data<postfix> and <prefix><seq-idx>.targets.<target><postfix>.
+  With postfix ".txt" or ".txt.gz", these are text files (numpy.savetxt/loadtxt).
+  With postfix ".npy", these are binary NumPy files (numpy.save/load), which are much faster to read,
+  and with mmap_mode="r", they are memory-mapped instead of read into memory.
+  """
 
   file_format_data = "%i.data"
   file_format_targets = "%i.targets"
 
   def __init__(self, prefix, postfix=".txt.gz",
                start_seq=0, end_seq=None,
-               num_inputs=None, num_outputs=None, **kwargs):
+               num_inputs=None, num_outputs=None, mmap_mode=None, target="classes", **kwargs):
+    """
+    :param str prefix: e.g. "/tmp/dump-dataset."
+    :param str postfix: ".txt.gz", ".txt" or ".npy"
+    :param str|None mmap_mode: for ".npy" files, passed to numpy.load, e.g. "r"
+    :param str target: the target name, as in the target filenames
+    """
     super(NumpyDumpDataset, self).__init__(**kwargs)
+    self.binary = postfix.endswith(".npy")
+    assert self.binary or not mmap_mode, "mmap_mode needs .npy files"
+    self.mmap_mode = mmap_mode
     self.file_format_data = prefix + self.file_format_data + postfix
-    self.file_format_targets = prefix + self.file_format_targets + postfix
+    self.target = target
+    self.file_format_targets = prefix + self.file_format_targets + "." + target + postfix
     self.start_seq = start_seq
     self._init_num_seqs(end_seq)
     self._seq_index = None
@@ -38,20 +55,25 @@ class NumpyDumpDataset(Dataset):
       i += 1
     if end_seq is None:
       assert last_seq is not None, "None found. Check %s." % (self.file_format_data % self.start_seq)
-      end_seq = last_seq
+      end_seq = last_seq + 1
     else:
       assert last_seq == end_seq - 1, "Check %s." % (self.file_format_data % end_seq)
     assert end_seq > self.start_seq
     self._num_seqs = end_seq - self.start_seq
 
+  def _load_numpy_file(self, filename):
+    if self.binary:
+      return numpy.load(filename, mmap_mode=self.mmap_mode)
+    return numpy.loadtxt(filename)
+
   def _load_numpy_seq(self, seq_idx):
     real_idx = self._seq_index[seq_idx]
-    features = numpy.loadtxt(self.file_format_data % real_idx)
-    targets = numpy.loadtxt(self.file_format_targets % real_idx)
+    features = self._load_numpy_file(self.file_format_data % real_idx)
+    targets = self._load_numpy_file(self.file_format_targets % real_idx)
     assert features.ndim == 2
     assert features.shape[1] == self.num_inputs
     assert targets.ndim == 1
-    self._add_cache_seq(seq_idx, features, targets)
+    self._add_cache_seq(seq_idx, features, {self.target: targets})
 
   # ------------ Dataset API --------------
 
@@ -73,6 +95,9 @@ class NumpyDumpDataset(Dataset):
   def get_input_data(self, seq_idx):
     return self._get_cache_seq(seq_idx).features
 
+  def get_target_list(self):
+    return [self.target]
+
   def get_targets(self, target, seq_idx):
     return self._get_cache_seq(seq_idx).targets.get(target, None)
 
@@ -123,6 +148,6 @@ class NumpyDumpDataset(Dataset):
 
   def _add_cache_seq(self, seq_idx, features, targets):
     last_seq_idx = self._get_cache_last_seq_idx()
-    assert seq_idx == last_seq_idx + 1
+    assert not self.cached_seqs or seq_idx == last_seq_idx + 1
     self.cached_seqs += [DatasetSeq(seq_idx, features, targets)]
 
@@ -1,8 +1,17 @@
+import os
 import numpy as np
 
 import theano
+from theano.gof import OpenMPOp
 
-class InvAlignOp(theano.Op):
+
+class InvAlignOp(OpenMPOp):
+  """
+  Viterbi alignment in inverse manner, i.e. for every HMM state we get the frame it is aligned to.
+  The C implementation (see AlignViterbi.cpp) handles the whole batch at once,
+  and with the Theano flag openmp=True, the sequences are aligned in parallel.
+  perform() is the reference implementation.
+  """
   __props__ = ('tdps','nstates')
 
   # index_in, index_out, scores, transcriptions
@@ -27,7 +36,85 @@ class InvAlignOp(theano.Op):
     output_storage[1][0] = attention
     output_storage[2][0] = index
 
-  def __init__(self, tdps, nstates):
+  def c_support_code(self):
+    path = os.path.dirname(os.path.abspath(__file__))
+    with open(path + '/AlignViterbi.cpp', 'r') as f:
+      return f.read()
+
+  def c_code(self, node, name, inputs, outputs, sub):
+    index_in, index_out, scores, transcriptions = inputs
+    labelling, attention, index = outputs
+    fail = sub['fail']
+    nstates = self.nstates
+    n_tdps = len(self.tdps)
+    tdps = "{%s}" % ", ".join(["%r" % float(v) for v in self.tdps])
+    return """
+    {
+    const int nstates = %(nstates)i;
+    const double tdps[] = %(tdps)s;
+    const int n_tdps = %(n_tdps)i;
+    const int len_in = PyArray_DIM(%(index_in)s, 0);
+    const int n_batch = PyArray_DIM(%(scores)s, 1);
+    if(PyArray_DIM(%(index_in)s, 1) != n_batch || PyArray_DIM(%(index_out)s, 1) != n_batch ||
+       PyArray_DIM(%(transcriptions)s, 1) != n_batch) {
+      PyErr_SetString(PyExc_ValueError, "InvAlignOp: batch dimensions do not match");
+      %(fail)s;
+    }
+    npy_intp dims[] = {PyArray_DIM(%(index_out)s, 0) * nstates, n_batch};
+    Py_XDECREF(%(labelling)s);
+    Py_XDECREF(%(attention)s);
+    Py_XDECREF(%(index)s);
+    %(labelling)s = (PyArrayObject*) PyArray_Zeros(2, dims, PyArray_DescrFromType(NPY_INT32), 0);
+    %(attention)s = (PyArrayObject*) PyArray_Zeros(2, dims, PyArray_DescrFromType(NPY_INT32), 0);
+    %(index)s = (PyArrayObject*) PyArray_Zeros(2, dims, PyArray_DescrFromType(NPY_INT8), 0);
+    if(!%(labelling)s || !%(attention)s || !%(index)s)
+      %(fail)s;
+    PyArrayObject* scores = PyArray_GETCONTIGUOUS(%(scores)s);
+    PyArrayObject* transcriptions = PyArray_GETCONTIGUOUS(%(transcriptions)s);
+    std::vector<AlignViterbiSeq> seqs(n_batch);
+    std::vector<int> errors(n_batch, ALIGN_VITERBI_OK);
+    for(int b = 0; b < n_batch; ++b) {
+      AlignViterbiSeq& seq = seqs[b];
+      seq.n_classes = PyArray_DIM(scores, 2);
+      seq.scores_stride = (long) n_batch * seq.n_classes;
+      seq.scores = (const float*) PyArray_DATA(scores) + b * seq.n_classes;
+      seq.trans_stride = n_batch;
+      seq.transcription = (const int*) PyArray_DATA(transcriptions) + b;
+      seq.length_x = align_viterbi_index_len(%(index_in)s, b);
+      seq.length_y = align_viterbi_index_len(%(index_out)s, b);
+      if(seq.length_x > PyArray_DIM(scores, 0) || seq.length_y > PyArray_DIM(transcriptions, 0))
+        errors[b] = ALIGN_VITERBI_ERR_LENGTH;
+    }
+    int* labelling_data = (int*) PyArray_DATA(%(labelling)s);
+    int* attention_data = (int*) PyArray_DATA(%(attention)s);
+    npy_int8* index_data = (npy_int8*) PyArray_DATA(%(index)s);
+    #pragma omp parallel for schedule(dynamic)
+    for(int b = 0; b < n_batch; ++b) {
+      if(errors[b] != ALIGN_VITERBI_OK) continue;
+      errors[b] = inv_align_viterbi(
+        seqs[b], tdps, n_tdps, nstates, attention_data + b, labelling_data + b, n_batch);
+      for(int s = 0; s < seqs[b].length_y * nstates; ++s) {
+        attention_data[s * n_batch + b] += b * len_in;
+        index_data[s * n_batch + b] = 1;
+      }
+    }
+    Py_DECREF(scores);
+    Py_DECREF(transcriptions);
+    for(int b = 0; b < n_batch; ++b) {
+      if(errors[b] != ALIGN_VITERBI_OK) {
+        PyErr_Format(PyExc_ValueError, "InvAlignOp: seq %%i: %%s", b, align_viterbi_error_str(errors[b]));
+        %(fail)s;
+      }
+    }
+    }
+    """ % locals()
+
+  #!!! change this when changing the code!
+  def c_code_cache_version(self):
+    return 1, 0
+
+  def __init__(self, tdps, nstates, openmp=None):
+    super(InvAlignOp, self).__init__(openmp=openmp)
     self.nstates = nstates
     self.tdps = tuple(tdps)
 
@@ -1,8 +1,17 @@
+import os
 import numpy as np
 
 import theano
+from theano.gof import OpenMPOp
 
-class NumpyAlignOp(theano.Op):
+
+class NumpyAlignOp(OpenMPOp):
+  """
+  Full Viterbi alignment of the frames to the HMM states of the transcription.
+  The C implementation (see AlignViterbi.cpp) handles the whole batch at once,
+  and with the Theano flag openmp=True, the sequences are aligned in parallel.
+  perform() is the reference implementation.
+  """
   # Properties attribute
   __props__ = ('inverse',)
 
@@ -25,10 +34,79 @@ class NumpyAlignOp(theano.Op):
                                                                 transcriptions[:length_y,b])
     output_storage[0][0] = alignment
 
-  # optional:
-  #check_input = True
-
-  def __init__(self, inverse): # TODO
+  def c_support_code(self):
+    path = os.path.dirname(os.path.abspath(__file__))
+    with open(path + '/AlignViterbi.cpp', 'r') as f:
+      return f.read()
+
+  def c_code(self, node, name, inputs, outputs, sub):
+    assert not self.silence and self.repetitions == 1, "not supported by the C implementation"
+    index_in, index_out, scores, transcriptions = inputs
+    alignment, = outputs
+    fail = sub['fail']
+    nstates = self.numStates
+    c_double_list = lambda values: "{%s}" % ", ".join(["%r" % float(v) for v in values])
+    tdp = c_double_list(self.tdp)
+    if self.inverse:
+      stdp = c_double_list([0])
+      align_call = "numpy_align_viterbi_inv(seqs[b], tdp, %i, nstates, alignment_data + b, n_batch)" % len(self.tdp)
+    else:
+      stdp = c_double_list(self.stdp)
+      align_call = "numpy_align_viterbi(seqs[b], tdp, stdp, nstates, alignment_data + b, n_batch)"
+    return """
+    {
+    const int nstates = %(nstates)i;
+    const double tdp[] = %(tdp)s;
+    const double stdp[] = %(stdp)s;
+    const int n_batch = PyArray_DIM(%(scores)s, 1);
+    if(PyArray_DIM(%(index_in)s, 1) != n_batch || PyArray_DIM(%(index_out)s, 1) != n_batch ||
+       PyArray_DIM(%(transcriptions)s, 1) != n_batch) {
+      PyErr_SetString(PyExc_ValueError, "NumpyAlignOp: batch dimensions do not match");
+      %(fail)s;
+    }
+    Py_XDECREF(%(alignment)s);
+    %(alignment)s = (PyArrayObject*) PyArray_Zeros(2, PyArray_DIMS(%(index_in)s), PyArray_DescrFromType(NPY_INT32), 0);
+    if(!%(alignment)s)
+      %(fail)s;
+    PyArrayObject* scores = PyArray_GETCONTIGUOUS(%(scores)s);
+    PyArrayObject* transcriptions = PyArray_GETCONTIGUOUS(%(transcriptions)s);
+    std::vector<AlignViterbiSeq> seqs(n_batch);
+    std::vector<int> errors(n_batch, ALIGN_VITERBI_OK);
+    for(int b = 0; b < n_batch; ++b) {
+      AlignViterbiSeq& seq = seqs[b];
+      seq.n_classes = PyArray_DIM(scores, 2);
+      seq.scores_stride = (long) n_batch * seq.n_classes;
+      seq.scores = (const float*) PyArray_DATA(scores) + b * seq.n_classes;
+      seq.trans_stride = n_batch;
+      seq.transcription = (const int*) PyArray_DATA(transcriptions) + b;
+      seq.length_x = align_viterbi_index_len(%(index_in)s, b);
+      seq.length_y = align_viterbi_index_len(%(index_out)s, b);
+      if(seq.length_x > PyArray_DIM(scores, 0) || seq.length_y > PyArray_DIM(transcriptions, 0))
+        errors[b] = ALIGN_VITERBI_ERR_LENGTH;
+    }
+    int* alignment_data = (int*) PyArray_DATA(%(alignment)s);
+    #pragma omp parallel for schedule(dynamic)
+    for(int b = 0; b < n_batch; ++b) {
+      if(errors[b] != ALIGN_VITERBI_OK) continue;
+      errors[b] = %(align_call)s;
+    }
+    Py_DECREF(scores);
+    Py_DECREF(transcriptions);
+    for(int b = 0; b < n_batch; ++b) {
+      if(errors[b] != ALIGN_VITERBI_OK) {
+        PyErr_Format(PyExc_ValueError, "NumpyAlignOp: seq %%i: %%s", b, align_viterbi_error_str(errors[b]));
+        %(fail)s;
+      }
+    }
+    }
+    """ % locals()
+
+  #!!! change this when changing the code!
+  def c_code_cache_version(self):
+    return 1, 0
+
+  def __init__(self, inverse, openmp=None): # TODO
+    super(NumpyAlignOp, self).__init__(openmp=openmp)
     self.numStates = 3
     self.inverse = inverse
     self.repetitions = 1
@@ -237,11 +237,16 @@ class LM(RecurrentTransformBase):
         self.cls = T.concatenate([eos,y_t[::-1]], axis=0)
       self.add_input(self.cls, 'cls')
 
+  def lm_logits(self, y_p):
+    return T.dot(y_p, self.W_lm_in)
+
   def step(self, y_p):
     result = 0
     updates = {}
-    p_re = T.nnet.softmax(T.dot(y_p, self.W_lm_in))
-    if self.layer.attrs['droplm'] < 1.0 and (self.layer.train_flag or self.layer.attrs['force_lm']):
+    p_re = T.nnet.softmax(self.lm_logits(y_p))
+    if self.layer.beam_search:
+      pass  # the label feedback is added by RecurrentUnitLayer.beam_search_step()
+    elif self.layer.attrs['droplm'] < 1.0 and (self.layer.train_flag or self.layer.attrs['force_lm']):
       mask = self.lmmask[T.cast(self.t[0],'int32')]
       if self.layer.attrs['attention_lm'] == "hard":
         result += self.W_lm_out[T.argmax(p_re, axis=1)] * (1. - mask) + self.cls[T.cast(self.t[0],'int32')] * mask
@@ -307,12 +312,15 @@ class AttentionBase(RecurrentTransformBase):
     self.n_glm = max(self.attrs['glimpse'],1)
     return { self.n : self.n + numpy.float32(1) } #T.constant(1,'float32') }
 
+  def lm_logits(self, y_p):
+    return T.dot(y_p, self.W_lm_in) + self.b_lm_in
+
   def step(self, y_p):
     result = 0
     self.glimpses = []
     updates = self.default_updates()
-    if self.attrs['lm'] != "none":
-      p_re = T.nnet.softmax(T.dot(y_p, self.W_lm_in) + self.b_lm_in)
+    if self.attrs['lm'] != "none" and not self.layer.beam_search:  # see RecurrentUnitLayer.beam_search_step()
+      p_re = T.nnet.softmax(self.lm_logits(y_p))
       if self.layer.attrs['droplm'] < 1.0:
         mask = self.drop_mask[T.cast(self.n[0],'int32')]
         if self.attrs['lm'] == "hard":
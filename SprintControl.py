@@ -17,7 +17,7 @@ import Debug
 import os
 import numpy
 import TaskSystem
-from TaskSystem import Pickler, Unpickler, numpy_set_unused
+from TaskSystem import msg_dump, msg_load, msg_protocol_negotiate, numpy_set_unused
 from Util import to_bool
 from threading import Condition
 
@@ -220,6 +220,8 @@ class PythonControl:
     self.cond = Condition()
     self.pipe_c2p = os.fdopen(c2p_fd, "w")
     self.pipe_p2c = os.fdopen(p2c_fd, "r")
+    self.msg_protocol = "pickle"  # switched after "init", see handle_cmd_init
+    self._next_msg_protocol = None
     self.sprint_callback = None  # via self._init
     self.sprint_version_number = None  # via self._init
     self.callback = None  # either via Sprint, or self.own_threaded_callback
@@ -249,7 +251,9 @@ class PythonControl:
     print("CRNN SprintControl[pid %i] PythonControl additional_init %r" %(os.getpid(), kwargs))
     self._init(**kwargs)
 
-  def _init(self, name, sprint_unit=None, callback=None, version_number=None, min_version_number=None, **kwargs):
+  def _init(self, name, sprint_unit=None, callback=None, version_number=None, min_version_number=None, config=None, **kwargs):
+    if config and "msgProtocol" in config:
+      self._next_msg_protocol = msg_protocol_negotiate(config["msgProtocol"])
     if name == "Sprint.PythonControl":
       print("CRNN SprintControl[pid %i] init for Sprint.PythonControl %r" % (os.getpid(), kwargs))
       assert min_version_number
@@ -315,11 +319,11 @@ class PythonControl:
     return loss, error_signal
 
   def _send(self, data):
-    Pickler(self.pipe_c2p).dump(data)
+    msg_dump(self.pipe_c2p, data, protocol=self.msg_protocol)
     self.pipe_c2p.flush()
 
   def _read(self):
-    return Unpickler(self.pipe_p2c).load()
+    return msg_load(self.pipe_p2c, protocol=self.msg_protocol)
 
   def close(self):
     self.pipe_c2p.close()
@@ -331,6 +335,10 @@ class PythonControl:
 
   def handle_cmd_init(self, name, version):
     assert version == self.Version
+    if self._next_msg_protocol:
+      # The parent asked for a msg protocol. Tell it which one we use from now on.
+      # We switch in handle_next() after we have sent this reply.
+      return "SprintControl", self.Version, self._next_msg_protocol
     return "SprintControl", self.Version
 
   def handle_cmd_get_loss_and_error_signal(self, seg_name, seg_len, posteriors):
@@ -392,6 +400,9 @@ class PythonControl:
     else:
       assert isinstance(res, tuple)
       self._send(("ok",) + res)
+      if args[0] == "init" and self._next_msg_protocol:
+        self.msg_protocol = self._next_msg_protocol
+        self._next_msg_protocol = None
 
   def run_control_loop(self, callback, **kwargs):
     """
@@ -15,8 +15,10 @@ import os
 import time
 import atexit
 import signal
+import errno
+from select import error as select_error
 import TaskSystem
-from TaskSystem import Pickler, Unpickler, numpy_set_unused
+from TaskSystem import msg_dump, msg_load, numpy_set_unused
 from Util import eval_shell_str, make_hashable
 from Log import log
 
@@ -33,12 +35,17 @@ class SprintSubprocessInstance:
     "exit" -> (exit)
     "get_loss_and_error_signal", seg_name, seg_len, posteriors -> "ok", loss, error_signal
       Numpy arrays encoded via TaskSystem.Pickler (which is optimized for Numpy).
+  We ask for the message protocol via the config string (msgProtocol).
+  If the child supports it, it will reply to "init" with ("ok", child_name, version, msg_protocol),
+  and all further messages in both directions use that protocol (see TaskSystem.msg_dump).
+  Otherwise (older SprintControl), we stay with pickle.
   On the Sprint side, we handle this via the SprintControl Sprint interface.
   """
 
   Version = 1  # increase when some protocol changes
 
-  def __init__(self, sprintExecPath, minPythonControlVersion=2, sprintConfigStr="", sprintControlConfig=None, usePythonSegmentOrder=True):
+  def __init__(self, sprintExecPath, minPythonControlVersion=2, sprintConfigStr="", sprintControlConfig=None, usePythonSegmentOrder=True,
+               msgProtocol="binary"):
     """
     :param str sprintExecPath: this executable will be called for the sub proc.
     :param int minPythonControlVersion: will be checked in the subprocess. via Sprint PythonControl
@@ -46,6 +53,7 @@ class SprintSubprocessInstance:
       can have "config:" prefix - in that case, looked up in config.
       handled via eval_shell_str(), can thus have lazy content (if it is callable, will be called).
     :param dict[str]|None sprintControlConfig: passed to SprintControl.init().
+    :param str msgProtocol: "binary" or "pickle". the protocol we ask for. see TaskSystem.MsgProtocols
     """
     assert os.path.exists(sprintExecPath)
     self.sprintExecPath = sprintExecPath
@@ -58,6 +66,9 @@ class SprintSubprocessInstance:
     self.sprintConfig = eval_shell_str(sprintConfigStr)
     self.sprintControlConfig = sprintControlConfig
     self.usePythonSegmentOrder = usePythonSegmentOrder
+    assert msgProtocol in TaskSystem.MsgProtocols
+    self.requestedMsgProtocol = msgProtocol
+    self.msg_protocol = "pickle"  # until negotiated in _start_child
     self.child_pid = None
     self.parent_pid = os.getpid()
     # There is no generic way to see whether Python is exiting.
@@ -67,6 +78,11 @@ class SprintSubprocessInstance:
     self._cur_seg_name = None
     self._cur_posteriors_shape = None
     self.is_calculating = False
+    # Stats, see SprintInstancePool.get_batch_loss_and_error_signal().
+    self.busy_time = 0.0  # time between send and read of a segment
+    self.idle_time = 0.0  # time without a segment, e.g. while the pool was processing a batch
+    self._last_free_time = None
+    self._send_time = None
     self.init()
 
   def _exit_child(self, should_interrupt=False):
@@ -134,11 +150,16 @@ class SprintSubprocessInstance:
     self.pipe_c2p[1].close()
     self.pipe_p2c[0].close()
     self.child_pid = pid
+    self.msg_protocol = "pickle"
 
     try:
       self._send(("init", "SprintSubprocessInstance", self.Version))
       ret = self._read()
       assert ret[0] == "ok" and len(ret) >= 3 and ret[2] == self.Version
+      if len(ret) >= 4:  # newer SprintControl tells us the negotiated protocol
+        assert ret[3] in TaskSystem.MsgProtocols
+        self.msg_protocol = ret[3]
+      print >> log.v5, "SprintSubprocessInstance: msg protocol %s" % self.msg_protocol
     except Exception:
       print >> log.v1, "SprintSubprocessInstance: Sprint child process (%r) caused an exception." % args
       sys.excepthook(*sys.exc_info())
@@ -158,6 +179,7 @@ class SprintSubprocessInstance:
     config_str = "c2p_fd:%i,p2c_fd:%i" % (
         self.pipe_c2p[1].fileno(), self.pipe_p2c[0].fileno())
     config_str += ",minPythonControlVersion:%i" % self.minPythonControlVersion
+    config_str += ",msgProtocol:%s" % self.requestedMsgProtocol
     if TaskSystem.SharedMemNumpyConfig["enabled"]:
       config_str += ",EnableAutoNumpySharedMemPickling:True"
     if self.sprintControlConfig:
@@ -187,12 +209,12 @@ class SprintSubprocessInstance:
   def _send(self, v):
     assert os.getpid() == self.parent_pid
     p = self.pipe_p2c[1]  # see _start_child
-    Pickler(p).dump(v)
+    msg_dump(p, v, protocol=self.msg_protocol)
 
   def _read(self):
     assert os.getpid() == self.parent_pid
     p = self.pipe_c2p[0]  # see _start_child
-    return Unpickler(p).load()
+    return msg_load(p, protocol=self.msg_protocol)
 
   def _poll(self):
     assert os.getpid() == self.parent_pid
@@ -201,6 +223,26 @@ class SprintSubprocessInstance:
     ready, _, _ = select([p.fileno()], [], [], 0)
     return bool(ready)
 
+  def fileno(self):
+    """
+    :return: the fd of the pipe we read from. for select()
+    :rtype: int
+    """
+    return self.pipe_c2p[0].fileno()
+
+  def start_idle_time(self, t=None):
+    """
+    Marks this instance as free since time t (default now).
+    Used by SprintInstancePool to accumulate the idle_time.
+    """
+    assert not self.is_calculating
+    self._last_free_time = t or time.time()
+
+  def stop_idle_time(self, t=None):
+    if self._last_free_time is not None:
+      self.idle_time += (t or time.time()) - self._last_free_time
+      self._last_free_time = None
+
   def _join_child(self, wait=True, expected_exit_status=None):
     assert self.child_pid
     options = 0 if wait else os.WNOHANG
@@ -229,6 +271,8 @@ class SprintSubprocessInstance:
       raise
     else:
       self.is_calculating = True
+      self._send_time = time.time()
+      self.stop_idle_time(self._send_time)
 
   def get_loss_and_error_signal__have_data(self):
     assert self.is_calculating
@@ -246,6 +290,8 @@ class SprintSubprocessInstance:
       raise
     else:
       self.is_calculating = False
+      self._last_free_time = time.time()
+      self.busy_time += self._last_free_time - self._send_time
     assert ret[0] == "ok" and len(ret) == 3, "Got unexpected return: %r" % (ret,)
     loss = ret[1]
     error_signal = ret[2]
@@ -332,25 +378,64 @@ class SprintInstancePool:
     # Very simple parallelism. We must avoid any form of multi-threading
     # because this can be problematic with Theano.
     # See: https://groups.google.com/forum/#!msg/theano-users/Pu4YKlZKwm4/eNcAegzaNeYJ
-    # We also try to keep it simple here.
-    for bb in range(0, n_batch, self.max_num_instances):
-      for i in range(self.max_num_instances):
-        b = bb + i
-        if b >= n_batch: break
-        instance = self._get_instance(i)
+    # Thus we use a work queue via select(): whenever any instance has finished a segment,
+    # it gets the next one, so fast segments don't wait for the slowest one.
+    # We take the longest segments first, to reduce the tail latency.
+    # Every segment goes to its own slot in the result arrays, so the result does not depend on the order.
+    queue = sorted(range(n_batch), key=lambda b: (-seq_lengths[b], b))
+    queue.reverse()  # we pop() from the end
+    num_instances = min(self.max_num_instances, n_batch)
+    instances = [self._get_instance(i) for i in range(num_instances)]
+    start_time = time.time()
+    for instance in instances:
+      instance.start_idle_time(start_time)
+    busy = {}  # instance -> batch idx
+    while queue or busy:
+      for instance in instances:
+        if not queue:
+          break
+        if instance in busy:
+          continue
+        b = queue.pop()
         instance.get_loss_and_error_signal__send(
-          seg_name=tags[b], seg_len=seq_lengths[b], log_posteriors=log_posteriors[:seq_lengths[b], b])
-      for i in range(self.max_num_instances):
-        b = bb + i
-        if b >= n_batch: break
-        instance = self._get_instance(i)
+          seg_name=tags[b], seg_len=int(seq_lengths[b]), log_posteriors=log_posteriors[:seq_lengths[b], b])
+        busy[instance] = b
+      for instance in self._wait_for_any_result(busy.keys()):
+        b = busy.pop(instance)
         seg_name, loss, error_signal = instance.get_loss_and_error_signal__read()
         assert seg_name == tags[b]
         batch_loss[b] = loss
         batch_error_signal[:seq_lengths[b], b] = error_signal
         numpy_set_unused(error_signal)
+    end_time = time.time()
+    for instance in instances:
+      instance.stop_idle_time(end_time)
     return batch_loss, batch_error_signal
 
+  @staticmethod
+  def _wait_for_any_result(instances):
+    """
+    :param list[SprintSubprocessInstance] instances: instances which are calculating
+    :return: the instances which have data ready to be read. blocks until there is at least one
+    :rtype: list[SprintSubprocessInstance]
+    """
+    from select import select
+    while True:
+      try:
+        ready, _, _ = select(instances, [], [])
+      except select_error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      return ready
+
+  def get_instance_stats(self):
+    """
+    :return: per instance: (busy_time, idle_time), accumulated over all calls to get_batch_loss_and_error_signal()
+    :rtype: list[(float,float)]
+    """
+    return [(instance.busy_time, instance.idle_time) for instance in self.instances]
+
   def get_automata_for_batch(self, tags):
     all_num_states = [None] * len(tags)
     all_num_edges  = [None] * len(tags)
@@ -7,7 +7,7 @@ This Sprint interface is to be used for ExternSprintDataset, which should automa
 
 import os
 import TaskSystem
-from TaskSystem import Pickler, Unpickler
+from TaskSystem import msg_dump, msg_protocol_negotiate
 from Util import to_bool
 
 # Start Sprint PythonSegmentOrder interface. {
@@ -102,7 +102,8 @@ def _init_global_sprintDataset(inputDim, outputDim, config):
   if sprintDataset: return
   numSegments = len(segmentOrderList) if segmentOrderList is not None else None
   sprintDataset = ExternSprintDatasetSource(c2p_fd=int(config["c2p_fd"]), p2c_fd=int(config["p2c_fd"]),
-                                            inputDim=inputDim, outputDim=outputDim, numSegments=numSegments)
+                                            inputDim=inputDim, outputDim=outputDim, numSegments=numSegments,
+                                            msgProtocol=config.get("msgProtocol", None))
 
 
 def exit():
@@ -189,7 +190,7 @@ class ExternSprintDatasetSource:
   and is waiting for our data.
   """
 
-  def __init__(self, c2p_fd, p2c_fd, inputDim, outputDim, numSegments):
+  def __init__(self, c2p_fd, p2c_fd, inputDim, outputDim, numSegments, msgProtocol=None):
     """
     :param int c2p_fd: child-to-parent file descriptor
     :param int p2c_fd: parent-to-child file descriptor
@@ -197,13 +198,21 @@ class ExternSprintDatasetSource:
     :type outputDim: int
     :type numSegments: int | None
     :param numSegments: can be None if not known in advance
+    :param str|None msgProtocol: the protocol the parent asked for. None means an older parent, i.e. pickle
     """
     self.pipe_c2p = os.fdopen(c2p_fd, "w")
     self.pipe_p2c = os.fdopen(p2c_fd, "r")
-    self._send("init", (inputDim, outputDim, numSegments))
+    self.msg_protocol = "pickle"
+    if msgProtocol:
+      # The init msg itself is always pickled. It tells the parent which protocol we use afterwards.
+      protocol = msg_protocol_negotiate(msgProtocol)
+      self._send("init", (inputDim, outputDim, numSegments, protocol))
+      self.msg_protocol = protocol
+    else:
+      self._send("init", (inputDim, outputDim, numSegments))
 
   def _send(self, dataType, args=None):
-    Pickler(self.pipe_c2p).dump((dataType, args))
+    msg_dump(self.pipe_c2p, (dataType, args), protocol=self.msg_protocol)
     self.pipe_c2p.flush()
 
   def addNewData(self, segmentName, features, targets):
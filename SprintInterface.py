@@ -27,7 +27,8 @@ from Log import log
 from Device import get_gpu_names
 import rnn
 from Engine import Engine
-from EngineUtil import assign_dev_data_single_seq
+from EngineBatch import Batch
+from EngineUtil import assign_dev_data
 from Network import LayerNetwork
 import Debug
 from Util import interrupt_main, to_bool
@@ -475,53 +476,108 @@ def forward(segmentName, features):
   :param numpy.ndarray features: format (input-feature,time) (via Sprint)
   :return numpy.ndarray, format (output-dim,time)
   """
-  print "Sprint forward", segmentName, features.shape
-  assert engine is not None, "not initialized"
-  assert sprintDataset
+  return forwardBatch([segmentName], [features])[0]
 
-  # Features are in Sprint format (feature,time).
-  T = features.shape[1]
-  assert features.shape == (InputDim, T)
 
-  # Fill the data for the current segment.
+def forwardBatch(segmentNames, featuresList):
+  """
+  Forwards several segments at once. They are sorted by length and packed into padded batches of multiple seqs,
+  limited by the config options sprint_forward_max_seqs and sprint_forward_max_frames
+  (padded frames, i.e. max seq len * num seqs), and each batch is forwarded in a single device run.
+
+  :param list[str|None] segmentNames: full names
+  :param list[numpy.ndarray] featuresList: each in format (input-feature,time) (via Sprint)
+  :return: posteriors for every segment, each in format (output-dim,time)
+  :rtype: list[numpy.ndarray]
+  """
+  assert engine is not None, "not initialized"
+  assert sprintDataset
+  assert len(segmentNames) == len(featuresList)
+  max_seqs = config.int('sprint_forward_max_seqs', 0)
+  if max_seqs <= 0:
+    max_seqs = sprintDataset.SprintCachedSeqsMin
+  max_seqs = min(max_seqs, sprintDataset.SprintCachedSeqsMin)  # addNewData() must not block
+  max_frames = config.int('sprint_forward_max_frames', 0)
+  if max_frames <= 0:
+    max_frames = 10000
+
+  # Sort by length to minimize the padding. The result is in the original order.
+  order = sorted(range(len(featuresList)), key=lambda j: featuresList[j].shape[1])
+  posteriorsList = [None] * len(featuresList)
+  i = 0
+  while i < len(order):
+    # The first segment always goes in, even if it is longer than max_frames.
+    end = i + 1
+    while end < len(order) and end - i < max_seqs:
+      if featuresList[order[end]].shape[1] * (end - i + 1) > max_frames:
+        break
+      end += 1
+    batch_order = order[i:end]
+    batchPosteriors = _forwardSingleBatch([segmentNames[j] for j in batch_order], [featuresList[j] for j in batch_order])
+    for j, posteriors in zip(batch_order, batchPosteriors):
+      posteriorsList[j] = posteriors
+    i = end
+  return posteriorsList
+
+
+def _forwardSingleBatch(segmentNames, featuresList):
+  """
+  :param list[str|None] segmentNames: full names
+  :param list[numpy.ndarray] featuresList: each in format (input-feature,time) (via Sprint)
+  :return: posteriors for every segment, each in format (output-dim,time)
+  :rtype: list[numpy.ndarray]
+  """
+  # Fill the data for the current segments.
   sprintDataset.shuffle_frames_of_nseqs = 0  # We must not shuffle.
   sprintDataset.initSprintEpoch(None)  # Reset cache. We don't need old seqs anymore.
   sprintDataset.init_seq_order()
-  seq = sprintDataset.addNewData(features, segmentName=segmentName)
+  batch = Batch()
+  for segmentName, features in zip(segmentNames, featuresList):
+    print "Sprint forward", segmentName, features.shape
+    # Features are in Sprint format (feature,time).
+    T = features.shape[1]
+    assert features.shape == (InputDim, T)
+    seq = sprintDataset.addNewData(features, segmentName=segmentName)
+    batch.add_sequence_as_slice(seq_idx=seq, seq_start_frame=0, length=sprintDataset.get_seq_length(seq))
 
   # Prepare data for device.
   device = engine.devices[0]
-  success = assign_dev_data_single_seq(device, sprintDataset, seq)
-  assert success, "failed to allocate & assign data for seq %i, %s" % (seq, segmentName)
+  success, _ = assign_dev_data(device, sprintDataset, [batch])
+  assert success, "failed to allocate & assign data for segments %r" % segmentNames
 
   # Do the actual forwarding and collect result.
   device.run("extract")
   result, _ = device.result()
   assert result is not None, "Device crashed."
   assert len(result) == 1
-  posteriors = result[0]
-
-  # If we have a sequence training criterion, posteriors might be in format (time,seq|batch,emission).
-  if posteriors.ndim == 3:
-    assert posteriors.shape == (T, 1, OutputDim)
-    posteriors = posteriors[:, 0]
-  # Posteriors are in format (time,emission).
-  assert posteriors.shape == (T, OutputDim)
-  # Reformat to Sprint expected format (emission,time).
-  posteriors = posteriors.transpose()
-  assert posteriors.shape == (OutputDim, T)
-  stats = (numpy.min(posteriors), numpy.max(posteriors), numpy.mean(posteriors), numpy.std(posteriors))
-  print "posteriors min/max/mean/std:", stats
-  if numpy.isinf(posteriors).any() or numpy.isnan(posteriors).any():
-    print "posteriors:", posteriors
-    debug_feat_fn = "/tmp/crnn.pid%i.sprintinterface.debug.features.txt" % os.getpid()
-    debug_post_fn = "/tmp/crnn.pid%i.sprintinterface.debug.posteriors.txt" % os.getpid()
-    print "Wrote to files %s, %s" % (debug_feat_fn, debug_post_fn)
-    numpy.savetxt(debug_feat_fn, features)
-    numpy.savetxt(debug_post_fn, posteriors)
-    assert False, "Error, posteriors contain invalid numbers."
-
-  return posteriors
+  batchPosteriors = result[0]
+
+  posteriorsList = []
+  for seq, (segmentName, features) in zip(batch.seqs, zip(segmentNames, featuresList)):
+    T = features.shape[1]
+    posteriors = batchPosteriors
+    # If we have a sequence training criterion, posteriors might be in format (time,seq|batch,emission).
+    if posteriors.ndim == 3:
+      assert posteriors.shape[1:] == (len(featuresList), OutputDim)
+      posteriors = posteriors[:T, seq.batch_slice]
+    # Posteriors are in format (time,emission).
+    assert posteriors.shape == (T, OutputDim)
+    # Reformat to Sprint expected format (emission,time).
+    posteriors = posteriors.transpose()
+    assert posteriors.shape == (OutputDim, T)
+    stats = (numpy.min(posteriors), numpy.max(posteriors), numpy.mean(posteriors), numpy.std(posteriors))
+    print "posteriors min/max/mean/std:", stats
+    if numpy.isinf(posteriors).any() or numpy.isnan(posteriors).any():
+      print "posteriors:", posteriors
+      debug_feat_fn = "/tmp/crnn.pid%i.sprintinterface.debug.features.txt" % os.getpid()
+      debug_post_fn = "/tmp/crnn.pid%i.sprintinterface.debug.posteriors.txt" % os.getpid()
+      print "Wrote to files %s, %s" % (debug_feat_fn, debug_post_fn)
+      numpy.savetxt(debug_feat_fn, features)
+      numpy.savetxt(debug_post_fn, posteriors)
+      assert False, "Error, posteriors contain invalid numbers in segment %s." % segmentName
+    posteriorsList.append(posteriors)
+
+  return posteriorsList
 
 
 class Criterion(theano.Op):
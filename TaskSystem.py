@@ -816,6 +816,226 @@ class Pickler(_BasePickler):
   def __setstate__(self, state): pass
 
 
+class BinaryMsgWriter:
+  """
+  Compact binary framing for messages over pipes, as an alternative to Pickler.
+  Numpy arrays are written as a small header followed by their raw contiguous bytes,
+  so the reader can read them directly into a preallocated buffer.
+  We support None, bool, int, long, float, str, unicode, tuple, list, dict and numpy.ndarray.
+  Any other object is embedded as a pickled blob (via Pickler), so this never fails
+  for objects which Pickler can handle.
+  See BinaryMsgReader for the other end.
+  """
+
+  Magic = "RBM1"
+
+  def __init__(self, file):
+    self.file = file
+    self._header = []  # small header parts, collected and written in one go before each raw array payload
+
+  def dump(self, obj):
+    self._header.append(self.Magic)
+    self._save(obj)
+    self._flush_header()
+    if hasattr(self.file, "flush"):
+      self.file.flush()
+
+  def _flush_header(self):
+    if self._header:
+      self.file.write("".join(self._header))
+      self._header = []
+
+  def _save_str(self, s):
+    self._header.append(struct.pack("<I", len(s)))
+    self._header.append(s)
+
+  def _save(self, obj):
+    t = type(obj)
+    if obj is None:
+      self._header.append("N")
+    elif t is bool:
+      self._header.append("T" if obj else "F")
+    elif t is int or t is long:
+      if -2 ** 63 <= obj < 2 ** 63:
+        self._header.append("i" + struct.pack("<q", obj))
+      else:
+        self._save_pickled(obj)
+    elif t is float:
+      self._header.append("f" + struct.pack("<d", obj))
+    elif t is str:
+      self._header.append("s")
+      self._save_str(obj)
+    elif t is unicode:
+      self._header.append("u")
+      self._save_str(obj.encode("utf8"))
+    elif t is tuple or t is list:
+      self._header.append(("t" if t is tuple else "l") + struct.pack("<I", len(obj)))
+      for v in obj:
+        self._save(v)
+    elif t is dict:
+      self._header.append("d" + struct.pack("<I", len(obj)))
+      for k, v in obj.items():
+        self._save(k)
+        self._save(v)
+    elif t is numpy.ndarray and not obj.dtype.hasobject:
+      self._save_ndarray(obj)
+    else:
+      self._save_pickled(obj)
+
+  def _save_ndarray(self, obj):
+    # We always write in C-order. Fortran-order arrays are transposed on the fly,
+    # so we keep the order flag to restore the same memory layout on the other side.
+    fortran = obj.ndim > 1 and obj.flags.f_contiguous and not obj.flags.c_contiguous
+    data = obj.T if fortran else obj
+    if not data.flags.c_contiguous:
+      data = data.copy(order="C")
+    self._header.append("a" + ("F" if fortran else "C"))
+    self._save_str(data.dtype.str)
+    self._header.append(struct.pack("<B", data.ndim))
+    if data.ndim:
+      self._header.append(struct.pack("<%iq" % data.ndim, *data.shape))
+    if data.nbytes:
+      self._flush_header()
+      self.file.write(buffer(data))
+
+  def _save_pickled(self, obj):
+    sio = BytesIO()
+    Pickler(sio).dump(obj)
+    self._header.append("p")
+    self._save_str(sio.getvalue())
+
+
+class BinaryMsgReader:
+  """
+  Reads messages written by BinaryMsgWriter.
+  Numpy array payloads are read via readinto() directly into a newly allocated array, without any extra copy.
+  """
+
+  def __init__(self, file):
+    self.file = file
+
+  def _read(self, n):
+    s = self.file.read(n)
+    if len(s) < n:
+      raise EOFError("BinaryMsgReader: expected %i bytes, got %i" % (n, len(s)))
+    return s
+
+  def _read_into(self, buf):
+    """
+    :param numpy.ndarray buf: C-contiguous array which will be filled
+    """
+    n = buf.nbytes
+    view = memoryview(buf.reshape(-1).view("uint8"))
+    readinto = getattr(self.file, "readinto", None)
+    if not readinto:
+      view[:] = self._read(n)
+      return
+    pos = 0
+    while pos < n:
+      m = readinto(view[pos:])
+      if not m:
+        raise EOFError("BinaryMsgReader: expected %i bytes, got %i" % (n, pos))
+      pos += m
+
+  def _load_uint32(self):
+    return struct.unpack("<I", self._read(4))[0]
+
+  def _load_str(self):
+    return self._read(self._load_uint32())
+
+  def load(self):
+    magic = self._read(len(BinaryMsgWriter.Magic))
+    assert magic == BinaryMsgWriter.Magic, "BinaryMsgReader: invalid header %r" % magic
+    return self._load()
+
+  def _load(self):
+    t = self._read(1)
+    if t == "N":
+      return None
+    if t == "T":
+      return True
+    if t == "F":
+      return False
+    if t == "i":
+      v = struct.unpack("<q", self._read(8))[0]
+      if -sys.maxint - 1 <= v <= sys.maxint:
+        v = int(v)
+      return v
+    if t == "f":
+      return struct.unpack("<d", self._read(8))[0]
+    if t == "s":
+      return self._load_str()
+    if t == "u":
+      return self._load_str().decode("utf8")
+    if t in "tl":
+      n = self._load_uint32()
+      ls = [self._load() for _ in range(n)]
+      return tuple(ls) if t == "t" else ls
+    if t == "d":
+      n = self._load_uint32()
+      d = {}
+      for _ in range(n):
+        k = self._load()
+        d[k] = self._load()
+      return d
+    if t == "a":
+      return self._load_ndarray()
+    if t == "p":
+      return Unpickler(BytesIO(self._load_str())).load()
+    raise Exception("BinaryMsgReader: invalid type tag %r" % t)
+
+  def _load_ndarray(self):
+    order = self._read(1)
+    dtype = numpy.dtype(self._load_str())
+    ndim = struct.unpack("<B", self._read(1))[0]
+    shape = struct.unpack("<%iq" % ndim, self._read(8 * ndim)) if ndim else ()
+    arr = numpy.empty(shape, dtype=dtype)
+    if arr.nbytes:
+      self._read_into(arr)
+    if order == "F":
+      arr = arr.T
+    return arr
+
+
+MsgProtocols = ("binary", "pickle")  # in order of preference
+
+def msg_dump(file, obj, protocol="pickle"):
+  """
+  :param file: file-like object, e.g. a pipe
+  :param obj: the message
+  :param str protocol: see MsgProtocols
+  """
+  if protocol == "binary":
+    BinaryMsgWriter(file).dump(obj)
+  elif protocol == "pickle":
+    Pickler(file).dump(obj)
+  else:
+    raise Exception("unknown msg protocol %r" % protocol)
+
+def msg_load(file, protocol="pickle"):
+  """
+  :param file: file-like object, e.g. a pipe
+  :param str protocol: see MsgProtocols
+  :return: the message, as written by msg_dump()
+  """
+  if protocol == "binary":
+    return BinaryMsgReader(file).load()
+  elif protocol == "pickle":
+    return Unpickler(file).load()
+  else:
+    raise Exception("unknown msg protocol %r" % protocol)
+
+def msg_protocol_negotiate(requested):
+  """
+  :param str|None requested: the protocol which the other side asked for, e.g. via a config string
+  :return: the protocol which we will use. "pickle" is understood by every peer
+  :rtype: str
+  """
+  if requested in MsgProtocols:
+    return requested
+  return "pickle"
+
+
 class ExecingProcess:
   """
   This is a replacement for multiprocessing.Process which always
@@ -6,6 +6,7 @@ from theano.compile import ViewOp
 from theano import gof
 from theano.compile import optdb
 import numpy
+from contextlib import contextmanager
 
 
 def time_batch_make_flat(val):
@@ -744,3 +745,198 @@ def self_similarity_cosine(x):
   assert xx.ndim == 2
   from theano.tensor.basic import tril
   return tril(xx, 1)
+
+
+class CompiledFunctionCache:
+  """
+  Persistent on-disk cache of compiled theano.function's.
+  Building the graph is cheap compared to the graph optimization and compilation in theano.function,
+  so we still build the graph as usual, but we store the compiled function, i.e. the optimized graph,
+  and on the next run, we load it and plug in the shared variables of the freshly built graph.
+  The shared variables (and their values) are not stored in the cache. We refer to them by name.
+  All functions of one cache instance share the same key, which should cover everything the graph depends on,
+  e.g. the network topology, the loss, the Theano flags and the device type.
+  """
+
+  RecursionLimit = 50000  # (un)pickling of graphs is recursive
+
+  def __init__(self, cache_dir, key):
+    """
+    :param str cache_dir: base directory. we create one sub-directory per key
+    :param str key: e.g. a hash, see make_key()
+    """
+    import os
+    self.cache_dir = os.path.join(os.path.expanduser(cache_dir), key)
+    self.key = key
+    self.num_hits = 0
+    self.num_misses = 0
+
+  @classmethod
+  def make_key(cls, parts):
+    """
+    :param dict[str] parts: everything the compiled functions depend on. must be JSON-serializable or have a stable repr
+    :return: hash of parts
+    :rtype: str
+    """
+    import json
+    import hashlib
+    s = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha1(s).hexdigest()
+
+  @classmethod
+  @contextmanager
+  def _big_recursion_limit(cls):
+    import sys
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old_limit, cls.RecursionLimit))
+    try:
+      yield
+    finally:
+      sys.setrecursionlimit(old_limit)
+
+  def _filename(self, name):
+    import os
+    return os.path.join(self.cache_dir, "%s.pkl" % name)
+
+  @staticmethod
+  def collect_shared_inputs(inputs, outputs, updates=None, givens=None, no_default_updates=False):
+    """
+    :return: the shared variables which theano.function would use as implicit inputs
+    :rtype: list[theano.compile.SharedVariable]
+    """
+    from theano.compile.pfunc import rebuild_collect_shared
+    if not isinstance(outputs, (list, tuple)):
+      outputs = [outputs]
+    _, _, (_, _, _, shared_inputs) = rebuild_collect_shared(
+      list(outputs), list(inputs), replace=givens, updates=updates,
+      rebuild_strict=True, copy_inputs_over=True, no_default_updates=no_default_updates)
+    return shared_inputs
+
+  @staticmethod
+  def _shared_by_name(shared_inputs):
+    """
+    :param list[theano.compile.SharedVariable] shared_inputs:
+    :return: name -> var, or None if the names are not unique
+    :rtype: dict[str,theano.compile.SharedVariable]|None
+    """
+    d = {}
+    for v in shared_inputs:
+      if not v.name or v.name in d:
+        return None
+      d[v.name] = v
+    return d
+
+  def function(self, name, inputs, outputs, updates=None, givens=None, no_default_updates=False, **kwargs):
+    """
+    Like theano.function, with the same arguments, but loads it from the cache, if possible.
+    :param str name: name of the function. must be unique within this cache
+    :rtype: theano.compile.function_module.Function
+    """
+    shared_inputs = self.collect_shared_inputs(inputs=inputs, outputs=outputs, updates=updates,
+                                               givens=givens, no_default_updates=no_default_updates)
+    shared_by_name = self._shared_by_name(shared_inputs)
+    f = None
+    if shared_by_name is not None:
+      f = self._load(name, shared_by_name)
+    if f is not None:
+      self.num_hits += 1
+      return f
+    self.num_misses += 1
+    f = theano.function(inputs=inputs, outputs=outputs, updates=updates, givens=givens,
+                        no_default_updates=no_default_updates, name=name, **kwargs)
+    if shared_by_name is not None:
+      self._store(name, f, shared_by_name)
+    return f
+
+  def _load(self, name, shared_by_name):
+    """
+    :param str name: function name
+    :param dict[str,theano.compile.SharedVariable] shared_by_name: the shared vars of the current graph
+    :rtype: theano.compile.function_module.Function|None
+    """
+    import os
+    import cPickle
+    from Log import log
+    filename = self._filename(name)
+    if not os.path.exists(filename):
+      return None
+
+    def persistent_load(pid):
+      kind, var_name = pid.split(":", 1)
+      var = shared_by_name[var_name]
+      if kind == "var":
+        return var
+      if kind == "container":
+        return var.container
+      if kind == "value":
+        return var.container.storage[0]
+      raise Exception("invalid persistent id %r" % pid)
+
+    try:
+      old_reoptimize = theano.config.reoptimize_unpickled_function
+      theano.config.reoptimize_unpickled_function = False
+      try:
+        with open(filename, "rb") as fh, self._big_recursion_limit():
+          unpickler = cPickle.Unpickler(fh)
+          unpickler.persistent_load = persistent_load
+          shared_types = unpickler.load()
+          if shared_types != {k: str(v.type) for (k, v) in shared_by_name.items()}:
+            raise Exception("shared variables mismatch")
+          maker = unpickler.load()
+      finally:
+        theano.config.reoptimize_unpickled_function = old_reoptimize
+      # Like theano.compile.function_module.orig_function, but the shared inputs use the live containers.
+      defaults = []
+      for inp in maker.inputs:
+        if inp.shared:
+          defaults.append(shared_by_name[inp.variable.name].container)
+        else:
+          defaults.append(getattr(inp, "value", None))
+      f = maker.create(defaults)
+      f.name = name
+    except Exception as e:
+      print >> log.v3, "CompiledFunctionCache: cannot load %r: %s. Recompiling." % (filename, e)
+      return None
+    print >> log.v4, "CompiledFunctionCache: loaded %r" % filename
+    return f
+
+  def _store(self, name, f, shared_by_name):
+    """
+    :param str name: function name
+    :param theano.compile.function_module.Function f: compiled function
+    :param dict[str,theano.compile.SharedVariable] shared_by_name: the shared vars used by f
+    """
+    import os
+    import cPickle
+    import tempfile
+    from Log import log
+    filename = self._filename(name)
+    # We refer to the shared variables, their containers and their values by name.
+    persistent_ids = {}
+    for var_name, var in shared_by_name.items():
+      persistent_ids[id(var)] = "var:%s" % var_name
+      persistent_ids[id(var.container)] = "container:%s" % var_name
+      persistent_ids[id(var.container.storage[0])] = "value:%s" % var_name
+    try:
+      if not os.path.isdir(self.cache_dir):
+        try:
+          os.makedirs(self.cache_dir)
+        except OSError:  # maybe created by another device in the meantime
+          if not os.path.isdir(self.cache_dir):
+            raise
+      # Write to a temp file first and then rename (atomic), because several devices might do this at the same time.
+      fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, prefix=name, suffix=".tmp")
+      try:
+        with os.fdopen(fd, "wb") as fh, self._big_recursion_limit():
+          pickler = cPickle.Pickler(fh, cPickle.HIGHEST_PROTOCOL)
+          pickler.persistent_id = lambda obj: persistent_ids.get(id(obj))
+          pickler.dump({k: str(v.type) for (k, v) in shared_by_name.items()})
+          pickler.dump(f.maker)
+        os.rename(tmp_filename, filename)
+      except Exception:
+        os.remove(tmp_filename)
+        raise
+    except Exception as e:
+      print >> log.v3, "CompiledFunctionCache: cannot store %r: %s" % (filename, e)
+      return
+    print >> log.v4, "CompiledFunctionCache: stored %r" % filename
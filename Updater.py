@@ -9,6 +9,7 @@ import theano.tensor.shared_randomstreams
 import theano.tensor as T
 import theano.ifelse
 import theano.compile
+import NativeOp
 from TheanoUtil import opt_contiguous_on_gpu
 
 
@@ -77,6 +78,8 @@ class Updater:
                update_multiple_models_average_step_i=0, update_multiple_models_averaging=True,
                update_multiple_models_param_is_cur_model=False,
                multi_batch_update=0,
+               accumulate_gradients=0,
+               fused_update=False,
                enforce_triangular_matrix_zero=False,
                gradient_noise=0.0,
                gradient_noise_decay=0.55,
@@ -117,6 +120,12 @@ class Updater:
     :param update_multiple_models_averaging:
     :param update_multiple_models_param_is_cur_model:
     :param multi_batch_update:
+    :param accumulate_gradients: if > 1, sum the gradients of this many batches and then do a single update step
+      with them, i.e. like one batch which is this many times larger. The optimizer state is only updated then.
+    :param fused_update: for adam, adadelta or rmsprop, do the update of every param in a single native op
+      (see NativeOp.AdamUpdate etc.), which reads the gradient, the optimizer state and the param once
+      and writes them inplace. Cannot be combined with the momentum variants, update_clip or the
+      multi-batch and multi-model updates.
     :param enforce_triangular_matrix_zero:
     :param gradient_noise:
     :param gradient_noise_decay:
@@ -153,6 +162,8 @@ class Updater:
     self.update_multiple_models_average_step_i = update_multiple_models_average_step_i
     self.update_multiple_models_param_is_cur_model = update_multiple_models_param_is_cur_model
     self.multi_batch_update = multi_batch_update
+    self.accumulate_gradients = accumulate_gradients
+    self.fused_update = fused_update
     self.enforce_triangular_matrix_zero = enforce_triangular_matrix_zero
     self.gradient_noise = gradient_noise
     self.gradient_noise_decay = gradient_noise_decay
@@ -190,6 +201,19 @@ class Updater:
       print >> log.v4, "using adam with nag and momentum schedule"
     if self.eve:
       print >> log.v4, "using eve optimizer (Adam with feedback)"
+    if self.accumulate_gradients > 1:
+      assert self.multi_batch_update <= 1, "use either multi_batch_update or accumulate_gradients"
+      print >> log.v4, "using gradient accumulation over %i batches" % self.accumulate_gradients
+    if self.fused_update:
+      assert self.adam or self.adadelta or self.rmsprop, "fused_update is only implemented for adam, adadelta, rmsprop"
+      assert not (self.adasecant or self.nadam or self.eve or self.adamax or self.adagrad or self.adamdelta), \
+        "fused_update is only implemented for adam, adadelta, rmsprop"
+      assert not (self.momentum or self.nesterov_momentum or self.momentum2 or self.update_clip > 0), \
+        "fused_update cannot be combined with momentum or update_clip"
+      assert self.multi_batch_update <= 1 and not self.update_multiple_models, \
+        "fused_update cannot be combined with multi_batch_update or update_multiple_models"
+      assert not self.enforce_triangular_matrix_zero, "fused_update cannot be combined with enforce_triangular_matrix_zero"
+      print >> log.v4, "using fused update op"
 
   def initVars(self, network, net_param_deltas):
     """
@@ -354,6 +378,17 @@ class Updater:
 
     self.counter = self.var(0, name="counter", dtype="int64")
     updates.append((self.counter, self.counter + 1))
+    # Updates which must be done for every batch, also with accumulate_gradients.
+    ungated_update_vars = set([v for (v, _) in updates])
+    if self.accumulate_gradients > 1:
+      accumulate_update_now = T.eq(self.counter % self.accumulate_gradients, self.accumulate_gradients - 1)
+      for param in grads.keys():
+        if hasattr(param, 'custom_update'):
+          continue
+        accumulated_grad = self.var(param, name="%s_accumulated_grad" % param.name, zero=True)
+        grads[param] = accumulated_grad + grads[param]
+        updates.append((accumulated_grad, theano.ifelse.ifelse(accumulate_update_now, T.zeros_like(param), grads[param])))
+        ungated_update_vars.add(accumulated_grad)
     dt = T.cast(1.,'float32') #T.cast(T.max(T.sum(self.network.output.values()[0].index,axis=0)), 'float32')
     i_t = self.i + dt #1.
     prev_epoch = self.var(numpy.zeros((), dtype="int32"),'prev_epoch',dtype='int32')
@@ -382,6 +417,11 @@ class Updater:
     for grad in grads.values(): n_total_params += T.prod(grad.shape)
     avg_grad_norm = total_grad_norm / T.cast(n_total_params, dtype="float32")
 
+    # With fused_update, the optimizer step is collected here and done for all params by a single op.
+    fused_inputs = []
+    " :type: list[(theano.SharedVariable, theano.Variable, list[theano.SharedVariable])] "
+    fused_op_class, fused_hyper = None, None
+
     for param in grads.keys():
       # This loops sets upd[param], where param_new = param + upd[param].
 
@@ -401,6 +441,7 @@ class Updater:
           assert param.custom_update_accumulate_batches >= 1
           do_update_now = T.eq(self.counter % param.custom_update_accumulate_batches, param.custom_update_accumulate_batches - 1)
           accumulated_param = self.var(param, name="%s_accumulated" % param.name, zero=True)
+          ungated_update_vars.add(accumulated_param)
           accumulated_param_new = accumulated_param + upd[param]
           updates.append((
             accumulated_param,
@@ -716,6 +757,10 @@ class Updater:
         a_t = self.learning_rate_var
         if self.adam_fit_learning_rate:
           a_t *= T.cast(T.sqrt(1 - beta2 ** i_t) / (1 - beta1 ** i_t), dtype="float32")
+        if self.fused_update:
+          fused_op_class, fused_hyper = NativeOp.AdamUpdate, [a_t, beta1, beta2, self.adam_offset]
+          fused_inputs.append((param, deltas, [m_prev, v_prev]))
+          continue
         step = a_t * m_t / (T.sqrt(v_t) + self.adam_offset)
 
         updates.append((m_prev, m_t))
@@ -785,6 +830,10 @@ class Updater:
       elif self.adadelta:
         decay = self.adadelta_decay
         offset = self.adadelta_offset
+        if self.fused_update:
+          fused_op_class, fused_hyper = NativeOp.AdadeltaUpdate, [self.learning_rate_var, decay, offset]
+          fused_inputs.append((param, deltas, [self.eg2[param], self.edx2[param], self.dx[param]]))
+          continue
         g = deltas
         g2 = g ** 2
         eg2_new = decay * self.eg2[param] + (numpy.float32(1) - decay) * g2
@@ -800,6 +849,10 @@ class Updater:
         # https://github.com/Lasagne/Lasagne/blob/master/lasagne/updates.py#L398-L453
         accumulator = self.var(param, zero=True, name="accumulator_%s" % param.name)
         epsilon = numpy.float32(1e-8)
+        if self.fused_update:
+          fused_op_class, fused_hyper = NativeOp.RmspropUpdate, [self.learning_rate_var, self.rmsprop, epsilon]
+          fused_inputs.append((param, deltas, [accumulator]))
+          continue
         accumulator_new = numpy.float32(self.rmsprop) * accumulator + (numpy.float32(1) - numpy.float32(self.rmsprop)) * deltas ** numpy.float32(2)
         updates.append((accumulator, accumulator_new))
         upd[param] += - (self.learning_rate_var * deltas) / (T.sqrt(accumulator_new) + epsilon)
@@ -837,6 +890,13 @@ class Updater:
         upd[param] += velocity * self.momentum2
         updates.append((velocity, upd[param]))
 
+    if fused_inputs:
+      params, param_grads, states = zip(*fused_inputs)
+      for param, state, (param_new, state_new) in zip(
+            params, states, NativeOp.fused_update(fused_op_class, params, param_grads, states, fused_hyper)):
+        updates.append((param, param_new))
+        updates.extend(zip(state, state_new))
+
     if self.update_clip > 0:
       for p, u in list(upd.items()):
         if not u: continue
@@ -924,6 +984,13 @@ class Updater:
         updates[i] = (p, upd)
       print >>log.v4, "enforce_triangular_matrix_zero for:", ps
 
+    if self.accumulate_gradients > 1:
+      # Everything else, i.e. the params, the optimizer state and the update step counter,
+      # only changes when we have accumulated enough batches. ifelse also skips the calculation otherwise.
+      updates = [(v, u) if v in ungated_update_vars or hasattr(v, 'custom_update')
+                 else (v, theano.ifelse.ifelse(accumulate_update_now, u, v))
+                 for (v, u) in updates]
+
     #for u in updates:
     #  print ">>>>", u
     return updates
@@ -10,6 +10,7 @@ import shlex
 import numpy as np
 import re
 import time
+import operator
 
 PY3 = sys.version_info[0] >= 3
 
@@ -654,21 +655,41 @@ def load_json(filename=None, content=None):
   return json_content
 
 
-class NumbersDict:
+class _NumbersDictClassMethodOnly(object):
+  """
+  Like classmethod, but when accessed via an instance, it returns a function which raises an exception.
+  To be sure that we don't confuse NumbersDict.max with NumbersDict.max_value.
+  """
+
+  def __init__(self, func):
+    self.func = func
+
+  def __get__(self, instance, owner):
+    if instance is not None:
+      return NumbersDict._max_error
+    return self.func.__get__(owner, type(owner))
+
+
+class NumbersDict(object):
   """
   It's mostly like dict[str,float|int] & some optional broadcast default value.
   It implements the standard math bin ops in a straight-forward way.
+  This is used for every seq in the batch generation (Dataset._generate_batches, EngineBatch),
+  thus the storage is in __slots__ and the bin ops have fast paths for the common cases.
   """
 
+  __slots__ = ("dict", "value")
+  __hash__ = None  # mutable
+
   def __init__(self, auto_convert=None, numbers_dict=None, broadcast_value=None):
     if auto_convert is not None:
       assert broadcast_value is None
       assert numbers_dict is None
-      if isinstance(auto_convert, dict):
-        numbers_dict = auto_convert
-      elif isinstance(auto_convert, NumbersDict):
+      if isinstance(auto_convert, NumbersDict):
         numbers_dict = auto_convert.dict
         broadcast_value = auto_convert.value
+      elif isinstance(auto_convert, dict):
+        numbers_dict = auto_convert
       else:
         broadcast_value = auto_convert
     if numbers_dict is None:
@@ -678,7 +699,22 @@ class NumbersDict:
 
     self.dict = numbers_dict
     self.value = broadcast_value
-    self.max = self.__max_error
+
+  @classmethod
+  def _from_dict(cls, numbers_dict, broadcast_value):
+    """
+    Like NumbersDict(numbers_dict=numbers_dict, broadcast_value=broadcast_value) but without the copy.
+    """
+    res = cls.__new__(cls)
+    res.dict = numbers_dict
+    res.value = broadcast_value
+    return res
+
+  def __getstate__(self):
+    return self.dict, self.value
+
+  def __setstate__(self, state):
+    self.dict, self.value = state
 
   @property
   def keys_set(self):
@@ -719,44 +755,69 @@ class NumbersDict:
       other = zero
     return op(self, other)
 
+  @staticmethod
+  def _dict_and_value(x):
+    """
+    :param NumbersDict|dict|T x:
+    :rtype: (dict, T|None)
+    """
+    if isinstance(x, NumbersDict):
+      return x.dict, x.value
+    if isinstance(x, dict):
+      return x, None
+    return {}, x
+
   @classmethod
   def bin_op(cls, self, other, op, zero, result=None):
-    if not isinstance(self, NumbersDict):
-      self = NumbersDict(self)
-    if not isinstance(other, NumbersDict):
-      other = NumbersDict(other)
+    self_dict, self_value = cls._dict_and_value(self)
+    other_dict, other_value = cls._dict_and_value(other)
+    res_dict = {}
+    # The common case is that all values are not None, which we handle directly.
+    for k, a in self_dict.items():
+      b = other_dict.get(k, other_value)
+      if a is None or b is None:
+        res_dict[k] = cls.bin_op_scalar_optional(a, b, zero=zero, op=op)
+      else:
+        res_dict[k] = op(a, b)
+    for k, b in other_dict.items():
+      if k in self_dict:
+        continue
+      if self_value is None or b is None:
+        res_dict[k] = cls.bin_op_scalar_optional(self_value, b, zero=zero, op=op)
+      else:
+        res_dict[k] = op(self_value, b)
+    res_value = cls.bin_op_scalar_optional(self_value, other_value, zero=zero, op=op)
     if result is None:
-      result = NumbersDict()
+      return cls._from_dict(res_dict, res_value)
     assert isinstance(result, NumbersDict)
-    for k in self.keys_set | other.keys_set:
-      result[k] = cls.bin_op_scalar_optional(self[k], other[k], zero=zero, op=op)
-    result.value = cls.bin_op_scalar_optional(self.value, other.value, zero=zero, op=op)
+    result.dict.update(res_dict)
+    result.value = res_value
     return result
 
   def __add__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a + b, zero=0)
+    return self.bin_op(self, other, op=operator.add, zero=0)
 
   __radd__ = __add__
 
   def __iadd__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a + b, zero=0, result=self)
+    return self.bin_op(self, other, op=operator.add, zero=0, result=self)
 
   def __sub__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a - b, zero=0)
+    return self.bin_op(self, other, op=operator.sub, zero=0)
 
   def __rsub__(self, other):
     return self.bin_op(self, other, op=lambda a, b: b - a, zero=0)
 
   def __isub__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a - b, zero=0, result=self)
+    return self.bin_op(self, other, op=operator.sub, zero=0, result=self)
 
   def __mul__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a * b, zero=1)
+    return self.bin_op(self, other, op=operator.mul, zero=1)
 
   __rmul__ = __mul__
 
   def __imul__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a * b, zero=1, result=self)
+    return self.bin_op(self, other, op=operator.mul, zero=1, result=self)
 
   def __div__(self, other):
     return self.bin_op(self, other, op=lambda a, b: a / b, zero=1)
@@ -777,13 +838,13 @@ class NumbersDict:
       This is often not what we want.
       You can control the behavior via result_with_default.
     """
-    res = self.bin_op(self, other, op=lambda a, b: a == b, zero=None)
+    res = self.bin_op(self, other, op=operator.eq, zero=None)
     if not result_with_default:
       res.value = None
     return res
 
   def __eq__(self, other):
-    return all(self.elem_eq(other).values())
+    return all(self.elem_eq(other).dict.values())
 
   def __ne__(self, other):
     return not (self == other)
@@ -793,23 +854,24 @@ class NumbersDict:
     # and it would just confuse.
     raise Exception("%s.__cmp__ is undefined" % self.__class__.__name__)
 
-  @classmethod
-  def max(cls, items):
+  def _max(cls, items):
     """
     Element-wise maximum for item in items.
     """
     if not items:
       return None
-    if len(items) == 1:
-      return items[0]
-    if len(items) == 2:
+    res = items[0]
+    for item in items[1:]:
       # max(x, None) == x, so this works.
-      return cls.bin_op(items[0], items[1], op=max, zero=None)
-    return cls.max([items[0], cls.max(items[1:])])
+      res = cls.bin_op(res, item, op=max, zero=None)
+    return res
+
+  max = _NumbersDictClassMethodOnly(_max)
+  del _max
 
   @staticmethod
-  def __max_error():
-    # Will replace self.max for each instance. To be sure that we don't confuse it with self.max_value.
+  def _max_error(*args, **kwargs):
+    # Will be returned for self.max. To be sure that we don't confuse it with self.max_value.
     raise Exception("Use max_value instead.")
 
   def max_value(self):
@@ -829,6 +891,60 @@ class NumbersDict:
            self.__class__.__name__, self.dict, self.value)
 
 
+class MomentsAccumulator:
+  """
+  Accumulates the count, the sum and the sum of squares of feature vectors, per dimension.
+  Accumulators of different parts of the data, e.g. seq ranges processed by different worker processes,
+  can be combined via merge(), and the result is the same as over all the data at once
+  (up to floating point summation order).
+  """
+
+  def __init__(self, dim, dtype="float64"):
+    """
+    :param int dim: feature dimension
+    :param str dtype: for the sums
+    """
+    self.count = 0
+    self.sum = np.zeros((dim,), dtype=dtype)
+    self.sum_sq = np.zeros((dim,), dtype=dtype)
+
+  def add(self, data):
+    """
+    :param numpy.ndarray data: shape (time,dim)
+    """
+    data = np.asarray(data, dtype=self.sum.dtype)
+    self.count += data.shape[0]
+    self.sum += np.sum(data, axis=0)
+    self.sum_sq += np.sum(data * data, axis=0)
+
+  def merge(self, other):
+    """
+    :param MomentsAccumulator other:
+    """
+    self.count += other.count
+    self.sum += other.sum
+    self.sum_sq += other.sum_sq
+
+  def mean(self):
+    """
+    :rtype: numpy.ndarray
+    """
+    return self.sum / self.count
+
+  def mean_sq(self):
+    """
+    :rtype: numpy.ndarray
+    """
+    return self.sum_sq / self.count
+
+  def var(self):
+    """
+    :rtype: numpy.ndarray
+    """
+    mean = self.mean()
+    return self.mean_sq() - mean * mean
+
+
 def collect_class_init_kwargs(cls):
   kwargs = set()
   for cls_ in inspect.getmro(cls):
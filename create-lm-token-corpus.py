@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+"""
+Converts a text corpus (Bliss XML or line-based txt, optionally gzipped)
+into the pre-tokenized memory-mapped format for LmDataset. See LmDataset.TokenCorpus.
+Afterwards, use the output prefix as corpus_file in LmDataset.
+"""
+
+import sys
+import argparse
+from Log import log
+from LmDataset import create_token_corpus
+
+
+def main(argv):
+  argparser = argparse.ArgumentParser(description='Create a pre-tokenized corpus for LmDataset.')
+  argparser.add_argument('corpus_file', help="Corpus Bliss XML or just txt-data")
+  argparser.add_argument('orth_symbols_file', help="list of orthography symbols, see collect-orth-symbols.py")
+  argparser.add_argument('output_prefix', help="where to store the files, <output_prefix>.*.npy etc.")
+  argparser.add_argument('--orth_replace_map_file', help="JSON file with replacement dict for orth symbols")
+  argparser.add_argument('--log_skipped_seqs', action='store_true', help="log skipped seqs")
+  args = argparser.parse_args(argv[1:])
+  log.initialize(verbosity=[5])
+  create_token_corpus(
+    corpus_file=args.corpus_file, orth_symbols_file=args.orth_symbols_file, output_prefix=args.output_prefix,
+    orth_replace_map_file=args.orth_replace_map_file, log_skipped_seqs=args.log_skipped_seqs)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
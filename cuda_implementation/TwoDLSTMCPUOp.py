@@ -0,0 +1,269 @@
+import theano
+import theano.gradient
+import theano.tensor as T
+from theano.gof import OpenMPOp
+from .Util import get_c_support_code_mdlstm_cpu
+
+
+#(flip_y, flip_x) for every direction, same order as in MultiDirectionalTwoDLSTMOp and BidirectionalTwoDLSTMOp
+multi_directions = ((0, 0), (1, 0), (0, 1), (1, 1))
+bi_directions = ((0, 0), (0, 1))
+
+
+def _c_list(values):
+  return "{" + ", ".join([str(v) for v in values]) + "}"
+
+
+class TwoDLSTMCPUOpBase(OpenMPOp):
+  """
+  Common code for the CPU versions of MultiDirectionalTwoDLSTMOp and BidirectionalTwoDLSTMOp.
+  See c_support_code_mdlstm_cpu.cpp. With the Theano flag openmp=True,
+  the positions of one anti-diagonal are processed in parallel.
+  """
+  __props__ = ("directions",)
+
+  def __init__(self, directions, openmp=None):
+    super(TwoDLSTMCPUOpBase, self).__init__(openmp=openmp)
+    self.directions = tuple([tuple(d) for d in directions])
+
+  def c_support_code(self):
+    return T.blas.blas_header_text() + get_c_support_code_mdlstm_cpu()
+
+  def c_libraries(self):
+    return T.blas.ldflags()
+
+  def c_compile_args(self):
+    return super(TwoDLSTMCPUOpBase, self).c_compile_args() + T.blas.ldflags(libs=False, flags=True)
+
+  def c_lib_dirs(self):
+    return T.blas.ldflags(libs=False, libs_dir=True)
+
+  def c_header_dirs(self):
+    return T.blas.ldflags(libs=False, include_dir=True)
+
+  def _c_init(self, X, sizes):
+    n_dirs = len(self.directions)
+    flips = _c_list([int(f) for d in self.directions for f in d])
+    return """
+    const int n_dirs = %(n_dirs)i;
+    const int flips[] = %(flips)s;
+    PyArrayObject * X = PyArray_GETCONTIGUOUS(%(X)s);
+    PyArrayObject * sizes = PyArray_GETCONTIGUOUS(%(sizes)s);
+    const npy_intp * X_dim = PyArray_DIMS(X);
+    assert(PyArray_DIMS(sizes)[0] == X_dim[2] && PyArray_DIMS(sizes)[1] == 2);
+    MDLSTMCPUDims d;
+    d.height = X_dim[0];
+    d.width = X_dim[1];
+    d.n_minibatch = X_dim[2];
+    d.sizes = (const float *) PyArray_DATA(sizes);
+    const int n_in = X_dim[3];
+    const long n_pos_batch = long(d.height) * d.width * d.n_minibatch;
+    """ % locals()
+
+  def _c_contiguous_list(self, c_name, names):
+    return "PyArrayObject * %s[] = %s;\n" % (
+      c_name, _c_list(["PyArray_GETCONTIGUOUS(%s)" % name for name in names]))
+
+  def _c_data_list(self, c_name, c_type, c_arrays):
+    return "%s %s[] = %s;\n" % (
+      c_type, c_name, _c_list(["(%s) PyArray_DATA(%s[%i])" % (c_type, c_arrays, i)
+                               for i in range(len(self.directions))]))
+
+  def _c_decref_list(self, c_names):
+    return "".join(["for(int dir = 0; dir < n_dirs; ++dir) Py_DECREF(%s[dir]);\n" % name for name in c_names])
+
+  #!!! change this when changing the code!
+  def c_code_cache_version(self):
+    return 1, 0
+
+
+class TwoDLSTMCPUOpGrad(TwoDLSTMCPUOpBase):
+  def make_node(self, X, *args):
+    n = len(self.directions)
+    X = T.as_tensor_variable(X)
+    args = [T.as_tensor_variable(v) for v in args]
+    assert len(args) == 4 * n + 1 + 3 * n
+    Ws, V_hs, V_vs, bs = [args[i * n:(i + 1) * n] for i in range(4)]
+    sizes = args[4 * n]
+    DYs, Ys, Hs = [args[4 * n + 1 + i * n:4 * n + 1 + (i + 1) * n] for i in range(3)]
+    for v in [X, sizes] + args:
+      assert v.dtype == "float32"
+    expected_ndims = [2] * (3 * n) + [1] * n + [2] + [4] * (3 * n)
+    for v, expected_ndim in zip(args, expected_ndims):
+      assert v.ndim == expected_ndim, (v, v.ndim, expected_ndim)
+    inputs_vars = [X] + list(Ws) + list(V_hs) + list(V_vs) + list(bs)
+    return theano.Apply(self, [X] + args, [v.type() for v in inputs_vars])
+
+  def c_code(self, node, name, input_names, output_names, sub):
+    n = len(self.directions)
+    X = input_names[0]
+    Ws, V_hs, V_vs, bs = [input_names[1 + i * n:1 + (i + 1) * n] for i in range(4)]
+    sizes = input_names[1 + 4 * n]
+    DYs, Ys, Hs = [input_names[2 + 4 * n + i * n:2 + 4 * n + (i + 1) * n] for i in range(3)]
+    DX = output_names[0]
+    DWs, DV_hs, DV_vs, Dbs = [output_names[1 + i * n:1 + (i + 1) * n] for i in range(4)]
+    c_outputs = _c_list(["&" + v for v in DWs + DV_hs + DV_vs + Dbs])
+    return "{\n" + self._c_init(X, sizes) + \
+      self._c_contiguous_list("Ws", Ws) + \
+      self._c_contiguous_list("V_hs", V_hs) + \
+      self._c_contiguous_list("V_vs", V_vs) + \
+      self._c_contiguous_list("Ys", Ys) + \
+      self._c_data_list("data_Ys", "const float*", "Ys") + \
+      self._c_data_list("data_V_hs", "const float*", "V_hs") + \
+      self._c_data_list("data_V_vs", "const float*", "V_vs") + \
+      "PyArrayObject * deltas[] = %s;\n" % _c_list(["(PyArrayObject*) PyArray_NewCopy(%s, NPY_CORDER)" % v for v in Hs]) + \
+      "PyArrayObject * epsilons[] = %s;\n" % _c_list(["(PyArrayObject*) PyArray_NewCopy(%s, NPY_CORDER)" % v for v in DYs]) + \
+      self._c_data_list("data_deltas", "float*", "deltas") + \
+      self._c_data_list("data_epsilons", "float*", "epsilons") + \
+      """
+    d.n_cells = PyArray_DIMS(Ys[0])[3];
+    assert(PyArray_DIMS(deltas[0])[3] == 5 * d.n_cells);
+    const int n_gates = 5 * d.n_cells;
+
+    vector<float> workmem(n_dirs * 2 * n_pos_batch * d.n_cells, 0.0f);
+    float * data_workmems[n_dirs];
+    for(int dir = 0; dir < n_dirs; ++dir)
+      data_workmems[dir] = &workmem[dir * 2 * n_pos_batch * d.n_cells];
+
+    mdlstm_cpu_bwd(d, n_dirs, flips, data_deltas, data_epsilons, data_workmems, data_Ys, data_V_hs, data_V_vs);
+
+    PyArrayObject ** outputs[] = %(c_outputs)s;
+    for(int i = 0; i < 4 * n_dirs; ++i)
+      Py_XDECREF(*outputs[i]);
+    Py_XDECREF(%(DX)s);
+    %(DX)s = (PyArrayObject*) PyArray_SimpleNew(4, PyArray_DIMS(X), NPY_FLOAT32);
+    float * data_DX = (float*) PyArray_DATA(%(DX)s);
+    for(int dir = 0; dir < n_dirs; ++dir)
+    {
+      npy_intp W_dims[] = {n_in, n_gates};
+      npy_intp V_dims[] = {d.n_cells, n_gates};
+      npy_intp b_dims[] = {n_gates};
+      PyArrayObject * DW = (PyArrayObject*) PyArray_SimpleNew(2, W_dims, NPY_FLOAT32);
+      PyArrayObject * DV_h = (PyArrayObject*) PyArray_SimpleNew(2, V_dims, NPY_FLOAT32);
+      PyArrayObject * DV_v = (PyArrayObject*) PyArray_SimpleNew(2, V_dims, NPY_FLOAT32);
+      PyArrayObject * Db = (PyArrayObject*) PyArray_SimpleNew(1, b_dims, NPY_FLOAT32);
+      *outputs[0 * n_dirs + dir] = DW;
+      *outputs[1 * n_dirs + dir] = DV_h;
+      *outputs[2 * n_dirs + dir] = DV_v;
+      *outputs[3 * n_dirs + dir] = Db;
+      const float * delta = data_deltas[dir];
+      //DW = X^T * delta
+      mdlstm_cpu_sgemm(true, false, n_in, n_gates, n_pos_batch,
+        (const float*) PyArray_DATA(X), delta, (float*) PyArray_DATA(DW), 0.0f);
+      //DX = sum over dirs delta * W^T
+      mdlstm_cpu_sgemm(false, true, n_pos_batch, n_in, n_gates,
+        delta, (const float*) PyArray_DATA(Ws[dir]), data_DX, dir == 0 ? 0.0f : 1.0f);
+      //Db = (1 ... 1) * delta
+      float * data_Db = (float*) PyArray_DATA(Db);
+      memset(data_Db, 0, sizeof(float) * n_gates);
+      for(long i = 0; i < n_pos_batch; ++i)
+        for(int j = 0; j < n_gates; ++j)
+          data_Db[j] += delta[i * n_gates + j];
+      mdlstm_cpu_grad_V(d, flips[2 * dir], flips[2 * dir + 1], delta, data_Ys[dir],
+        (float*) PyArray_DATA(DV_h), (float*) PyArray_DATA(DV_v));
+    }
+    if(n_in == 0 || n_pos_batch == 0)
+      memset(data_DX, 0, sizeof(float) * PyArray_SIZE(%(DX)s));
+
+    Py_DECREF(X);
+    Py_DECREF(sizes);
+    """ % locals() + self._c_decref_list(["Ws", "V_hs", "V_vs", "Ys", "deltas", "epsilons"]) + "}\n"
+
+
+class TwoDLSTMCPUOp(TwoDLSTMCPUOpBase):
+  """
+  Inputs: X, W1..Wn, V_h1..V_hn, V_v1..V_vn, b1..bn, sizes, for n directions.
+  Outputs: Y1..Yn, (gates and cell states) H1..Hn.
+  """
+
+  def make_node(self, X, *args):
+    n = len(self.directions)
+    X = T.as_tensor_variable(X)
+    args = [T.as_tensor_variable(v) for v in args]
+    assert len(args) == 4 * n + 1
+    sizes = args[-1]
+    for v in [X] + args:
+      assert v.dtype == "float32"
+    assert X.ndim == 4
+    expected_ndims = [2] * (3 * n) + [1] * n + [2]
+    for v, expected_ndim in zip(args, expected_ndims):
+      assert v.ndim == expected_ndim, (v, v.ndim, expected_ndim)
+    return theano.Apply(self, [X] + args, [X.type() for _ in range(2 * n)])
+
+  def c_code(self, node, name, input_names, output_names, sub):
+    n = len(self.directions)
+    X = input_names[0]
+    Ws, V_hs, V_vs, bs = [input_names[1 + i * n:1 + (i + 1) * n] for i in range(4)]
+    sizes = input_names[1 + 4 * n]
+    Ys, Hs = output_names[:n], output_names[n:]
+    c_Ys = _c_list(["&" + v for v in Ys])
+    c_Hs = _c_list(["&" + v for v in Hs])
+    return "{\n" + self._c_init(X, sizes) + \
+      self._c_contiguous_list("Ws", Ws) + \
+      self._c_contiguous_list("V_hs", V_hs) + \
+      self._c_contiguous_list("V_vs", V_vs) + \
+      self._c_contiguous_list("bs", bs) + \
+      self._c_data_list("data_V_hs", "const float*", "V_hs") + \
+      self._c_data_list("data_V_vs", "const float*", "V_vs") + \
+      """
+    const npy_intp * W_dim = PyArray_DIMS(Ws[0]);
+    const npy_intp * V_dim = PyArray_DIMS(V_hs[0]);
+    assert(W_dim[1] %% 5 == 0 && "W has wrong shape");
+    assert(5 * V_dim[0] == V_dim[1] && "V has wrong shape");
+    assert(W_dim[1] == V_dim[1]);
+    assert(W_dim[0] == n_in);
+    d.n_cells = W_dim[1] / 5;
+    const int n_gates = 5 * d.n_cells;
+    npy_intp Y_dim[] = {X_dim[0], X_dim[1], X_dim[2], d.n_cells};
+    npy_intp H_dim[] = {X_dim[0], X_dim[1], X_dim[2], n_gates};
+
+    PyArrayObject ** Ys[] = %(c_Ys)s;
+    PyArrayObject ** Hs[] = %(c_Hs)s;
+    float * data_Ys[n_dirs];
+    float * data_Hs[n_dirs];
+    for(int dir = 0; dir < n_dirs; ++dir)
+    {
+      Py_XDECREF(*Ys[dir]);
+      Py_XDECREF(*Hs[dir]);
+      *Ys[dir] = (PyArrayObject*) PyArray_SimpleNew(4, Y_dim, NPY_FLOAT32);
+      *Hs[dir] = (PyArrayObject*) PyArray_SimpleNew(4, H_dim, NPY_FLOAT32);
+      data_Ys[dir] = (float*) PyArray_DATA(*Ys[dir]);
+      data_Hs[dir] = (float*) PyArray_DATA(*Hs[dir]);
+      //H = b + X * W
+      const float * data_b = (const float*) PyArray_DATA(bs[dir]);
+      for(long i = 0; i < n_pos_batch; ++i)
+        memcpy(data_Hs[dir] + i * n_gates, data_b, sizeof(float) * n_gates);
+      mdlstm_cpu_sgemm(false, false, n_pos_batch, n_gates, n_in,
+        (const float*) PyArray_DATA(X), (const float*) PyArray_DATA(Ws[dir]), data_Hs[dir], 1.0f);
+    }
+
+    mdlstm_cpu_fwd(d, n_dirs, flips, data_Hs, data_Ys, data_V_hs, data_V_vs);
+
+    Py_DECREF(X);
+    Py_DECREF(sizes);
+    """ % locals() + self._c_decref_list(["Ws", "V_hs", "V_vs", "bs"]) + "}\n"
+
+  def grad(self, inputs, output_grads):
+    n = len(self.directions)
+    fwd_results = self(*inputs)
+    Ys, Hs = fwd_results[:n], fwd_results[n:]
+    DYs = []
+    for Y, DY in zip(Ys, output_grads[:n]):
+      if isinstance(DY.type, theano.gradient.DisconnectedType):
+        DY = T.zeros_like(Y)
+      DYs.append(DY)
+    grads = TwoDLSTMCPUOpGrad(self.directions)(*(list(inputs) + DYs + list(Ys) + list(Hs)))
+    Dsizes = theano.gradient.grad_undefined(self, len(inputs) - 1, inputs[-1], 'cannot diff w.r.t. sizes')
+    return grads + [Dsizes]
+
+  # noinspection PyMethodMayBeStatic
+  def infer_shape(self, node, input_shapes):
+    n = len(self.directions)
+    Xs, W1s = input_shapes[:2]
+    Y_shape = (Xs[0], Xs[1], Xs[2], W1s[1] // 5)
+    H_shape = (Xs[0], Xs[1], Xs[2], W1s[1])
+    return [Y_shape] * n + [H_shape] * n
+
+
+MultiDirectionalTwoDLSTMCPUOpInstance = TwoDLSTMCPUOp(multi_directions)
+BidirectionalTwoDLSTMCPUOpInstance = TwoDLSTMCPUOp(bi_directions)
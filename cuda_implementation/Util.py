@@ -22,3 +22,8 @@ def get_c_support_code_cudnn():
   base_path = os.path.dirname(__file__)
   with open(base_path + "/c_support_code_cudnn.cpp") as f:
     return f.read()
+
+def get_c_support_code_mdlstm_cpu():
+  base_path = os.path.dirname(__file__)
+  with open(base_path + "/c_support_code_mdlstm_cpu.cpp") as f:
+    return f.read()
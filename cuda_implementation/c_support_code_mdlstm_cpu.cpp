@@ -0,0 +1,316 @@
+//CPU implementation of the multi-directional 2D LSTM, see TwoDLSTMCPUOp.py.
+//This is the same computation as c_support_code_mdlstm.cpp (with STABLE_CELL).
+//All arrays are C-contiguous float32, layout as in the GPU version:
+//X: (height, width, n_minibatch, n_in), H: (height, width, n_minibatch, 5 * n_cells),
+//Y: (height, width, n_minibatch, n_cells), sizes: (n_minibatch, 2) as (img_height, img_width).
+//Every direction scans the image in its own (flipped) coordinates.
+//All positions on one anti-diagonal (in scan coordinates) only depend on the previous anti-diagonal,
+//so we process them (for all directions) in parallel with OpenMP (wavefront order).
+
+#include <vector>
+#include <algorithm>
+#include <string.h>
+#include <math.h>
+using namespace std;
+
+//C = op(A) * op(B) + beta * C, all row-major, C is m x n, op(A) is m x k, op(B) is k x n
+static void mdlstm_cpu_sgemm(bool transA, bool transB, int m, int n, int k,
+  const float * A, const float * B, float * C, float beta)
+{
+  if(m <= 0 || n <= 0)
+  {
+    return;
+  }
+  if(k <= 0)
+  {
+    //sgemm does not touch C in that case
+    for(long i = 0; i < long(m) * n; ++i)
+    {
+      C[i] = (beta == 0.0f) ? 0.0f : C[i] * beta;
+    }
+    return;
+  }
+  //column-major BLAS, thus we calculate C^T = op(B)^T * op(A)^T
+  char ta = transA ? 'T' : 'N';
+  char tb = transB ? 'T' : 'N';
+  int lda = transA ? m : k;
+  int ldb = transB ? k : n;
+  int ldc = n;
+  float alpha = 1.0f;
+  sgemm_(&tb, &ta, &n, &m, &k, &alpha, B, &ldb, A, &lda, &beta, C, &ldc);
+}
+
+static inline int mdlstm_cpu_flip(int i, int n, bool flip)
+{
+  return flip ? (n - 1) - i : i;
+}
+
+static inline float mdlstm_cpu_sigmoid(float x)
+{
+  return 1.f / (1.f + expf(-x));
+}
+
+struct MDLSTMCPUDims
+{
+  int height;
+  int width;
+  int n_minibatch;
+  int n_cells;
+  const float * sizes;
+
+  long pos(int y, int x) const { return long(y) * width + x; }
+  long H_pos_size() const { return long(n_minibatch) * 5 * n_cells; }
+  long Y_pos_size() const { return long(n_minibatch) * n_cells; }
+  float valid(int y, int x, int n) const
+  {
+    //sizes of a single image in the batch, while height/width are the maximum sizes in the batch
+    int img_height = int(sizes[2 * n]);
+    int img_width = int(sizes[2 * n + 1]);
+    return float(y < img_height && x < img_width);
+  }
+};
+
+//the anti-diagonal diag in scan coordinates: (y_high - i, x_low + i) for i in [0, diag_size)
+static inline int mdlstm_cpu_diag(const MDLSTMCPUDims & d, int diag, int & y_high, int & x_low)
+{
+  y_high = min(diag, d.height - 1);
+  x_low = max(diag - d.height + 1, 0);
+  return min(y_high + 1, d.width - x_low);
+}
+
+//H must contain b + X * W already. Will be overwritten with the gate activations and cell states.
+static void mdlstm_cpu_fwd_pos(const MDLSTMCPUDims & d, bool flip_y, bool flip_x, int y, int x,
+  float * H, float * Y, const float * V_h, const float * V_v)
+{
+  const int n_cells = d.n_cells;
+  const int sy = mdlstm_cpu_flip(y, d.height, flip_y);
+  const int sx = mdlstm_cpu_flip(x, d.width, flip_x);
+  float * data_H = H + d.pos(sy, sx) * d.H_pos_size();
+  float * data_Y = Y + d.pos(sy, sx) * d.Y_pos_size();
+  const float * data_H_y = 0;
+  const float * data_H_x = 0;
+  if(y > 0)
+  {
+    long p = d.pos(mdlstm_cpu_flip(y - 1, d.height, flip_y), sx);
+    data_H_y = H + p * d.H_pos_size();
+    //H += Y[y-1,x] * V_v
+    mdlstm_cpu_sgemm(false, false, d.n_minibatch, 5 * n_cells, n_cells, Y + p * d.Y_pos_size(), V_v, data_H, 1.0f);
+  }
+  if(x > 0)
+  {
+    long p = d.pos(sy, mdlstm_cpu_flip(x - 1, d.width, flip_x));
+    data_H_x = H + p * d.H_pos_size();
+    //H += Y[y,x-1] * V_h
+    mdlstm_cpu_sgemm(false, false, d.n_minibatch, 5 * n_cells, n_cells, Y + p * d.Y_pos_size(), V_h, data_H, 1.0f);
+  }
+
+  //layout (for every mini-batch):
+  //H[0*n_cells..1*n_cells-1] : input gate
+  //H[1*n_cells..2*n_cells-1] : forget gate
+  //H[2*n_cells..3*n_cells-1] : lambda gate
+  //H[3*n_cells..4*n_cells-1] : output gate
+  //H[4*n_cells..5*n_cells-1] : cell state
+  for(int n = 0; n < d.n_minibatch; ++n)
+  {
+    const float valid = d.valid(sy, sx, n);
+    for(int c = 0; c < n_cells; ++c)
+    {
+      const long start = long(n) * 5 * n_cells + c;
+      float inpGate = mdlstm_cpu_sigmoid(data_H[start]);
+      float fgtGate = mdlstm_cpu_sigmoid(data_H[start + n_cells]);
+      float lambdaGate = mdlstm_cpu_sigmoid(data_H[start + 2 * n_cells]);
+      float outGate = mdlstm_cpu_sigmoid(data_H[start + 3 * n_cells]);
+      float state = inpGate * tanhf(data_H[start + 4 * n_cells]);
+      if(data_H_y)
+      {
+        state += fgtGate * lambdaGate * data_H_y[start + 4 * n_cells];
+      }
+      if(data_H_x)
+      {
+        state += fgtGate * (1.0f - lambdaGate) * data_H_x[start + 4 * n_cells];
+      }
+      state *= valid;
+
+      data_Y[long(n) * n_cells + c] = outGate * tanhf(state) * valid;
+
+      data_H[start] = inpGate;
+      data_H[start + n_cells] = fgtGate;
+      data_H[start + 2 * n_cells] = lambdaGate;
+      data_H[start + 3 * n_cells] = outGate;
+      data_H[start + 4 * n_cells] = state;
+    }
+  }
+}
+
+//flips: 2 * n_dirs, (flip_y, flip_x) for every direction
+void mdlstm_cpu_fwd(const MDLSTMCPUDims & d, int n_dirs, const int * flips,
+  float ** Hs, float ** Ys, const float ** V_hs, const float ** V_vs)
+{
+  const int n_diags = d.width + d.height - 1;
+  for(int diag = 0; diag < n_diags; ++diag)
+  {
+    int y_high, x_low;
+    const int diag_size = mdlstm_cpu_diag(d, diag, y_high, x_low);
+    const int n_jobs = n_dirs * diag_size;
+    #pragma omp parallel for schedule(static)
+    for(int job = 0; job < n_jobs; ++job)
+    {
+      const int dir = job / diag_size;
+      const int i = job % diag_size;
+      mdlstm_cpu_fwd_pos(d, flips[2 * dir], flips[2 * dir + 1], y_high - i, x_low + i,
+        Hs[dir], Ys[dir], V_hs[dir], V_vs[dir]);
+    }
+  }
+}
+
+//delta: gate activations and cell states from the forward pass, will be overwritten with the derivatives w.r.t. H.
+//epsilon: derivatives w.r.t. Y, we will add the recurrent part.
+//workmem: (2, height, width, n_minibatch, n_cells), the cell state derivatives passed to the previous positions in y/x.
+static void mdlstm_cpu_bwd_pos(const MDLSTMCPUDims & d, bool flip_y, bool flip_x, int y, int x,
+  float * delta, float * epsilon, float * workmem, const float * Y, const float * V_h, const float * V_v)
+{
+  const int n_cells = d.n_cells;
+  const long workmem_size = long(d.height) * d.width * d.Y_pos_size();
+  const int sy = mdlstm_cpu_flip(y, d.height, flip_y);
+  const int sx = mdlstm_cpu_flip(x, d.width, flip_x);
+  const long p = d.pos(sy, sx);
+  float * data_delta = delta + p * d.H_pos_size();
+  float * data_epsilon = epsilon + p * d.Y_pos_size();
+  const float * data_Y = Y + p * d.Y_pos_size();
+  float * data_epsilon_y = workmem + p * d.Y_pos_size();
+  float * data_epsilon_x = workmem + workmem_size + p * d.Y_pos_size();
+  const float * data_next_epsilon_y = 0;
+  const float * data_next_epsilon_x = 0;
+  const float * data_last_state_y = 0;
+  const float * data_last_state_x = 0;
+  if(y < d.height - 1)
+  {
+    long p_next = d.pos(mdlstm_cpu_flip(y + 1, d.height, flip_y), sx);
+    data_next_epsilon_y = workmem + p_next * d.Y_pos_size();
+    //epsilon += delta[y+1,x] * V_v^T
+    mdlstm_cpu_sgemm(false, true, d.n_minibatch, n_cells, 5 * n_cells, delta + p_next * d.H_pos_size(), V_v,
+      data_epsilon, 1.0f);
+  }
+  if(x < d.width - 1)
+  {
+    long p_next = d.pos(sy, mdlstm_cpu_flip(x + 1, d.width, flip_x));
+    data_next_epsilon_x = workmem + workmem_size + p_next * d.Y_pos_size();
+    //epsilon += delta[y,x+1] * V_h^T
+    mdlstm_cpu_sgemm(false, true, d.n_minibatch, n_cells, 5 * n_cells, delta + p_next * d.H_pos_size(), V_h,
+      data_epsilon, 1.0f);
+  }
+  //not yet overwritten because we go backwards
+  if(y > 0)
+  {
+    data_last_state_y = delta + d.pos(mdlstm_cpu_flip(y - 1, d.height, flip_y), sx) * d.H_pos_size() + 4 * n_cells;
+  }
+  if(x > 0)
+  {
+    data_last_state_x = delta + d.pos(sy, mdlstm_cpu_flip(x - 1, d.width, flip_x)) * d.H_pos_size() + 4 * n_cells;
+  }
+
+  for(int n = 0; n < d.n_minibatch; ++n)
+  {
+    const float valid = d.valid(sy, sx, n);
+    for(int c = 0; c < n_cells; ++c)
+    {
+      const long start = long(n) * 5 * n_cells + c;
+      const long inner_idx = long(n) * n_cells + c;
+      float inpGate = data_delta[start];
+      float fgtGate = data_delta[start + n_cells];
+      float lambdaGate = data_delta[start + 2 * n_cells];
+      float outGate = data_delta[start + 3 * n_cells];
+      float state = data_delta[start + 4 * n_cells];
+      float lastState_y = data_last_state_y ? data_last_state_y[start] : 0.f;
+      float lastState_x = data_last_state_x ? data_last_state_x[start] : 0.f;
+      float eps = data_epsilon[inner_idx];
+
+      //avoid division by 0
+      float gc = 0.f; //g(c(t))
+      float gzc = 0.f; //g(z_c(t))
+      if(outGate != 0)
+      {
+        gc = data_Y[inner_idx] / outGate;
+      }
+      if(inpGate != 0)
+      {
+        gzc = (state - fgtGate * lambdaGate * lastState_y - fgtGate * (1.0f - lambdaGate) * lastState_x) / inpGate;
+      }
+
+      //delta_output
+      data_delta[start + 3 * n_cells] = outGate * (1.f - outGate) * gc * eps * valid;
+
+      //epsilon_c
+      float epsilon_c = (1.f - (gc * gc)) * outGate * eps;
+      if(data_next_epsilon_y)
+      {
+        epsilon_c += data_next_epsilon_y[inner_idx];
+      }
+      if(data_next_epsilon_x)
+      {
+        epsilon_c += data_next_epsilon_x[inner_idx];
+      }
+
+      data_epsilon_y[inner_idx] = epsilon_c * fgtGate * lambdaGate * valid;
+      data_epsilon_x[inner_idx] = epsilon_c * fgtGate * (1.0f - lambdaGate) * valid;
+
+      //delta_cell
+      data_delta[start + 4 * n_cells] = inpGate * (1.f - (gzc * gzc)) * epsilon_c * valid;
+      //delta_forget
+      data_delta[start + n_cells] = fgtGate * (1.f - fgtGate) * epsilon_c *
+                                    (lastState_y * lambdaGate + lastState_x * (1.0f - lambdaGate)) * valid;
+      //delta_lambda
+      data_delta[start + 2 * n_cells] = fgtGate * lambdaGate * (1.f - lambdaGate) * epsilon_c
+                                        * (lastState_y - lastState_x) * valid;
+      //delta_input
+      data_delta[start] = inpGate * (1.f - inpGate) * gzc * epsilon_c * valid;
+    }
+  }
+}
+
+void mdlstm_cpu_bwd(const MDLSTMCPUDims & d, int n_dirs, const int * flips,
+  float ** deltas, float ** epsilons, float ** workmems, const float ** Ys, const float ** V_hs, const float ** V_vs)
+{
+  const int n_diags = d.width + d.height - 1;
+  for(int diag = n_diags - 1; diag >= 0; --diag)
+  {
+    int y_high, x_low;
+    const int diag_size = mdlstm_cpu_diag(d, diag, y_high, x_low);
+    const int n_jobs = n_dirs * diag_size;
+    #pragma omp parallel for schedule(static)
+    for(int job = 0; job < n_jobs; ++job)
+    {
+      const int dir = job / diag_size;
+      const int i = job % diag_size;
+      mdlstm_cpu_bwd_pos(d, flips[2 * dir], flips[2 * dir + 1], y_high - i, x_low + i,
+        deltas[dir], epsilons[dir], workmems[dir], Ys[dir], V_hs[dir], V_vs[dir]);
+    }
+  }
+}
+
+//DV_h = sum over all positions (in scan coordinates) Y[y,x-1]^T * delta[y,x], DV_v accordingly with Y[y-1,x]
+void mdlstm_cpu_grad_V(const MDLSTMCPUDims & d, bool flip_y, bool flip_x,
+  const float * delta, const float * Y, float * DV_h, float * DV_v)
+{
+  const int n_cells = d.n_cells;
+  memset(DV_h, 0, sizeof(float) * n_cells * 5 * n_cells);
+  memset(DV_v, 0, sizeof(float) * n_cells * 5 * n_cells);
+  //the previous position in scan coordinates is the next one in storage if we flip
+  if(d.width > 1)
+  {
+    for(int sy = 0; sy < d.height; ++sy)
+    {
+      const float * data_Y = Y + d.pos(sy, flip_x ? 1 : 0) * d.Y_pos_size();
+      const float * data_delta = delta + d.pos(sy, flip_x ? 0 : 1) * d.H_pos_size();
+      mdlstm_cpu_sgemm(true, false, n_cells, 5 * n_cells, (d.width - 1) * d.n_minibatch,
+        data_Y, data_delta, DV_h, 1.0f);
+    }
+  }
+  if(d.height > 1)
+  {
+    const float * data_Y = Y + d.pos(flip_y ? 1 : 0, 0) * d.Y_pos_size();
+    const float * data_delta = delta + d.pos(flip_y ? 0 : 1, 0) * d.H_pos_size();
+    mdlstm_cpu_sgemm(true, false, n_cells, 5 * n_cells, (d.height - 1) * d.width * d.n_minibatch,
+      data_Y, data_delta, DV_v, 1.0f);
+  }
+}
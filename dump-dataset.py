@@ -8,13 +8,24 @@ import numpy
 from better_exchook import pretty_print
 
 
+def save_numpy(filename, data, fmt='%.18e'):
+  """
+  Binary if the filename ends with ".npy", otherwise text (numpy.savetxt).
+  NumpyDumpDataset can read both.
+  """
+  if filename.endswith(".npy"):
+    numpy.save(filename, data)
+  else:
+    numpy.savetxt(filename, data, fmt=fmt)
+
+
 def dump_dataset(dataset, options):
   """
   :type dataset: Dataset.Dataset
   :param options: argparse.Namespace
   """
   print >> log.v3, "Epoch: %i" % options.epoch
-  rnn.train_data.init_seq_order(options.epoch)
+  dataset.init_seq_order(options.epoch)
 
   if options.type == "numpy":
     print >> log.v3, "Dump files: %r*%r" % (options.dump_prefix, options.dump_postfix)
@@ -28,13 +39,13 @@ def dump_dataset(dataset, options):
     dataset.load_seqs(seq_idx, seq_idx + 1)
     data = dataset.get_data(seq_idx, "data")
     if options.type == "numpy":
-      numpy.savetxt("%s%i.data%s" % (options.dump_prefix, seq_idx, options.dump_postfix), data)
+      save_numpy("%s%i.data%s" % (options.dump_prefix, seq_idx, options.dump_postfix), data)
     elif options.type == "stdout":
       print "seq %i data:" % seq_idx, pretty_print(data)
     for target in dataset.get_target_list():
       targets = dataset.get_targets(target, seq_idx)
       if options.type == "numpy":
-        numpy.savetxt("%s%i.targets.%s%s" % (options.dump_prefix, seq_idx, target, options.dump_postfix), targets, fmt='%i')
+        save_numpy("%s%i.targets.%s%s" % (options.dump_prefix, seq_idx, target, options.dump_postfix), targets, fmt='%i')
       elif options.type == "stdout":
         print "seq %i target %r:" % (seq_idx, target), pretty_print(targets)
 
@@ -65,7 +76,7 @@ def main(argv):
   argparser.add_argument('--endseq', type=int, default=float('inf'), help='end seq idx (inclusive) (default: inf)')
   argparser.add_argument('--type', default='numpy', help="'numpy' or 'stdout'")
   argparser.add_argument('--dump_prefix', default='/tmp/crnn.dump-dataset.')
-  argparser.add_argument('--dump_postfix', default='.txt.gz')
+  argparser.add_argument('--dump_postfix', default='.txt.gz', help="'.npy' for binary files (default: .txt.gz)")
   args = argparser.parse_args(argv[1:])
   init(configFilename=args.crnn_config_file, commandLineOptions=[])
   dump_dataset(rnn.train_data, args)
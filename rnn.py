@@ -420,7 +420,7 @@ def executeMainTask():
   elif task == 'analyze':  # anything based on the network + Device
     statistics = config.list('statistics', ['confusion_matrix'])
     engine.init_network_from_config(config)
-    engine.analyze(engine.devices[0], eval_data, statistics)
+    engine.analyze(data=eval_data, statistics=statistics, batch_size=config.int('forward_batch_size', 0))
   elif task == "analyze_data":  # anything just based on the data
     analyze_data(config)
   elif task == "classify":
@@ -428,17 +428,57 @@ def executeMainTask():
     assert config.has('label_file'), 'no output file provided'
     label_file = config.value('label_file', '')
     engine.init_network_from_config(config)
-    engine.classify(engine.devices[0], eval_data, label_file)
+    engine.classify(data=eval_data, output_file=label_file, batch_size=config.int('forward_batch_size', 0))
   elif task == "daemon":
     engine.init_network_from_config(config)
-    engine.daemon()
+    engine.daemon(config)
   else:
     assert False, "unknown task: %s" % task
 
   print >> log.v3, ("elapsed: %f" % (time.time() - st))
 
 
+_analyze_data_dataset = None; " :type: Dataset.Dataset "  # see analyze_data()
+
+
+def _analyze_data_seq_range(args):
+  """
+  Collects the statistics for analyze_data() over the seq range [start,end) of _analyze_data_dataset.
+  This is called in a worker process, which has a (forked) copy of the dataset.
+
+  :param (int,int|None,str,str,str,bool) args: start, end (None: until the end), target, data_key, dtype, show_progress
+  :return: target class counts, data moments
+  :rtype: (numpy.ndarray, Util.MomentsAccumulator)
+  """
+  start, end, target, data_key, dtype, show_progress = args
+  from Util import progress_bar_with_time, MomentsAccumulator
+  ds = _analyze_data_dataset
+  priors = numpy.zeros((ds.get_data_dim(target),), dtype=dtype)
+  moments = MomentsAccumulator(ds.get_data_dim(data_key), dtype=dtype)
+  seq_idx = start
+  while ds.is_less_than_num_seqs(seq_idx) and (end is None or seq_idx < end):
+    if show_progress:
+      if end is None:
+        progress_bar_with_time(ds.get_complete_frac(seq_idx))
+      else:
+        progress_bar_with_time(float(seq_idx - start) / (end - start))
+    ds.load_seqs(seq_idx, seq_idx + 1)
+    targets = ds.get_data(seq_idx, target)
+    priors += numpy.bincount(numpy.asarray(targets, dtype="int64"), minlength=priors.shape[0])
+    moments.add(ds.get_data(seq_idx, data_key))
+    seq_idx += 1
+  return priors, moments
+
+
 def analyze_data(config):
+  """
+  Calculates the log priors of the target classes and the mean and std-dev of the input data,
+  and stores them in text files.
+  With analyze_data_num_workers > 1, the dataset is split into seq ranges, which are processed
+  in parallel by forked worker processes, and the partial statistics are merged.
+  For this, the dataset must know its num seqs and support loading from any seq idx, like HDFDataset.
+  """
+  global _analyze_data_dataset
   dss = config.value('analyze_dataset', 'train')
   ds = {"train": train_data, "dev": dev_data, "eval": eval_data}[dss]
   epoch = config.int('epoch', 1)
@@ -448,33 +488,42 @@ def analyze_data(config):
   dtype = config.value('statistics_dtype', 'float64')
   target = config.value('target', 'classes')
   data_key = config.value('data_key', 'data')
+  num_workers = config.int('analyze_data_num_workers', 1)
   assert ds.is_data_sparse(target), "need for prior calculation"
   assert not ds.is_data_sparse(data_key), "needed for mean/var estimation"
-  from Util import inplace_increment, progress_bar_with_time, NumbersDict
 
-  priors = numpy.zeros((ds.get_data_dim(target),), dtype=dtype)
-  mean = numpy.zeros((ds.get_data_dim(data_key),), dtype=dtype)
-  mean_sq = numpy.zeros((ds.get_data_dim(data_key),), dtype=dtype)
-  total_targets_len = 0
-  total_data_len = 0
-
-  seq_idx = 0
-  while ds.is_less_than_num_seqs(seq_idx):
-    progress_bar_with_time(ds.get_complete_frac(seq_idx))
-    ds.load_seqs(seq_idx, seq_idx + 1)
-    targets = ds.get_data(seq_idx, target)
-    inplace_increment(priors, targets, 1)
-    total_targets_len += targets.shape[0]
-    data = ds.get_data(seq_idx, data_key)
-    new_total_data_len = total_data_len + data.shape[0]
-    f = float(total_data_len) / new_total_data_len
-    mean = mean * f + numpy.sum(data, axis=0) * (1.0 - f)
-    mean_sq = mean_sq * f + numpy.sum(data * data, axis=0) * (1.0 - f)
-    total_data_len = new_total_data_len
-    seq_idx += 1
+  _analyze_data_dataset = ds
+  num_seqs = None
+  if num_workers > 1:
+    try:
+      num_seqs = ds.num_seqs
+    except Exception:  # e.g. NotImplementedError
+      print >> log.v2, "Analyze dataset: num seqs unknown, cannot use multiple workers."
+  if num_seqs is not None:
+    import multiprocessing
+    # Contiguous seq ranges, so that every worker reads sequentially.
+    bounds = [num_seqs * i // num_workers for i in range(num_workers + 1)]
+    ranges = [(bounds[i], bounds[i + 1], target, data_key, dtype, i == 0) for i in range(num_workers)]
+    print >> log.v3, "Analyze dataset with %i workers" % num_workers
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      results = pool.map(_analyze_data_seq_range, ranges)
+    finally:
+      pool.terminate()
+  else:
+    results = [_analyze_data_seq_range((0, None, target, data_key, dtype, True))]
+  _analyze_data_dataset = None
+  priors, moments = results[0]
+  for other_priors, other_moments in results[1:]:
+    priors += other_priors
+    moments.merge(other_moments)
+
+  total_targets_len = int(priors.sum())
+  total_data_len = moments.count
   log_priors = numpy.log(priors)
-  log_priors -= numpy.log(NumbersDict(ds.get_num_timesteps())[target])
-  var = numpy.sqrt(mean_sq - mean * mean)
+  log_priors -= numpy.log(total_targets_len)
+  mean = moments.mean()
+  var = numpy.sqrt(moments.var())
   print >> log.v1, "Finished. %i total target frames, %i total data frames" % (total_targets_len, total_data_len)
   priors_fn = stat_prefix + ".log_priors.txt"
   mean_fn = stat_prefix + ".mean.txt"
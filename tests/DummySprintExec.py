@@ -6,6 +6,8 @@
 
 import sys
 import os
+import time
+import numpy
 from importlib import import_module
 
 # Add parent dir to Python path so that we can use GeneratingDataset and other CRNN code.
@@ -45,11 +47,53 @@ class ArgParser:
       i += 1
 
 
+def dummy_loss_and_error_signal(posteriors):
+  """
+  What we calculate in PythonControl mode, instead of a real Sprint criterion.
+  :param numpy.ndarray posteriors: 2d (time,label), log probs
+  :return: loss, error_signal (time,label). loss is the negative sum of the best log probs,
+    error_signal is the softmax of the posteriors minus the 1-hot of the best label.
+  :rtype: (float, numpy.ndarray)
+  """
+  best = posteriors.argmax(axis=1)
+  loss = -float(posteriors.max(axis=1).sum())
+  error_signal = numpy.exp(posteriors - posteriors.max(axis=1)[:, None])
+  error_signal /= error_signal.sum(axis=1)[:, None]
+  error_signal[numpy.arange(posteriors.shape[0]), best] -= 1
+  return loss, error_signal.astype("float32")
+
+
+def python_control_main(args):
+  """
+  Emulates Sprint PythonControl (--*.python-control-enabled=true), as used by SprintErrorSignals.
+  Every segment takes "seg-sleep-time" (in secs) per frame, to simulate the Sprint calculation.
+  """
+  SprintAPI = import_module(args.get("pymod-name"))
+  seg_sleep_time = float(args.get("seg-sleep-time", 0))
+
+  def callback(action, *cb_args, **cb_kwargs):
+    if action == "version":
+      return "DummySprintExec"
+    if action == "get_loss_and_error_signal":
+      seg_name, seg_len, posteriors = cb_args
+      time.sleep(seg_sleep_time * seg_len)
+      return dummy_loss_and_error_signal(posteriors)
+    raise NotImplementedError("action = %s" % action)
+
+  control = SprintAPI.init(name="Sprint.PythonControl", reference=None, config=args.get("pymod-config", ""),
+                           sprint_unit="NnTrainer.pythonControl", version_number=2, callback=callback)
+  control.run_control_loop(callback)
+
+
 def main(argv):
   print "DummySprintExec init", argv
   args = ArgParser()
   args.parse(argv[1:])
 
+  if args.get("python-control-enabled") == "true":
+    python_control_main(args)
+    return
+
   if args.get("pymod-name"):
     SprintAPI = import_module(args.get("pymod-name"))
   else:
@@ -0,0 +1,75 @@
+"""
+Small CPU-only setups shared by the tests:
+a config with an LSTM+softmax network, a feed-forward training network and a random toy dataset.
+"""
+
+import numpy
+from Config import Config
+from Device import Device
+from GeneratingDataset import StaticDataset
+from Network import LayerNetwork
+
+
+def make_cpu_config(task, num_outputs=2, n_hidden=4):
+  """
+  :param str task:
+  :param int num_outputs: number of classes
+  :param int n_hidden: size of the forward LSTM layer
+  :rtype: Config
+  """
+  config = Config()
+  config.update({
+    "multiprocessing": False,
+    "blocking": True,
+    "device": "cpu",
+    "task": task,
+    "num_inputs": 3,
+    "num_outputs": num_outputs,
+  })
+  config.network_topology_json = """
+  {
+  "fw": {"class": "rec", "unit": "lstm", "n_out": %i},
+  "output": {"class": "softmax", "loss": "ce", "from": ["fw"]}
+  }
+  """ % n_hidden
+  return config
+
+
+def make_network_and_devices(task, num_devices=1, **kwargs):
+  """
+  :param str task:
+  :param int num_devices:
+  :param kwargs: passed to make_cpu_config()
+  :rtype: (LayerNetwork, list[Device])
+  """
+  config = make_cpu_config(task, **kwargs)
+  network = LayerNetwork.from_config_topology(config)
+  devices = [Device("cpu", config=config, blocking=True) for i in range(num_devices)]
+  return network, devices
+
+
+def make_hidden_softmax_network(**output_opts):
+  """
+  :param output_opts: extra options for the output layer, e.g. compute_priors=True
+  :return: hidden(tanh, 5) + softmax network with declared train params
+  :rtype: LayerNetwork
+  """
+  json_content = {"hidden": {"class": "hidden", "activation": "tanh", "n_out": 5},
+                  "output": dict({"class": "softmax", "loss": "ce", "from": ["hidden"]}, **output_opts)}
+  network = LayerNetwork.from_json(json_content, n_in=3, n_out={"classes": [4, 1]}, train_flag=True)
+  network.declare_train_params()
+  return network
+
+
+def make_toy_dataset(seq_lens, num_classes=2):
+  """
+  :param list[int] seq_lens:
+  :param int num_classes:
+  :return: dataset with random 3-dim float32 "data" and random "classes"
+  :rtype: StaticDataset
+  """
+  rnd = numpy.random.RandomState(42)
+  seqs = [{"data": rnd.uniform(-1, 1, (n, 3)).astype("float32"),
+           "classes": rnd.randint(0, num_classes, (n,)).astype("int32")}
+          for n in seq_lens]
+  return StaticDataset(data=seqs, output_dim={"classes": num_classes})
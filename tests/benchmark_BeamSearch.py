@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the beam search decoding of RecurrentUnitLayer (option beam_search, see BeamSearch)
+with an attention decoder on the toy copy task of GeneratingDataset.CopyTaskDataset.
+The network is not trained, we only measure the decoding throughput on CPU,
+for a single sequence per batch and for many sequences per batch.
+Run it from the tests directory, e.g.: python benchmark_BeamSearch.py
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import numpy
+import theano
+from GeneratingDataset import CopyTaskDataset
+from Network import LayerNetwork
+from NetworkBaseLayer import Container
+from Log import log
+
+
+def make_network(n_symbols, beam_search):
+  dec = {"class": "rec", "unit": "lstme", "n_out": 64, "from": ["null"], "base": ["enc"], "target": "classes",
+         "recurrent_transform": "attention_list", "attention_lm": "hard", "attention_template": 64}
+  if beam_search:
+    dec["beam_search"] = beam_search
+  json_content = {"enc": {"class": "rec", "unit": "lstm", "n_out": 64},
+                  "dec": dec,
+                  "output": {"class": "softmax", "loss": "ce", "from": ["dec"], "target": "classes"}}
+  return LayerNetwork.from_json(json_content, n_in=n_symbols, n_out={"classes": [n_symbols, 1]}, train_flag=False)
+
+
+def make_batches(dataset, max_seqs):
+  """
+  :returns list of (data, index), data as 1-hot (time,batch,dim), index (time,batch)
+  """
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, dataset.num_seqs)
+  seqs = [dataset.get_data(i, "data") for i in range(dataset.num_seqs)]
+  batches = []
+  for start in range(0, len(seqs), max_seqs):
+    batch_seqs = seqs[start:start + max_seqs]
+    n_time = max([len(s) for s in batch_seqs])
+    data = numpy.zeros((n_time, len(batch_seqs), dataset.num_inputs), dtype="float32")
+    index = numpy.zeros((n_time, len(batch_seqs)), dtype="int8")
+    for b, s in enumerate(batch_seqs):
+      data[numpy.arange(len(s)), b, s] = 1
+      index[:len(s), b] = 1
+    batches.append((data, index))
+  return batches
+
+
+def main():
+  log.initialize(verbosity=[0])
+  Container.initialize_rng()
+  n_symbols = 8
+  dataset = CopyTaskDataset(nsymbols=n_symbols, minlen=5, maxlen=20, num_seqs=128)
+  for beam_search in [0, 1, 4, 8]:
+    network = make_network(n_symbols, beam_search)
+    f = theano.function([network.x, network.i, network.j["classes"]],
+                        network.output["output"].p_y_given_x, on_unused_input='ignore')
+    for max_seqs in [1, 64]:
+      batches = make_batches(dataset, max_seqs)
+      f(*(batches[0] + batches[0][1:]))  # warm up
+      num_frames = sum([index.sum() for _, index in batches])
+      start = time.time()
+      for data, index in batches:
+        f(data, index, index)
+      elapsed = time.time() - start
+      print("beam_search %i, %i seqs per batch: %.1f frames/sec" % (beam_search, max_seqs, num_frames / elapsed))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark of Util.NumbersDict and of the batch planning in Dataset._generate_batches,
+which does NumbersDict arithmetic for every sequence.
+Run it from the tests directory, e.g.: python benchmark_NumbersDict.py
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timeit
+import numpy
+from Dataset import Dataset
+from Util import NumbersDict
+from Log import log
+
+
+class LengthsDataset(Dataset):
+  """
+  Only provides seq lengths, which is all the batch planning needs.
+  """
+
+  def __init__(self, seq_lens, **kwargs):
+    super(LengthsDataset, self).__init__(**kwargs)
+    self._seq_lens = [NumbersDict({"data": l, "classes": l}) for l in seq_lens]
+    self._num_seqs = len(seq_lens)
+
+  def is_less_than_num_seqs(self, n):
+    return n < self._num_seqs
+
+  def get_seq_length(self, seq_idx):
+    return self._seq_lens[seq_idx]
+
+
+def bench(name, func, number):
+  t = min(timeit.repeat(func, number=number, repeat=3))
+  print("%s: %.2f usec per call" % (name, t / number * 1e6))
+
+
+def main():
+  log.initialize(verbosity=[0])
+  a = NumbersDict({"data": 11, "classes": 7})
+  b = NumbersDict({"data": 5, "classes": 3})
+  number = 100000
+  bench("a + b", lambda: a + b, number)
+  bench("a - 3", lambda: a - 3, number)
+  bench("a == b", lambda: a == b, number)
+  bench("NumbersDict.max([a, b])", lambda: NumbersDict.max([a, b]), number)
+  bench("a.max_value()", lambda: a.max_value(), number)
+  bench("NumbersDict(a)", lambda: NumbersDict(a), number)
+
+  seq_lens = numpy.random.RandomState(42).randint(50, 1000, size=(20000,)).tolist()
+  for recurrent_net, chunking in [(True, "0"), (True, "100:50"), (False, "0")]:
+    dataset = LengthsDataset(seq_lens=seq_lens, chunking=chunking)
+    dataset.init_seq_order(epoch=1)
+
+    def plan_batches():
+      for _ in dataset._generate_batches(recurrent_net=recurrent_net, batch_size=5000, max_seqs=40):
+        pass
+
+    bench("_generate_batches(recurrent_net=%r, chunking=%r), %i seqs" % (
+          recurrent_net, chunking, len(seq_lens)), plan_batches, 1)
+
+if __name__ == "__main__":
+  main()
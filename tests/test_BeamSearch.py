@@ -0,0 +1,95 @@
+
+import itertools
+from nose.tools import assert_equal
+import numpy
+import numpy.testing
+import theano
+import theano.tensor as T
+from BeamSearch import beam_search_initial_scores, beam_search_step, beam_search_backtrack, beam_search_gather
+from Network import LayerNetwork
+from NetworkBaseLayer import Container
+from Log import log
+
+log.initialize()
+Container.initialize_rng()
+
+
+def test_beam_search_exact_for_markov_chain():
+  # With a first order Markov model and beam_size >= n_classes, beam search finds the best sequence.
+  rnd = numpy.random.RandomState(42)
+  n_time, n_batch, n_classes = 4, 3, 3
+  beam_size = n_classes
+  log_trans = numpy.log(rnd.dirichlet(numpy.ones(n_classes), size=(n_batch, n_classes))).astype("float32")
+  lens = [4, 2, 3]
+  index = numpy.zeros((n_time, n_batch * beam_size), dtype="float32")
+  for b, l in enumerate(lens):
+    index[:l, b * beam_size:(b + 1) * beam_size] = 1
+
+  trans = T.constant(log_trans).repeat(beam_size, axis=0)  # (batch*beam,classes,classes)
+  rows = T.arange(n_batch * beam_size)
+
+  def step(i_t, prev_labels, scores):
+    log_probs = trans[rows, prev_labels]
+    scores, labels, parents = beam_search_step(log_probs, scores, i_t, beam_size)
+    return labels, scores, parents
+
+  (labels, scores, parents), _ = theano.scan(
+    step, sequences=[T.constant(index)],
+    outputs_info=[T.zeros((n_batch * beam_size,), "int32"),
+                  beam_search_initial_scores(n_batch * beam_size, beam_size), None])
+  best_rows = beam_search_backtrack(scores, parents, beam_size)
+  f = theano.function([], [beam_search_gather(labels, best_rows), beam_search_gather(scores, best_rows)[-1]])
+  best_labels, best_scores = f()
+  assert_equal(best_labels.shape, (n_time, n_batch))
+
+  for b, l in enumerate(lens):
+    def score(seq):
+      return sum([log_trans[b, prev, cur] for prev, cur in zip((0,) + seq[:-1], seq)])
+    ref = max(itertools.product(range(n_classes), repeat=l), key=score)
+    assert_equal(tuple(best_labels[:l, b]), ref)
+    numpy.testing.assert_allclose(best_scores[b], score(ref), rtol=1e-5)
+    assert (best_labels[l:, b] == 0).all()
+
+
+def _make_decoder_network(beam_search, recurrent_transform):
+  dec = {"class": "rec", "unit": "lstme", "n_out": 6, "from": ["null"], "base": ["enc"], "target": "classes",
+         "recurrent_transform": recurrent_transform, "attention_lm": "hard", "attention_template": 6}
+  if beam_search:
+    dec["beam_search"] = beam_search
+  json_content = {"enc": {"class": "rec", "unit": "lstm", "n_out": 6},
+                  "dec": dec,
+                  "output": {"class": "softmax", "loss": "ce", "from": ["dec"], "target": "classes"}}
+  return LayerNetwork.from_json(json_content, n_in=3, n_out={"classes": [4, 1]}, train_flag=False)
+
+
+def _check_beam_search_greedy(recurrent_transform):
+  rnd = numpy.random.RandomState(2)
+  networks = [_make_decoder_network(beam_search, recurrent_transform) for beam_search in [0, 1, 3]]
+  params = {layer_name: {param_name: rnd.uniform(-1, 1, value.shape).astype("float32")
+                         for param_name, value in layer_params.items()}
+            for layer_name, layer_params in networks[0].get_params_dict().items()}
+  x = rnd.uniform(-1, 1, (8, 2, 3)).astype("float32")
+  index = numpy.ones((8, 2), dtype="int8")
+  index[3:, 1] = 0
+  outputs = []
+  for network in networks:
+    network.set_params_by_dict(params)
+    dec = network.hidden["dec"]
+    beam_outputs = [dec.beam_labels, dec.beam_scores] if dec.beam_search else []
+    f = theano.function([network.x, network.i, network.j["classes"]],
+                        [network.output["output"].p_y_given_x] + beam_outputs, on_unused_input='ignore')
+    outputs.append(f(x, index, index))
+  greedy, beam1, beam3 = outputs
+  numpy.testing.assert_allclose(beam1[0], greedy[0], rtol=1e-5)
+  assert_equal(beam3[0].shape, greedy[0].shape)
+  assert_equal(beam3[1].shape, (8, 2))
+  assert (beam3[1][3:, 1] == 0).all()
+  assert (beam3[2] <= 0).all()
+
+
+def test_beam_search_greedy_attention_list():
+  _check_beam_search_greedy("attention_list")
+
+
+def test_beam_search_greedy_lm():
+  _check_beam_search_greedy("lm")
@@ -159,3 +159,52 @@ def test_batches_non_recurrent_1():
   assert_equal(all_batches[3].seqs[0].frame_length, 5)
   assert_equal(all_batches[3].seqs[0].batch_slice, 0)
   assert_equal(all_batches[3].seqs[0].batch_frame_offset, 0)
+
+
+def _get_seq_order_for_epoch_reference(seq_ordering, epoch, num_seqs, get_seq_len):
+  """
+  The former list based implementation of Dataset.get_seq_order_for_epoch().
+  """
+  from random import Random
+  seq_index = list(range(num_seqs))
+  if seq_ordering == 'default':
+    pass
+  elif seq_ordering == 'sorted':
+    seq_index.sort(key=get_seq_len)
+  elif seq_ordering.startswith('laplace'):
+    tmp = seq_ordering.split(':')
+    bins = int(tmp[1]) if len(tmp) > 1 else 2
+    nth = int(tmp[2]) if len(tmp) > 2 else 1
+    rnd = Random(((epoch - 1) / nth + 1) if epoch else 1)
+    rnd.shuffle(seq_index)
+    out_index = []
+    for i in xrange(bins):
+      if i == bins - 1:
+        part = seq_index[i * len(seq_index) / bins:]
+      else:
+        part = seq_index[i * len(seq_index) / bins:(i + 1) * len(seq_index) / bins]
+      part.sort(key=get_seq_len, reverse=(i % 2 == 1))
+      out_index += part
+    seq_index = out_index
+  elif seq_ordering.startswith('random'):
+    tmp = seq_ordering.split(':')
+    nth = int(tmp[1]) if len(tmp) > 1 else 1
+    rnd = Random(((epoch - 1) / nth + 1) if epoch else 1)
+    rnd.shuffle(seq_index)
+  return seq_index
+
+
+def test_get_seq_order_for_epoch_same_as_reference():
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=1)
+  rnd = np.random.RandomState(42)
+  for num_seqs in [1, 2, 7, 100, 1001]:
+    # Few distinct lengths, so that the sorting must be stable.
+    seq_lens = rnd.randint(1, 10, size=(num_seqs,))
+    get_seq_len = lambda i: seq_lens[i]
+    for seq_ordering in ["default", "sorted", "random", "random:3", "laplace", "laplace:5", "laplace:3:2"]:
+      dataset.seq_ordering = seq_ordering
+      for epoch in [None, 1, 2, 5]:
+        ref = _get_seq_order_for_epoch_reference(seq_ordering, epoch, num_seqs, get_seq_len)
+        assert_equal(dataset.get_seq_order_for_epoch(epoch, num_seqs, get_seq_len), ref)
+        if seq_ordering.startswith("sorted") or seq_ordering.startswith("laplace"):
+          assert_equal(dataset.get_seq_order_for_epoch(epoch, num_seqs, seq_lens), ref)
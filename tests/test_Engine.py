@@ -0,0 +1,73 @@
+
+from nose.tools import assert_equal
+import os
+import sys
+import shutil
+import tempfile
+import numpy
+import numpy.testing
+from Engine import Engine
+from Log import log
+
+log.initialize()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ToySetup import make_network_and_devices, make_toy_dataset
+
+
+def _make_engine(task):
+  network, devices = make_network_and_devices(task, num_outputs=4, n_hidden=5)
+  engine = Engine(devices)
+  engine.network = network
+  return engine
+
+
+def _make_dataset():
+  dataset = make_toy_dataset([5, 3, 7, 1, 4, 6], num_classes=4)
+  dataset.labels["classes"] = ["a_1", "a_2", "b_1", "c_1"]
+  return dataset
+
+
+def test_analyze_batched_same_as_single():
+  engine = _make_engine("analyze")
+  dataset = _make_dataset()
+  engine.max_seqs = 1
+  dataset.init_seq_order()
+  single = engine.analyze(dataset, ["confusion_matrix", "error"], batch_size=0)
+  engine.max_seqs = 4
+  dataset.init_seq_order()
+  batched = engine.analyze(dataset, ["confusion_list", "error"], batch_size=0)
+  assert_equal(single.shape, (4, 4))
+  assert_equal(single.sum(), dataset.get_num_timesteps())
+  numpy.testing.assert_array_equal(single, batched)
+  dataset.init_seq_order()
+  mle = engine.analyze(dataset, ["confusion_list", "mle"], batch_size=0)
+  numpy.testing.assert_array_equal(
+    mle, [[single[:2, :2].sum(), single[:2, 2].sum(), single[:2, 3].sum()],
+          [single[2, :2].sum(), single[2, 2], single[2, 3]],
+          [single[3, :2].sum(), single[3, 2], single[3, 3]]])
+
+
+def test_classify_batched_same_as_single():
+  engine = _make_engine("classify")
+  dataset = _make_dataset()
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    outputs = []
+    for max_seqs in [1, 4]:
+      engine.max_seqs = max_seqs
+      dataset.init_seq_order()
+      output_file = os.path.join(tmp_dir, "labels.%i.txt" % max_seqs)
+      engine.classify(dataset, output_file, batch_size=0)
+      outputs.append(open(output_file).read())
+  finally:
+    shutil.rmtree(tmp_dir)
+  assert_equal(outputs[0], outputs[1])
+  lines = outputs[0].splitlines()
+  dataset.init_seq_order()
+  dataset.load_seqs(0, dataset.num_seqs)
+  assert_equal([line.split()[0] for line in lines], [dataset.get_tag(i) for i in range(dataset.num_seqs)])
+  for i, line in enumerate(lines):
+    classes = line.split()[1:]
+    assert_equal(len(classes), dataset.get_seq_length(i)["data"])
+    assert set(classes).issubset(dataset.labels["classes"])
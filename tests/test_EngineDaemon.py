@@ -0,0 +1,117 @@
+
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_true, assert_less_equal
+import os
+import sys
+import time
+import numpy
+import numpy.testing
+from EngineDaemon import *
+from Log import log
+
+log.initialize()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ToySetup import make_network_and_devices
+
+
+def test_ResultCache_max_entries():
+  cache = ResultCache(max_entries=2, ttl=0)
+  cache.set("a", 1)
+  cache.set("b", 2)
+  cache.set("c", 3)
+  assert_not_in("a", cache)
+  assert_equal(cache.get("b"), 2)
+  assert_equal(cache.get("c"), 3)
+  assert_equal(len(cache), 2)
+  assert_equal(cache.num_evicted, 1)
+
+
+def test_ResultCache_ttl():
+  cache = ResultCache(max_entries=10, ttl=0.05)
+  cache.set("a", 1)
+  assert_equal(cache.get("a"), 1)
+  time.sleep(0.1)
+  assert_equal(cache.get("a"), None)
+  assert_equal(len(cache), 0)
+
+
+def test_LatencyStats():
+  stats = LatencyStats(window=100)
+  assert_equal(stats.percentile(50), None)
+  for i in range(200):
+    stats.add(float(i))
+  assert_equal(stats.count, 200)
+  assert_equal(stats.percentile(0), 100.0)
+  assert_equal(stats.percentile(100), 199.0)
+
+
+def _make_network_and_device():
+  network, devices = make_network_and_devices("daemon")
+  return network, devices[0]
+
+
+def test_InferenceServer_batched_same_as_single():
+  network, device = _make_network_and_device()
+  rnd = numpy.random.RandomState(42)
+  seqs = [rnd.uniform(-1, 1, (n, 3)).tolist() for n in [5, 3, 7, 1]]
+
+  single = InferenceServer(network=network, devices=[device], max_seqs=1)
+  single_results = []
+  for seq in seqs:
+    ret = single.submit({"data": seq})
+    hash = ret["result"]["hash"]
+    while "classification in progress" == single.get_result(hash).get("error"):
+      time.sleep(0.01)
+    single_results.append(single.get_result(hash)["result"]["seq-0"])
+  single.stop()
+  assert_equal(single.num_batches, len(seqs))
+
+  batched = InferenceServer(network=network, devices=[device], max_seqs=len(seqs), max_wait=1.0)
+  hashes = [batched.submit({"data": seq})["result"]["hash"] for seq in seqs]
+  for hash, single_result in zip(hashes, single_results):
+    while "classification in progress" == batched.get_result(hash).get("error"):
+      time.sleep(0.01)
+    ret = batched.get_result(hash)
+    assert_in("result", ret)
+    numpy.testing.assert_allclose(ret["result"]["seq-0"], single_result, rtol=1e-5)
+  stats = batched.get_stats()
+  batched.stop()
+  assert_less_equal(batched.num_batches, 2)
+  assert_equal(stats["num_seqs"], len(seqs))
+  assert_true(stats["latency_p99"] >= stats["latency_p50"] >= 0)
+
+
+def _wait_for_result(server, hash):
+  while "classification in progress" == server.get_result(hash).get("error"):
+    time.sleep(0.01)
+  return server.get_result(hash)
+
+
+def test_InferenceServer_invalid_dimension():
+  network, device = _make_network_and_device()
+  server = InferenceServer(network=network, devices=[device], max_seqs=2)
+  ret = server.submit({"data": numpy.ones((4, 7)).tolist()})
+  assert_in("error", ret)
+  hash = server.submit({"data": numpy.ones((4, 3)).tolist()})["result"]["hash"]
+  assert_in("result", _wait_for_result(server, hash))
+  server.stop()
+
+
+def test_InferenceServer_failed_batch_retries_single_seqs():
+  network, device = _make_network_and_device()
+  server = InferenceServer(network=network, devices=[device], max_seqs=2, max_wait=1.0)
+  good_hash = server.submit({"data": numpy.ones((4, 3)).tolist()})["result"]["hash"]
+  # Bypass the checks of submit(), so that the batch fails in the classifier.
+  bad = InferenceRequest(hash="bad", params={"data": numpy.ones((4, 7), dtype="float32")})
+  with server.lock:
+    server.in_progress[bad.hash] = bad
+    server.queue.put(bad)
+  assert_in("result", _wait_for_result(server, good_hash))  # would get a KeyboardInterrupt via interrupt_main()
+  assert_equal(_wait_for_result(server, bad.hash), {"error": "classification failed"})
+  assert_equal(server.num_errors, 1)
+  # Failures are not cached, a new submit tries again.
+  server.errors.set(good_hash, "classification failed")
+  server.results = ResultCache()
+  assert_equal(server.submit({"data": numpy.ones((4, 3)).tolist()})["result"]["hash"], good_hash)
+  assert_in("result", _wait_for_result(server, good_hash))
+  server.stop()
@@ -202,3 +202,43 @@ def test_DeviceBatchRun_outputs_format():
 
   assert_greater(tester.score, 0)
   assert_greater(tester.error, 0)
+
+
+def test_HDFForwardTaskThread_multi_device():
+  import tempfile
+  import os
+  import h5py
+  import numpy
+  from EngineTask import HDFForwardTaskThread
+  my_dir = os.path.dirname(os.path.abspath(__file__))
+  sys.path.insert(0, my_dir)
+  from ToySetup import make_network_and_devices, make_toy_dataset
+  network, devices = make_network_and_devices("forward", num_devices=2)
+  seq_lens = [5, 3, 7, 1, 4, 6, 2]
+  data = make_toy_dataset(seq_lens)
+
+  def forward(devices, max_seqs):
+    fd, filename = tempfile.mkstemp(suffix=".hdf")
+    os.close(fd)
+    try:
+      data.init_seq_order()
+      batches = data.generate_batches(recurrent_net=True, batch_size=10, max_seqs=max_seqs)
+      cache = h5py.File(filename, "w")
+      forwarder = HDFForwardTaskThread(network, devices, data, batches, cache)
+      forwarder.join()
+      assert forwarder.finalized
+      cache.close()
+      cache = h5py.File(filename, "r")
+      res = {k: cache[k][...] for k in ["inputs", "seqLengths", "seqTags"]}
+      cache.close()
+      return res
+    finally:
+      os.remove(filename)
+
+  single = forward(devices[:1], max_seqs=1)
+  multi = forward(devices, max_seqs=3)
+  assert_equal(single["seqLengths"].tolist(), seq_lens)
+  assert_equal(multi["seqLengths"].tolist(), seq_lens)
+  assert_equal(multi["seqTags"].tolist(), ["seq-%i" % i for i in range(len(seq_lens))])
+  assert_equal(multi["inputs"].shape, (sum(seq_lens), 2))
+  numpy.testing.assert_allclose(multi["inputs"], single["inputs"], rtol=1e-5)
@@ -1,7 +1,7 @@
 
 from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_in, assert_true, assert_false
 from Device import Device
-from EngineUtil import assign_dev_data, assign_dev_data_single_seq
+from EngineUtil import assign_dev_data, assign_dev_data_single_seq, average_flat_params
 from EngineBatch import Batch
 from Log import log
 from Config import Config
@@ -83,3 +83,22 @@ def test_assign_dev_data():
   success, num_batches = assign_dev_data(device, dataset, batches)
   assert_true(success)
   assert_equal(num_batches, len(batches))
+
+
+def test_average_flat_params():
+  rnd = np.random.RandomState(42)
+  sizes = [6, 0, 4, 3]
+  base = rnd.uniform(-1, 1, (sum(sizes),)).astype("float32")
+  nets = [base + rnd.uniform(-1, 1, base.shape).astype("float32") for _ in range(3)]
+  # Device 1 does not change the third param, and no device changes the last param.
+  nets[1][6:10] = base[6:10]
+  for net in nets:
+    net[10:] = base[10:]
+  num_updates = [1, 2, 3]
+  avg, no_update = average_flat_params(base, nets, num_updates=num_updates, sizes=sizes)
+  assert_equal(avg.dtype, np.float32)
+  assert_equal(list(no_update), [False, True, False, True])
+  expected = base + (nets[0] - base) / 6. + (nets[1] - base) * 2 / 6. + (nets[2] - base) * 3 / 6.
+  expected[6:10] = base[6:10] + (nets[0][6:10] - base[6:10]) / 4. + (nets[2][6:10] - base[6:10]) * 3 / 4.
+  np.testing.assert_allclose(avg, expected, rtol=1e-5)
+  np.testing.assert_array_equal(avg[10:], base[10:])
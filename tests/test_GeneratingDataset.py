@@ -20,3 +20,17 @@ def test_load_seqs():
   dataset.load_seqs(1, 3)
 
 
+
+
+def test_load_seqs_cleanup():
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=10)
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, 5)
+  assert_equal([seq.seq_idx for seq in dataset.added_data], [0, 1, 2, 3, 4])
+  dataset.load_seqs(3, 8)
+  assert_equal([seq.seq_idx for seq in dataset.added_data], [3, 4, 5, 6, 7])
+  assert_equal(sorted(dataset._added_data_by_seq_idx.keys()), [3, 4, 5, 6, 7])
+  assert_equal(dataset._get_seq(2), None)
+  for seq_idx in range(3, 8):
+    assert_equal(dataset.get_tag(seq_idx), dataset.added_data[seq_idx - 3].seq_tag)
+    assert_equal(dataset.get_data(seq_idx, "data").shape, (dataset.get_seq_length(seq_idx)["data"], 2))
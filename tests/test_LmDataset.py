@@ -0,0 +1,127 @@
+
+from nose.tools import assert_equal, assert_true, assert_raises
+import os
+import shutil
+import tempfile
+import numpy
+from LmDataset import LmDataset, TokenCorpus, create_token_corpus, Lexicon, StateTying
+from Log import log
+
+log.initialize()
+
+
+def _write_text_corpus(tmp_dir, with_skipped_seqs=True):
+  corpus_file = os.path.join(tmp_dir, "corpus.txt")
+  with open(corpus_file, "w") as f:
+    if with_skipped_seqs:
+      f.write("hello world\n\nabc  cab\n</s>\nunknown symbol X\nba\n")
+    else:
+      # "a    b" has more chars but less orth symbols than "abcd", as spaces are collapsed.
+      f.write("hello world\na    b\nabcd\nba\nabc  cab\ncab\n")
+  orth_symbols_file = os.path.join(tmp_dir, "orth_symbols.txt")
+  with open(orth_symbols_file, "w") as f:
+    f.write("\n".join([" ", "[END]"] + list("abcdehlnorw")) + "\n")
+  return corpus_file, orth_symbols_file
+
+
+def _iter_seqs(dataset, epoch):
+  dataset.init_seq_order(epoch=epoch)
+  seqs = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    seqs.append(dataset.get_data(seq_idx, "data").tolist())
+    seq_idx += 1
+  return seqs
+
+
+def test_TokenCorpus_same_as_text():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    corpus_file, orth_symbols_file = _write_text_corpus(tmp_dir)
+    prefix = os.path.join(tmp_dir, "corpus")
+    num_seqs, num_skipped = create_token_corpus(
+      corpus_file=corpus_file, orth_symbols_file=orth_symbols_file, output_prefix=prefix)
+    assert_equal((num_seqs, num_skipped), (3, 1))
+    assert_true(TokenCorpus.exists(prefix))
+    corpus = TokenCorpus(prefix)
+    assert_equal(len(corpus), 3)
+    assert_equal(len(corpus[1:]), 2)
+    assert_equal(corpus[1:][-1].tolist(), corpus[2].tolist())
+    assert_true(isinstance(corpus.tokens, numpy.memmap))
+
+    txt_dataset = LmDataset(corpus_file=corpus_file, orth_symbols_file=orth_symbols_file)
+    tok_dataset = LmDataset(corpus_file=prefix)
+    assert_equal(tok_dataset.labels["data"], txt_dataset.labels["data"])
+    assert_equal(tok_dataset.num_outputs, txt_dataset.num_outputs)
+    txt_seqs = _iter_seqs(txt_dataset, epoch=1)
+    tok_seqs = _iter_seqs(tok_dataset, epoch=1)
+    assert_equal(len(txt_seqs), 3)
+    assert_equal(tok_seqs, txt_seqs)
+    assert_equal(txt_seqs[0], [txt_dataset.orth_symbols_map[c] for c in list("hello world") + ["[END]"]])
+
+    # Without skipped seqs, as e.g. the laplace shuffling depends on the num of seqs.
+    tmp_dir2 = os.path.join(tmp_dir, "no-skipped")
+    os.mkdir(tmp_dir2)
+    corpus_file, orth_symbols_file = _write_text_corpus(tmp_dir2, with_skipped_seqs=False)
+    prefix = os.path.join(tmp_dir2, "corpus")
+    create_token_corpus(corpus_file=corpus_file, orth_symbols_file=orth_symbols_file, output_prefix=prefix)
+    for seq_ordering in ["sorted", "laplace:2"]:
+      txt_dataset = LmDataset(corpus_file=corpus_file, orth_symbols_file=orth_symbols_file,
+                              seq_ordering=seq_ordering)
+      tok_dataset = LmDataset(corpus_file=prefix, seq_ordering=seq_ordering)
+      for epoch in [1, 2]:
+        txt_seqs = _iter_seqs(txt_dataset, epoch=epoch)
+        tok_seqs = _iter_seqs(tok_dataset, epoch=epoch)
+        assert_equal(len(txt_seqs), 6)
+        assert_equal(tok_seqs, txt_seqs)
+        if seq_ordering == "sorted":
+          assert_equal([len(seq) for seq in txt_seqs], sorted([len(seq) for seq in txt_seqs]))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+_lexicon_xml = """<?xml version="1.0" encoding="utf8"?>
+<lexicon>
+  <phoneme-inventory>
+    <phoneme><symbol>a</symbol></phoneme>
+    <phoneme><symbol>b</symbol></phoneme>
+    <phoneme><symbol>si</symbol><variation>none</variation></phoneme>
+  </phoneme-inventory>
+  <lemma><orth>[SILENCE]</orth><phon>si</phon></lemma>
+  <lemma><orth>ab</orth><orth>AB</orth><phon score="0.5">a b</phon><phon>b a</phon></lemma>
+</lexicon>
+"""
+
+
+def test_Lexicon_StateTying_cache():
+  tmp_dir = tempfile.mkdtemp()
+  orig_parse_funcs = Lexicon.__dict__["_parse"], StateTying.__dict__["_parse"]
+  try:
+    lexicon_file = os.path.join(tmp_dir, "lexicon.xml")
+    with open(lexicon_file, "w") as f:
+      f.write(_lexicon_xml)
+    state_tying_file = os.path.join(tmp_dir, "state-tying.txt")
+    with open(state_tying_file, "w") as f:
+      f.write("a{#+#}.0 0\nb{#+#}.0 1\nsi{#+#}@i@f.0 2\na{#+b}.0 0\n")
+    cache_dir = os.path.join(tmp_dir, "cache")
+    orig_lexicon = Lexicon(lexicon_file, cache_dir=None)
+    orig_state_tying = StateTying(state_tying_file, cache_dir=None)
+    assert_equal(orig_lexicon.lemmas["AB"]["phons"], [{"phon": "a b", "score": 0.5}, {"phon": "b a", "score": 0.0}])
+    assert_equal(orig_state_tying.class_map[0], {"a{#+#}.0", "a{#+b}.0"})
+    for i in range(2):  # first creates the cache, then loads it
+      lexicon = Lexicon(lexicon_file, cache_dir=cache_dir)
+      state_tying = StateTying(state_tying_file, cache_dir=cache_dir)
+      assert_equal(len(os.listdir(cache_dir)), 2)
+      assert_equal(lexicon.phonemes, orig_lexicon.phonemes)
+      assert_equal(lexicon.lemmas, orig_lexicon.lemmas)
+      assert_equal(state_tying.allo_map, orig_state_tying.allo_map)
+      assert_equal(state_tying.class_map, orig_state_tying.class_map)
+      assert_equal(state_tying.num_classes, 3)
+      Lexicon._parse = StateTying._parse = None  # must not be called anymore
+    os.chmod(cache_dir, 0o777)
+    # A cache dir writable by others is not used, thus it parses again (and fails because _parse is None).
+    assert_raises(TypeError, Lexicon, lexicon_file, cache_dir=cache_dir)
+  finally:
+    Lexicon._parse, StateTying._parse = orig_parse_funcs
+    shutil.rmtree(tmp_dir)
@@ -0,0 +1,103 @@
+
+from nose.tools import assert_equal
+import os
+import shutil
+import tempfile
+import threading
+import numpy
+from MetaDataset import CombinedDataset, MetaDataset
+import h5py
+from Log import log
+
+log.initialize()
+
+
+def _make_combined_dataset(load_seqs_num_threads):
+  return CombinedDataset(
+    datasets={
+      "ds1": {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 7},
+      "ds2": {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 5, "seq_len": 4}},
+    data_map={("ds1", "data"): "data", ("ds1", "classes"): "classes",
+              ("ds2", "data"): "data", ("ds2", "classes"): "classes"},
+    data_dims={"data": [2, 2], "classes": [3, 1]},
+    seq_ordering="in-order",
+    load_seqs_num_threads=load_seqs_num_threads)
+
+
+def _collect_seqs(dataset, step):
+  dataset.init_seq_order(epoch=1)
+  seqs = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + step)
+    seqs.append((dataset.get_tag(seq_idx), dataset.get_data(seq_idx, "data"), dataset.get_data(seq_idx, "classes")))
+    seq_idx += 1
+  return seqs
+
+
+def test_CombinedDataset_load_seqs_num_threads():
+  ref_seqs = _collect_seqs(_make_combined_dataset(load_seqs_num_threads=1), step=4)
+  assert_equal(len(ref_seqs), 12)
+  num_threads_before = threading.active_count()
+  seqs = _collect_seqs(_make_combined_dataset(load_seqs_num_threads=2), step=4)
+  _check_seqs_equal(seqs, ref_seqs)
+  assert_equal(threading.active_count(), num_threads_before)
+
+
+def _make_hdf_file(filename, seqs, num_classes):
+  """
+  :param list[(numpy.ndarray,numpy.ndarray)] seqs: (features, classes), all seqs with tag "seq-<idx>"
+  """
+  with h5py.File(filename, "w") as f:
+    f.attrs["inputPattSize"] = seqs[0][0].shape[1]
+    f.attrs["numLabels"] = num_classes
+    f.create_dataset("inputs", data=numpy.concatenate([features for features, _ in seqs]))
+    f.create_dataset("seqLengths", data=numpy.array([[len(features), len(classes)] for features, classes in seqs]))
+    f.create_dataset("seqTags", data=numpy.array(["seq-%i" % i for i in range(len(seqs))]))
+    f.create_dataset("labels", data=numpy.array(["class-%i" % i for i in range(num_classes)]))
+    f.create_dataset("targets/data/classes", data=numpy.concatenate([classes for _, classes in seqs]))
+    f.create_dataset("targets/labels/classes", data=numpy.array(["class-%i" % i for i in range(num_classes)]))
+    f.create_group("targets/size").attrs["classes"] = num_classes
+
+
+def _check_seqs_equal(seqs, ref_seqs):
+  assert_equal(len(seqs), len(ref_seqs))
+  for (tag, data, classes), (ref_tag, ref_data, ref_classes) in zip(seqs, ref_seqs):
+    assert_equal(tag, ref_tag)
+    numpy.testing.assert_array_equal(data, ref_data)
+    numpy.testing.assert_array_equal(classes, ref_classes)
+
+
+def test_MetaDataset_load_seqs_num_threads():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    feat_file = os.path.join(tmp_dir, "feat.hdf")
+    align_file = os.path.join(tmp_dir, "align.hdf")
+    rnd = numpy.random.RandomState(42)
+    seqs = [(rnd.normal(size=(n, 2)).astype("float32"), rnd.randint(0, 3, size=(n,)).astype("int32"))
+            for n in [3, 5, 2, 4, 6, 3]]
+    _make_hdf_file(feat_file, [(features, numpy.zeros_like(classes)) for features, classes in seqs], num_classes=3)
+    _make_hdf_file(align_file, [(features * 0, classes) for features, classes in seqs], num_classes=3)
+    seq_list_file = os.path.join(tmp_dir, "seq-list.txt")
+    with open(seq_list_file, "w") as f:
+      f.write("".join(["seq-%i\n" % i for i in range(6)]))
+    num_threads_before = threading.active_count()
+
+    def make_dataset(load_seqs_num_threads):
+      return MetaDataset(
+        seq_list_file=seq_list_file, seq_lens_file=None,
+        datasets={"feat": {"class": "HDFDataset", "files": [feat_file]},
+                  "align": {"class": "HDFDataset", "files": [align_file]}},
+        data_map={"data": ("feat", "data"), "classes": ("align", "classes")},
+        data_dims={"data": [2, 2], "classes": [3, 1]},
+        seq_ordering="default",
+        load_seqs_num_threads=load_seqs_num_threads)
+
+    ref_seqs = _collect_seqs(make_dataset(load_seqs_num_threads=1), step=2)
+    _check_seqs_equal(ref_seqs, [("seq-%i" % i, features, classes) for i, (features, classes) in enumerate(seqs)])
+    seqs = _collect_seqs(make_dataset(load_seqs_num_threads=2), step=2)
+    _check_seqs_equal(seqs, ref_seqs)
+    # The load threads only live during load_seqs().
+    assert_equal(threading.active_count(), num_threads_before)
+  finally:
+    shutil.rmtree(tmp_dir)
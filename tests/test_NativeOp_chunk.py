@@ -5,6 +5,7 @@ from numpy.testing.utils import assert_almost_equal
 import theano.tensor as T
 import TheanoUtil
 import sys
+import unittest
 f32 = "float32"
 
 
@@ -126,3 +127,33 @@ def test_chunk_unchunk_grad2():
   Dx, _, _, _, _ = chunk_op.grad(out.owner.inputs, (Dout, None))
   _Dx = Dx.eval()
   assert_almost_equal(_Dx, _Dx2)
+
+
+def test_chunk_unchunk_openmp():
+  import os
+  import theano
+  n_time = 101
+  n_batch = 3
+  n_dim = 5
+  chunk_size = 11
+  chunk_step = 7
+  numpy.random.seed(1234)
+  _x = numpy.random.randn(n_time, n_batch, n_dim).astype(f32)
+  _index = numpy.ones((n_time, n_batch), dtype="int8")
+  x = T.as_tensor(_x)
+  index = T.as_tensor(_index)
+  out, oindex = chunk(x, index=index, chunk_size=chunk_size, chunk_step=chunk_step)
+  x2, index2, factors = unchunk(out, index=oindex, chunk_size=chunk_size, chunk_step=chunk_step, n_time=x.shape[0], n_batch=x.shape[1])
+  _out_serial, _x2_serial = theano.function([], [out, x2])()
+  old_openmp = theano.config.openmp
+  os.environ.setdefault("OMP_NUM_THREADS", "4")  # only has an effect if OpenMP was not initialized yet
+  theano.config.openmp = True
+  try:
+    if not NativeOp.NativeOp.use_openmp():
+      raise unittest.SkipTest("no OpenMP support")
+    _out, _x2 = theano.function([], [out, x2])()
+  finally:
+    theano.config.openmp = old_openmp
+  assert_almost_equal(_out, _out_serial)
+  assert_almost_equal(_x2, _x2_serial)
+  assert_almost_equal(_x, _x2)
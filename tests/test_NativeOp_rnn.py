@@ -0,0 +1,93 @@
+
+import numpy
+import theano
+import theano.tensor as T
+from numpy.testing.utils import assert_allclose
+from NativeOp import VanillaRnnGenericBase, GruGenericBase
+import better_exchook
+from Log import log
+
+better_exchook.replace_traceback_format_tb()
+log.initialize()  # some code might need it
+
+
+def ref_vanilla_rnn(Z, V_h, h0, i):
+  def step(z_t, i_t, h_p):
+    i_t = i_t.dimshuffle(0, 'x')
+    return T.tanh(z_t + T.dot(h_p, V_h)) * i_t + h_p * (1 - i_t)
+  Y, _ = theano.scan(step, sequences=[Z, i], outputs_info=[h0])
+  return Y
+
+
+def ref_gru(Z, V_h, V_c, h0, i):
+  n = V_c.shape[0]
+  def step(z_t, i_t, h_p):
+    i_t = i_t.dimshuffle(0, 'x')
+    z_p = T.dot(h_p, V_h)
+    u_t = T.nnet.sigmoid(z_t[:, :n] + z_p[:, :n])
+    r_t = T.nnet.sigmoid(z_t[:, n:2 * n] + z_p[:, n:])
+    c_t = T.tanh(z_t[:, 2 * n:] + T.dot(r_t * h_p, V_c))
+    return (u_t * h_p + (1 - u_t) * c_t) * i_t + h_p * (1 - i_t)
+  Y, _ = theano.scan(step, sequences=[Z, i], outputs_info=[h0])
+  return Y
+
+
+def make_index(n_time, n_batch):
+  i = numpy.ones((n_time, n_batch), dtype="float32")
+  i[n_time - 2:, 1] = 0
+  i[1:, 2] = 0
+  return i
+
+
+def check_same_as_ref(native_op, ref_func, params):
+  n_time, n_batch = params[0].shape[:2]
+  param_vars = [theano.shared(v) for v in params]
+  i = T.constant(make_index(n_time, n_batch))
+  rnd = numpy.random.RandomState(1)
+  weights = rnd.uniform(-1, 1, (n_time, n_batch, params[-1].shape[1])).astype("float32")
+  results = []
+  for f in [native_op, ref_func]:
+    Y = f(*(param_vars + [i]))
+    if isinstance(Y, (list, tuple)):
+      Y = Y[0]
+    grads = T.grad(T.sum(Y * weights), param_vars)
+    results.append(theano.function([], [Y] + grads)())
+  for native_value, ref_value in zip(*results):
+    assert_allclose(native_value, ref_value, rtol=1e-4, atol=1e-5)
+
+
+def check_vanilla_rnn(n_time):
+  rnd = numpy.random.RandomState(42)
+  n_batch, n_cells = 3, 4
+  Z = rnd.uniform(-1, 1, (n_time, n_batch, n_cells)).astype("float32")
+  V_h = rnd.uniform(-1, 1, (n_cells, n_cells)).astype("float32")
+  h0 = rnd.uniform(-1, 1, (n_batch, n_cells)).astype("float32")
+  check_same_as_ref(VanillaRnnGenericBase.make_op(), ref_vanilla_rnn, [Z, V_h, h0])
+
+
+def test_vanilla_rnn():
+  check_vanilla_rnn(n_time=5)
+
+
+def test_vanilla_rnn_single_frame():
+  check_vanilla_rnn(n_time=1)
+
+
+def test_gru():
+  rnd = numpy.random.RandomState(42)
+  n_time, n_batch, n_cells = 5, 3, 4
+  Z = rnd.uniform(-1, 1, (n_time, n_batch, n_cells * 3)).astype("float32")
+  V_h = rnd.uniform(-1, 1, (n_cells, n_cells * 2)).astype("float32")
+  V_c = rnd.uniform(-1, 1, (n_cells, n_cells)).astype("float32")
+  h0 = rnd.uniform(-1, 1, (n_batch, n_cells)).astype("float32")
+  check_same_as_ref(GruGenericBase.make_op(), ref_gru, [Z, V_h, V_c, h0])
+
+
+def test_gru_single_frame():
+  rnd = numpy.random.RandomState(42)
+  n_batch, n_cells = 3, 2
+  Z = rnd.uniform(-1, 1, (1, n_batch, n_cells * 3)).astype("float32")
+  V_h = rnd.uniform(-1, 1, (n_cells, n_cells * 2)).astype("float32")
+  V_c = rnd.uniform(-1, 1, (n_cells, n_cells)).astype("float32")
+  h0 = rnd.uniform(-1, 1, (n_batch, n_cells)).astype("float32")
+  check_same_as_ref(GruGenericBase.make_op(), ref_gru, [Z, V_h, V_c, h0])
@@ -7,6 +7,16 @@ from Network import LayerNetwork
 import h5py
 import tempfile
 import os
+import sys
+import numpy
+import numpy.testing
+import theano
+from Log import log
+
+log.initialize()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ToySetup import make_hidden_softmax_network
 
 
 config_enc_dec1_json = """
@@ -65,3 +75,38 @@ def test_enc_dec1_hdf():
   assert_equal(sorted(network.j.keys()), sorted(loaded_net.j.keys()))
 
   os.remove(filename)
+
+
+def test_flat_params():
+  network = make_hidden_softmax_network()
+  values = [numpy.array(p.get_value()) for p in network.get_all_params_vars()]
+  flat = network.get_flat_params()
+  assert_equal(flat.shape, (sum([v.size for v in values]),))
+  network.init_flat_params()
+  assert_is_instance(network.flat_params, numpy.ndarray)
+  numpy.testing.assert_array_equal(network.get_flat_params(), flat)
+  for p, value in zip(network.get_all_params_vars(), values):
+    numpy.testing.assert_array_equal(p.get_value(), value)
+  network.set_flat_params(flat * 2)
+  for p, value in zip(network.get_all_params_vars(), values):
+    numpy.testing.assert_array_equal(p.get_value(), value * 2)
+  for view, value in zip(network.split_flat_params(network.get_flat_params()), values):
+    numpy.testing.assert_array_equal(view, value * 2)
+
+
+def test_flat_params_after_update():
+  network = make_hidden_softmax_network()
+  network.init_flat_params()
+  params = network.get_all_params_vars()
+  # Not inplace, thus Theano will assign new arrays to the shared vars.
+  f = theano.function([], updates=[(p, p * numpy.float32(3) + numpy.float32(1)) for p in params],
+                      mode=theano.compile.get_default_mode().excluding("inplace"))
+  values = [numpy.array(p.get_value()) for p in params]
+  f()
+  flat = network.get_flat_params()
+  assert flat is network.flat_params
+  for view, value in zip(network.split_flat_params(flat), values):
+    numpy.testing.assert_allclose(view, value * 3 + 1, rtol=1e-6)
+  network.set_flat_params(numpy.zeros_like(flat))
+  for p in params:
+    assert (p.get_value() == 0).all()
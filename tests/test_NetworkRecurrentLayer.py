@@ -1,14 +1,16 @@
 
+from nose.tools import assert_is_instance
 import theano
+import theano.tensor as T
 import numpy
 from NetworkBaseLayer import Container, SourceLayer
-from NetworkRecurrentLayer import RecurrentUnitLayer
+from NetworkRecurrentLayer import RecurrentUnitLayer, GRU, GRUN, VANILLA, VANILLAN
 
 Container.initialize_rng()
 
 # TODO more sane data
 index = theano.shared(numpy.array([[1]]), name="i")
-source = SourceLayer(n_out=2, x_out=theano.shared(numpy.array([[[1.0, -2.0]]], dtype='float32'), name="x", index=index))
+source = SourceLayer(n_out=2, x_out=theano.shared(numpy.array([[[1.0, -2.0]]], dtype='float32'), name="x"), index=index)
 
 
 def test_RecurrentUnitLayer_init():
@@ -16,3 +18,56 @@ def test_RecurrentUnitLayer_init():
 
 def test_RecurrentUnitLayer_init_sampling2():
   RecurrentUnitLayer(n_out=3, sources=[source], index=index, sampling=2)
+
+
+def _check_rec_layers_same(unit_kwargs, direction):
+  """
+  :param list[dict[str]] unit_kwargs: for each layer, the unit and maybe other kwargs for RecurrentUnitLayer
+  """
+  rnd = numpy.random.RandomState(42)
+  n_time, n_batch, n_in, n_out = 5, 3, 2, 4
+  x = theano.shared(rnd.uniform(-1, 1, (n_time, n_batch, n_in)).astype('float32'), name="x")
+  index_values = numpy.ones((n_time, n_batch), dtype='int8')
+  index_values[3:, 1] = 0
+  index_values[1:, 2] = 0
+  index = theano.shared(index_values, name="i")
+  source = SourceLayer(n_out=n_in, x_out=x, index=index)
+  layers = [RecurrentUnitLayer(n_out=n_out, sources=[source], index=index, direction=direction,
+                               name="rec_%i" % i, **kwargs)
+            for i, kwargs in enumerate(unit_kwargs)]
+  for param_name, param in layers[0].params.items():
+    param.set_value(rnd.uniform(-0.5, 0.5, param.get_value().shape).astype('float32'))
+    for i, layer in enumerate(layers[1:], 1):
+      layer.params[param_name.replace("rec_0", "rec_%i" % i)].set_value(param.get_value())
+  results = []
+  for layer in layers:
+    cost = T.sum(layer.output * numpy.arange(1, n_out + 1, dtype='float32'))
+    params = [layer.params[name] for name in sorted(layer.params.keys())]
+    outputs = [layer.output] + [act[-1] for act in layer.act[1:]]
+    f = theano.function([], outputs + T.grad(cost, params))
+    results.append(f())
+  for values in zip(*results):
+    for value in values[1:]:
+      numpy.testing.assert_allclose(value, values[0], rtol=1e-4, atol=1e-6)
+  return layers
+
+
+def test_RecurrentUnitLayer_lstmn_same_as_lstme():
+  _check_rec_layers_same([{"unit": "lstme"}, {"unit": "lstmn"}], direction=1)
+
+
+def test_RecurrentUnitLayer_lstmn_same_as_lstme_backward():
+  _check_rec_layers_same([{"unit": "lstme"}, {"unit": "lstmn"}], direction=-1)
+
+
+def test_RecurrentUnitLayer_gru_native_same_as_scan():
+  # With gradient truncation, the theano.scan implementation is used.
+  layers = _check_rec_layers_same([{"unit": "gru", "truncation": 100}, {"unit": "gru"}], direction=-1)
+  assert type(layers[0].unit) is GRU  # GRUN is a subclass of GRU
+  assert_is_instance(layers[1].unit, GRUN)
+
+
+def test_RecurrentUnitLayer_vanilla_native_same_as_scan():
+  layers = _check_rec_layers_same([{"unit": "vanilla", "truncation": 100}, {"unit": "vanilla"}], direction=1)
+  assert type(layers[0].unit) is VANILLA  # VANILLAN is a subclass of VANILLA
+  assert_is_instance(layers[1].unit, VANILLAN)
@@ -0,0 +1,59 @@
+
+from nose.tools import assert_equal, assert_is_instance
+import os
+import imp
+import shutil
+import tempfile
+import numpy
+from NumpyDumpDataset import NumpyDumpDataset
+from GeneratingDataset import StaticDataset
+from Util import DictAsObj
+from Log import log
+
+log.initialize()
+
+dump_dataset_module = imp.load_source(
+  "dump_dataset", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dump-dataset.py"))
+
+
+def _write_dump(prefix, postfix, seqs):
+  dataset = StaticDataset([{"data": features, "classes": targets} for features, targets in seqs],
+                          output_dim={"classes": [5, 1]})
+  options = DictAsObj({"epoch": 1, "startseq": 0, "endseq": float("inf"), "type": "numpy",
+                       "dump_prefix": prefix, "dump_postfix": postfix})
+  dump_dataset_module.dump_dataset(dataset, options)
+
+
+def _read_dump(dataset):
+  dataset.init_seq_order(epoch=1)
+  seqs = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    seqs.append((dataset.get_data(seq_idx, "data"), dataset.get_data(seq_idx, "classes")))
+    seq_idx += 1
+  return seqs
+
+
+def test_NumpyDumpDataset_npy():
+  rnd = numpy.random.RandomState(42)
+  seqs = [(rnd.normal(size=(n, 3)).astype("float32"), rnd.randint(0, 5, size=(n,)).astype("int32")) for n in [4, 2, 5]]
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    prefix = os.path.join(tmp_dir, "dump.")
+    _write_dump(prefix, ".txt", seqs)
+    _write_dump(prefix, ".npy", seqs)
+    assert os.path.exists(prefix + "0.targets.classes.npy")
+    text_seqs = _read_dump(NumpyDumpDataset(prefix=prefix, postfix=".txt", num_inputs=3, num_outputs=5))
+    npy_seqs = _read_dump(NumpyDumpDataset(prefix=prefix, postfix=".npy", num_inputs=3, num_outputs=5))
+    dataset = NumpyDumpDataset(prefix=prefix, postfix=".npy", num_inputs=3, num_outputs=5, mmap_mode="r")
+    mmap_seqs = _read_dump(dataset)
+    assert_equal(dataset.num_seqs, len(seqs))
+    assert_is_instance(dataset.get_input_data(len(seqs) - 1), numpy.memmap)
+    for read_seqs in [text_seqs, npy_seqs, mmap_seqs]:
+      assert_equal(len(read_seqs), len(seqs))
+      for (features, targets), (read_features, read_targets) in zip(seqs, read_seqs):
+        numpy.testing.assert_allclose(read_features, features, rtol=1e-6)
+        numpy.testing.assert_array_equal(read_targets, targets)
+  finally:
+    shutil.rmtree(tmp_dir)
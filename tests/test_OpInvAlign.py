@@ -0,0 +1,58 @@
+
+import numpy
+from numpy.testing.utils import assert_array_equal
+import theano
+import theano.tensor as T
+from OpInvAlign import InvAlignOp
+
+import better_exchook
+from Log import log
+
+better_exchook.replace_traceback_format_tb()
+log.initialize()  # some code might need it
+
+
+def make_batch(lengths_x, lengths_y, n_classes=5, seed=42):
+  rnd = numpy.random.RandomState(seed)
+  n_batch = len(lengths_x)
+  index_in = numpy.zeros((max(lengths_x), n_batch), dtype="int8")
+  index_out = numpy.zeros((max(lengths_y), n_batch), dtype="int8")
+  for b in range(n_batch):
+    index_in[:lengths_x[b], b] = 1
+    index_out[:lengths_y[b], b] = 1
+  scores = -numpy.log(rnd.dirichlet([1.0] * n_classes, size=index_in.shape)).astype("float32")
+  transcriptions = rnd.randint(0, n_classes, size=index_out.shape).astype("int32")
+  return index_in, index_out, scores, transcriptions
+
+
+def align(op, mode, index_in, index_out, scores, transcriptions):
+  args = [T.bmatrix(), T.bmatrix(), T.ftensor3(), T.imatrix()]
+  outputs = op(*args)
+  if not isinstance(outputs, (list, tuple)):
+    outputs = [outputs]
+  f = theano.function(args, outputs, mode=mode)
+  return f(index_in, index_out, scores, transcriptions)
+
+
+def check_same_as_python(op, lengths_x, lengths_y):
+  batch = make_batch(lengths_x, lengths_y)
+  py_outputs = align(op, theano.Mode(linker="py"), *batch)
+  c_outputs = align(op, theano.Mode(linker="c"), *batch)
+  for py_output, c_output in zip(py_outputs, c_outputs):
+    assert_array_equal(py_output, c_output)
+
+
+def test_InvAlignOp_c_same_as_python():
+  check_same_as_python(InvAlignOp(tdps=[1e10, 0., 1.9, 3., 2.5, 2., 1.4], nstates=3),
+                       lengths_x=[30, 17, 25, 12], lengths_y=[4, 3, 2, 1])
+
+
+def test_InvAlignOp_c_same_as_python_short_seqs():
+  # skip is limited by the seq length
+  check_same_as_python(InvAlignOp(tdps=[1e10, 0., 1.9, 3., 2.5, 2., 1.4], nstates=2),
+                       lengths_x=[6, 4, 9], lengths_y=[2, 1, 3])
+
+
+def test_InvAlignOp_c_openmp():
+  check_same_as_python(InvAlignOp(tdps=[1e10, 0., 1.9, 3., 2.5, 2., 1.4], nstates=3, openmp=True),
+                       lengths_x=[30, 17, 25, 12, 40, 21], lengths_y=[4, 3, 2, 1, 6, 3])
@@ -0,0 +1,31 @@
+
+from numpy.testing.utils import assert_array_equal
+import theano
+from OpNumpyAlign import NumpyAlignOp
+from test_OpInvAlign import make_batch, align
+
+import better_exchook
+from Log import log
+
+better_exchook.replace_traceback_format_tb()
+log.initialize()  # some code might need it
+
+
+def check_same_as_python(op, lengths_x, lengths_y):
+  batch = make_batch(lengths_x, lengths_y, seed=23)
+  py_alignment, = align(op, theano.Mode(linker="py"), *batch)
+  c_alignment, = align(op, theano.Mode(linker="c"), *batch)
+  assert_array_equal(py_alignment, c_alignment)
+  assert (c_alignment > 0).sum() == sum(lengths_x)
+
+
+def test_NumpyAlignOp_c_same_as_python():
+  check_same_as_python(NumpyAlignOp(False), lengths_x=[30, 17, 25, 12, 3], lengths_y=[4, 3, 2, 1, 1])
+
+
+def test_NumpyAlignOp_inverse_c_same_as_python():
+  check_same_as_python(NumpyAlignOp(True), lengths_x=[30, 17, 25, 12, 9], lengths_y=[4, 3, 2, 1, 3])
+
+
+def test_NumpyAlignOp_c_openmp():
+  check_same_as_python(NumpyAlignOp(False, openmp=True), lengths_x=[30, 17, 25, 12], lengths_y=[4, 3, 2, 1])
@@ -0,0 +1,75 @@
+
+from nose.tools import assert_equal, assert_true
+import os
+import sys
+import numpy
+import Device
+from SprintErrorSignals import SprintInstancePool
+from Log import log
+
+log.initialize()
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, my_dir)
+from DummySprintExec import dummy_loss_and_error_signal
+
+sprintExecPath = os.path.join(my_dir, "DummySprintExec.py")
+
+
+class DummyDeviceHost:
+  """
+  SprintInstancePool.get_batch_loss_and_error_signal() expects to run in the Device host proc.
+  """
+
+  def __init__(self, tags):
+    self.tags = tags
+
+  def is_device_proc(self):
+    return True
+
+
+def _get_batch_loss_and_error_signal(num_instances, log_posteriors, seq_lengths, tags):
+  pool = SprintInstancePool(sprint_opts={
+    "sprintExecPath": sprintExecPath, "usePythonSegmentOrder": False, "numInstances": num_instances,
+    "sprintConfigStr": "--*.seg-sleep-time=0.01"})
+  old_device_instance = Device.deviceInstance
+  Device.deviceInstance = DummyDeviceHost(tags)
+  try:
+    loss, error_signal = pool.get_batch_loss_and_error_signal(log_posteriors, seq_lengths)
+    return loss, error_signal, pool.get_instance_stats()
+  finally:
+    Device.deviceInstance = old_device_instance
+    for instance in pool.instances:
+      instance._exit_child()
+
+
+def test_SprintInstancePool_work_queue():
+  rnd = numpy.random.RandomState(42)
+  seq_lengths = numpy.array([3, 12, 2, 7, 9], dtype="int32")
+  n_time, n_batch, n_classes = max(seq_lengths), len(seq_lengths), 4
+  log_posteriors = numpy.log(rnd.dirichlet(numpy.ones(n_classes), size=(n_time, n_batch))).astype("float32")
+  tags = ["seq-%i" % b for b in range(n_batch)]
+  seq_loss, seq_error_signal, seq_stats = _get_batch_loss_and_error_signal(1, log_posteriors, seq_lengths, tags)
+  par_loss, par_error_signal, par_stats = _get_batch_loss_and_error_signal(3, log_posteriors, seq_lengths, tags)
+  # Bit-identical to the sequential path, every seq in its own slot.
+  numpy.testing.assert_array_equal(par_loss, seq_loss)
+  numpy.testing.assert_array_equal(par_error_signal, seq_error_signal)
+  for b in range(n_batch):
+    loss, error_signal = dummy_loss_and_error_signal(log_posteriors[:seq_lengths[b], b])
+    numpy.testing.assert_allclose(par_loss[b], loss, rtol=1e-5)
+    numpy.testing.assert_allclose(par_error_signal[:seq_lengths[b], b], error_signal, rtol=1e-5, atol=1e-6)
+    assert (par_error_signal[seq_lengths[b]:, b] == 0).all()
+  assert_equal(len(seq_stats), 1)
+  assert_equal(len(par_stats), 3)
+  total_sleep = 0.01 * seq_lengths.sum()
+  seq_busy, seq_idle = seq_stats[0]
+  assert_true(seq_busy >= total_sleep)
+  assert_true(seq_idle < seq_busy)
+  for busy, idle in par_stats:
+    assert_true(busy > 0)
+    assert_true(idle >= 0)
+  assert_true(sum([busy for busy, _ in par_stats]) >= total_sleep)
+  # Longest first: the longest seq (12 frames) keeps one instance busy,
+  # while the other two instances share the remaining 21 frames.
+  assert_true(max([busy for busy, _ in par_stats]) >= 0.01 * 12)
+  assert_true(max([busy for busy, _ in par_stats]) < total_sleep)
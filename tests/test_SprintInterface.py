@@ -53,6 +53,7 @@ def create_first_epoch(config_filename):
   engine.init_train_from_config(config=config, train_data=None)
   engine.epoch = 1
   engine.save_model(engine.get_epoch_model_filename(), epoch=engine.epoch)
+  Engine._epoch_model = None  # Reset the cache. SprintInterface will load the model via config 'load'.
 
 
 
@@ -72,6 +73,9 @@ def test_forward():
     bidirectional false
     model model
     log_verbosity 5
+    device cpu
+    multiprocessing false
+    sprint_forward_max_frames 12
     """)
 
   create_first_epoch("config")
@@ -87,6 +91,17 @@ def test_forward():
   posteriors = SprintAPI.forward("segment1", features.T).T
   assert_equal(posteriors.shape, (seq_len, outputDim))
 
+  # Several segments of different length, forwarded in padded batches.
+  rnd = numpy.random.RandomState(42)
+  featuresList = [rnd.uniform(-1, 1, (inputDim, n)) for n in [4, 1, 6, 3, 2]]
+  names = ["segment%i" % (i + 2) for i in range(len(featuresList))]
+  batchPosteriors = SprintAPI.forwardBatch(names, featuresList)
+  assert_equal(len(batchPosteriors), len(featuresList))
+  for name, features, batchPost in zip(names, featuresList, batchPosteriors):
+    singlePost = SprintAPI.forward(name, features)
+    assert_equal(batchPost.shape, (outputDim, features.shape[1]))
+    numpy.testing.assert_allclose(batchPost, singlePost, rtol=1e-5)
+
   SprintAPI.exit()
 
   os.chdir(olddir)
@@ -73,3 +73,63 @@ def test_pickle_inst_anon_class():
   assert inst.a == "hello"
   assert inst.b == "foo"
   assert inst.f(42) == 42
+
+
+def binary_msg_dumps(obj):
+  sio = StringIO()
+  BinaryMsgWriter(sio).dump(obj)
+  return sio.getvalue()
+
+def binary_msg_loads(s):
+  import io
+  return BinaryMsgReader(io.BytesIO(s)).load()
+
+
+def test_binary_msg_simple():
+  obj = ("data", "seg1", 42, 2 ** 40, -1.5, None, True, u"\xe4", [1, "a"], {"classes": 3})
+  obj2 = binary_msg_loads(binary_msg_dumps(obj))
+  assert obj2 == obj
+  assert type(obj2[8]) is list
+
+
+def test_binary_msg_numpy():
+  import numpy
+  features = numpy.arange(12, dtype="float32").reshape(3, 4)
+  targets = {"classes": numpy.array([1, 2, 3], dtype="int32"),
+             "fortran": numpy.asfortranarray(features),
+             "empty": numpy.zeros((0, 5), dtype="float32"),
+             "scalar": numpy.array(3.5)}
+  seg_name, features2, targets2 = binary_msg_loads(binary_msg_dumps((u"seg", features, targets)))
+  assert seg_name == u"seg"
+  assert features2.dtype == features.dtype
+  assert (features2 == features).all()
+  assert sorted(targets2.keys()) == sorted(targets.keys())
+  for k, v in targets.items():
+    assert targets2[k].dtype == v.dtype
+    assert targets2[k].shape == v.shape
+    assert (targets2[k] == v).all()
+  assert targets2["fortran"].flags.f_contiguous
+
+
+def test_binary_msg_pickle_fallback():
+  import numpy
+  obj = ("ok", numpy.float32(1.5), set([1, 2]))
+  obj2 = binary_msg_loads(binary_msg_dumps(obj))
+  assert obj2 == obj
+  assert type(obj2[1]) is numpy.float32
+
+
+def test_binary_msg_pipe():
+  import numpy
+  readend, writeend = os.pipe()
+  readend = os.fdopen(readend, "r", 0)
+  writeend = os.fdopen(writeend, "w", 0)
+  posteriors = numpy.random.RandomState(42).randn(100, 7).astype("float32")
+  msg_dump(writeend, ("get_loss_and_error_signal", "seg", 100, posteriors), protocol="binary")
+  msg_dump(writeend, ("exit",), protocol="pickle")
+  cmd, seg_name, seg_len, posteriors2 = msg_load(readend, protocol="binary")
+  assert (cmd, seg_name, seg_len) == ("get_loss_and_error_signal", "seg", 100)
+  assert (posteriors2 == posteriors).all()
+  assert msg_load(readend, protocol="pickle") == ("exit",)
+  readend.close()
+  writeend.close()
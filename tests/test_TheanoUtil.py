@@ -3,6 +3,9 @@ from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_i
 import numpy
 import numpy.testing
 from TheanoUtil import *
+from Log import log
+
+log.initialize()  # some code needs it
 
 
 def test_class_idx_seq_to_1_of_k():
@@ -164,3 +167,32 @@ def test_indices_in_flatten_array():
 
   numpy.testing.assert_allclose(meminkeyP1.eval(), meminkeyP2.eval())
   numpy.testing.assert_allclose(meminkeyP1.eval(), meminkeyP3.eval())
+
+
+def test_CompiledFunctionCache():
+  import tempfile
+  import shutil
+  cache_dir = tempfile.mkdtemp()
+  try:
+    def build(cache):
+      y = theano.shared(numpy.zeros((1, 1, 1), dtype="float32"), name="y_data")
+      W = theano.shared(numpy.ones((3, 2), dtype="float32"), name="W")
+      x = T.tensor3("x")
+      s, e = T.lscalar(), T.lscalar()
+      out = T.dot(x, W).sum()
+      f = cache.function(name="f", inputs=[s, e], outputs=[out], givens=[(x, y[:, s:e])], updates=[(W, W * 2)])
+      y.set_value(numpy.ones((4, 5, 3), dtype="float32"))
+      return f, W
+    key = CompiledFunctionCache.make_key({"test": 1})
+    cache1 = CompiledFunctionCache(cache_dir, key)
+    f1, W1 = build(cache1)
+    assert_equal(cache1.num_misses, 1)
+    cache2 = CompiledFunctionCache(cache_dir, key)
+    f2, W2 = build(cache2)
+    assert_equal(cache2.num_hits, 1)
+    for f, W in [(f1, W1), (f2, W2)]:
+      assert_almost_equal(f(0, 2)[0], 48.0)
+      assert_almost_equal(f(0, 2)[0], 96.0)
+      numpy.testing.assert_allclose(W.get_value(), numpy.ones((3, 2)) * 4)
+  finally:
+    shutil.rmtree(cache_dir)
@@ -0,0 +1,128 @@
+
+import numpy
+from numpy.testing.utils import assert_allclose
+import theano
+import theano.tensor as T
+from cuda_implementation.TwoDLSTMCPUOp import TwoDLSTMCPUOp, multi_directions, bi_directions
+
+import better_exchook
+from Log import log
+
+better_exchook.replace_traceback_format_tb()
+log.initialize()  # some code might need it
+
+
+def sigmoid(x):
+  return 1.0 / (1.0 + numpy.exp(-x))
+
+
+def naive_mdlstm(X, Ws, V_hs, V_vs, bs, sizes, directions):
+  """
+  Straight-forward NumPy implementation, position by position in raster order.
+  :return: list of Y for every direction
+  """
+  height, width, n_batch, _ = X.shape
+  # valid mask in storage coordinates
+  valid = numpy.zeros((height, width, n_batch))
+  for n in range(n_batch):
+    valid[:int(sizes[n, 0]), :int(sizes[n, 1]), n] = 1.0
+  Ys = []
+  for W, V_h, V_v, b, (flip_y, flip_x) in zip(Ws, V_hs, V_vs, bs, directions):
+    n_cells = W.shape[1] // 5
+
+    def flip(a):
+      if flip_y:
+        a = a[::-1]
+      if flip_x:
+        a = a[:, ::-1]
+      return a
+
+    Xd, valid_d = flip(X), flip(valid)
+    Y = numpy.zeros((height, width, n_batch, n_cells))
+    C = numpy.zeros((height, width, n_batch, n_cells))
+    for y in range(height):
+      for x in range(width):
+        z = Xd[y, x].dot(W) + b
+        if x > 0:
+          z += Y[y, x - 1].dot(V_h)
+        if y > 0:
+          z += Y[y - 1, x].dot(V_v)
+        inp, fgt, lmb, out = [sigmoid(z[:, k * n_cells:(k + 1) * n_cells]) for k in range(4)]
+        c = inp * numpy.tanh(z[:, 4 * n_cells:])
+        if y > 0:
+          c += fgt * lmb * C[y - 1, x]
+        if x > 0:
+          c += fgt * (1.0 - lmb) * C[y, x - 1]
+        c *= valid_d[y, x][:, None]
+        C[y, x] = c
+        Y[y, x] = out * numpy.tanh(c) * valid_d[y, x][:, None]
+    Ys.append(flip(Y))
+  return Ys
+
+
+def make_params(directions, height=3, width=4, n_batch=2, n_in=2, n_cells=2, seed=42):
+  rnd = numpy.random.RandomState(seed)
+  n = len(directions)
+  X = rnd.uniform(-1, 1, (height, width, n_batch, n_in))
+  Ws = [rnd.uniform(-1, 1, (n_in, 5 * n_cells)) for _ in range(n)]
+  V_hs = [rnd.uniform(-1, 1, (n_cells, 5 * n_cells)) for _ in range(n)]
+  V_vs = [rnd.uniform(-1, 1, (n_cells, 5 * n_cells)) for _ in range(n)]
+  bs = [rnd.uniform(-1, 1, (5 * n_cells,)) for _ in range(n)]
+  sizes = numpy.array([[height, width], [height - 1, width - 1]][:n_batch], dtype="float32")
+  return X, Ws, V_hs, V_vs, bs, sizes
+
+
+def check_fwd(directions, openmp=False):
+  X, Ws, V_hs, V_vs, bs, sizes = make_params(directions)
+  op = TwoDLSTMCPUOp(directions, openmp=openmp)
+  args = [X] + Ws + V_hs + V_vs + bs
+  outputs = op(*([T.constant(numpy.array(v, dtype="float32")) for v in args] + [T.constant(sizes)]))
+  Ys = theano.function([], outputs[:len(directions)])()
+  ref_Ys = naive_mdlstm(X, Ws, V_hs, V_vs, bs, sizes, directions)
+  for Y, ref_Y in zip(Ys, ref_Ys):
+    assert_allclose(Y, ref_Y, rtol=1e-4, atol=1e-5)
+
+
+def test_fwd_multi_directions():
+  check_fwd(multi_directions)
+
+
+def test_fwd_bi_directions():
+  check_fwd(bi_directions)
+
+
+def test_fwd_openmp():
+  check_fwd(multi_directions, openmp=True)
+
+
+def test_grad_multi_directions():
+  directions = multi_directions
+  n = len(directions)
+  X, Ws, V_hs, V_vs, bs, sizes = make_params(directions)
+  rnd = numpy.random.RandomState(1)
+  Rs = [rnd.uniform(-1, 1, X.shape[:3] + (Ws[0].shape[1] // 5,)) for _ in range(n)]
+  params = [X] + Ws + V_hs + V_vs + bs
+
+  def ref_cost(params):
+    Ys = naive_mdlstm(params[0], params[1:1 + n], params[1 + n:1 + 2 * n], params[1 + 2 * n:1 + 3 * n],
+                      params[1 + 3 * n:], sizes, directions)
+    return sum([numpy.sum(Y * R) for Y, R in zip(Ys, Rs)])
+
+  param_vars = [T.constant(numpy.array(v, dtype="float32")) for v in params]
+  Ys = TwoDLSTMCPUOp(directions)(*(param_vars + [T.constant(sizes)]))[:n]
+  cost = sum([T.sum(Y * numpy.array(R, dtype="float32")) for Y, R in zip(Ys, Rs)])
+  grads = theano.function([], T.grad(cost, param_vars))()
+
+  eps = 1e-5
+  for param, grad in zip(params, grads):
+    assert grad.shape == param.shape
+    num_grad = numpy.zeros_like(param)
+    for idx in numpy.ndindex(*param.shape):
+      orig = param[idx]
+      param[idx] = orig + eps
+      cost_plus = ref_cost(params)
+      param[idx] = orig - eps
+      cost_minus = ref_cost(params)
+      param[idx] = orig
+      num_grad[idx] = (cost_plus - cost_minus) / (2 * eps)
+    assert_allclose(grad, num_grad, rtol=1e-2, atol=1e-3)
@@ -0,0 +1,142 @@
+
+from nose.tools import assert_equal
+import os
+import sys
+import numpy
+import numpy.testing
+import theano
+import theano.tensor as T
+from NetworkBaseLayer import Container
+from Updater import Updater
+from Log import log
+
+log.initialize()
+Container.initialize_rng()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ToySetup import make_hidden_softmax_network
+
+
+def _make_train_function(updater, network):
+  # Like Device: params with a custom_update (e.g. the priors) don't get a gradient.
+  grad_params = [p for p in network.train_params_vars if not hasattr(p, 'custom_update')]
+  grads = dict(zip(grad_params, T.grad(network.get_objective(), grad_params)))
+  for param in network.train_params_vars:
+    if hasattr(param, 'custom_update'):
+      grads[param] = param.custom_update
+  updater.initVars(network, grads)
+  updater.setLearningRate(0.1)
+  return theano.function([network.x, network.i, network.y["classes"], network.j["classes"]],
+                         updates=updater.getUpdateList(), on_unused_input='ignore')
+
+
+def _get_params(network):
+  return {layer_name: {param_name: numpy.array(value) for param_name, value in layer_params.items()}
+          for layer_name, layer_params in network.get_params_dict().items()}
+
+
+def _train(updater, batches, **output_opts):
+  """
+  :returns the initial params and the params after every batch
+  """
+  network = make_hidden_softmax_network(**output_opts)
+  rnd = numpy.random.RandomState(42)
+  network.set_params_by_dict({layer_name: {param_name: rnd.uniform(-1, 1, value.shape).astype("float32")
+                                           for param_name, value in layer_params.items()}
+                              for layer_name, layer_params in sorted(network.get_params_dict().items())})
+  initial_params = _get_params(network)
+  f = _make_train_function(updater, network)
+  params = []
+  for x, index, y in batches:
+    f(x, index, y, index)
+    params.append(_get_params(network))
+  return initial_params, params
+
+
+def _make_batches(n_batches):
+  rnd = numpy.random.RandomState(1)
+  n_time, n_batch = 4, 2
+  batches = []
+  for _ in range(n_batches):
+    x = rnd.uniform(-1, 1, (n_time, n_batch, 3)).astype("float32")
+    index = numpy.ones((n_time, n_batch), dtype="int8")
+    index[rnd.randint(1, n_time):, 1] = 0
+    y = rnd.randint(0, 4, (n_time, n_batch)).astype("int32")
+    batches.append((x, index, y))
+  return batches
+
+
+def _concat_batches(batches):
+  return tuple([numpy.concatenate(values, axis=1) for values in zip(*batches)])
+
+
+def check_accumulate_gradients_same_as_large_batch(**kwargs):
+  batches = _make_batches(4)
+  large_batches = [_concat_batches(batches[:2]), _concat_batches(batches[2:])]
+  _, large = _train(Updater(**kwargs), large_batches)
+  initial, accumulated = _train(Updater(accumulate_gradients=2, **kwargs), batches)
+  assert_equal(len(accumulated), 4)
+  for i, params in enumerate(accumulated):
+    if i % 2 == 0:
+      # No update after the first batch of the accumulation.
+      expected = accumulated[i - 1] if i > 0 else initial
+    else:
+      expected = large[i // 2]
+    for layer_name, layer_params in expected.items():
+      for param_name, value in layer_params.items():
+        numpy.testing.assert_allclose(params[layer_name][param_name], value, rtol=1e-4, atol=1e-6)
+
+
+def test_accumulate_gradients_sgd():
+  check_accumulate_gradients_same_as_large_batch()
+
+
+def test_accumulate_gradients_adam():
+  check_accumulate_gradients_same_as_large_batch(adam=True)
+
+
+def test_accumulate_gradients_adadelta_momentum():
+  check_accumulate_gradients_same_as_large_batch(adadelta=True)
+  check_accumulate_gradients_same_as_large_batch(momentum=0.9)
+
+
+def test_accumulate_gradients_with_priors_accumulate_batches():
+  # The priors have their own accumulation period, which must not change the one of the other params.
+  initial, params = _train(Updater(accumulate_gradients=2), _make_batches(6),
+                           compute_priors=True, compute_priors_accumulate_batches=3)
+  for i in range(len(params)):
+    prev = params[i - 1] if i > 0 else initial
+    for layer_name, layer_params in params[i].items():
+      for param_name, value in layer_params.items():
+        if param_name == "priors":
+          changed = i % 3 == 2
+        else:
+          changed = i % 2 == 1
+        assert_equal(not numpy.array_equal(value, prev[layer_name][param_name]), changed,
+                     "%s/%s after batch %i" % (layer_name, param_name, i))
+
+
+def check_fused_update_same_as_unfused(**kwargs):
+  batches = _make_batches(3)
+  _, unfused = _train(Updater(**kwargs), batches)
+  _, fused = _train(Updater(fused_update=True, **kwargs), batches)
+  for unfused_params, fused_params in zip(unfused, fused):
+    for layer_name, layer_params in unfused_params.items():
+      for param_name, value in layer_params.items():
+        numpy.testing.assert_allclose(fused_params[layer_name][param_name], value, rtol=1e-4, atol=1e-6)
+
+
+def test_fused_update_adam():
+  check_fused_update_same_as_unfused(adam=True)
+
+
+def test_fused_update_adadelta():
+  check_fused_update_same_as_unfused(adadelta=True)
+
+
+def test_fused_update_rmsprop():
+  check_fused_update_same_as_unfused(rmsprop=0.9)
+
+
+def test_fused_update_accumulate_gradients():
+  check_fused_update_same_as_unfused(adam=True, accumulate_gradients=2)
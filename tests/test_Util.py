@@ -57,6 +57,32 @@ def test_NumbersDict_eq_1():
   assert_true(r2)
 
 
+def test_NumbersDict_max():
+  a = NumbersDict(numbers_dict={'classes': 3}, broadcast_value=2)
+  r = NumbersDict.max([a, NumbersDict({'data': 5}), NumbersDict(1)])
+  assert_equal(r.dict, {'classes': 3, 'data': 5})
+  assert_equal(r.value, 2)
+  assert_raises(Exception, lambda: a.max([a]))
+
+
+def test_NumbersDict_iadd_none():
+  a = NumbersDict({'classes': None, 'data': 2})
+  b = a
+  a += NumbersDict({'data': 3, 'sizes': 4})
+  assert_is(a, b)
+  assert_equal(a.dict, {'classes': None, 'data': 5, 'sizes': 4})
+  assert_is(a.value, None)
+
+
+def test_NumbersDict_pickle():
+  import pickle
+  a = NumbersDict(numbers_dict={'classes': 3}, broadcast_value=2)
+  for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+    b = pickle.loads(pickle.dumps(a, protocol))
+    assert_equal(b.dict, a.dict)
+    assert_equal(b.value, a.value)
+
+
 def test_collect_class_init_kwargs():
   class A(object):
     def __init__(self, a):
@@ -73,3 +99,19 @@ def test_collect_class_init_kwargs():
   kwargs = collect_class_init_kwargs(C)
   print kwargs
   assert_equal(sorted(kwargs), ["a", "b", "c"])
+
+
+def test_MomentsAccumulator_merge():
+  rnd = np.random.RandomState(42)
+  seqs = [rnd.normal(size=(n, 3)) for n in [5, 1, 7, 4]]
+  m1 = MomentsAccumulator(3)
+  for x in seqs[:2]:
+    m1.add(x)
+  m2 = MomentsAccumulator(3)
+  for x in seqs[2:]:
+    m2.add(x)
+  m1.merge(m2)
+  all_data = np.concatenate(seqs, axis=0)
+  assert_equal(m1.count, all_data.shape[0])
+  np.testing.assert_allclose(m1.mean(), np.mean(all_data, axis=0))
+  np.testing.assert_allclose(m1.var(), np.var(all_data, axis=0))
@@ -0,0 +1,45 @@
+
+from nose.tools import assert_equal
+import os
+import shutil
+import tempfile
+import numpy
+import rnn
+from Config import Config
+from GeneratingDataset import StaticDataset
+from Log import log
+
+log.initialize()
+
+
+def _analyze_data(dataset, num_workers, stat_prefix):
+  config = Config()
+  config.update({"analyze_data_num_workers": num_workers, "statistics_save_prefix": stat_prefix})
+  rnn.train_data = dataset
+  try:
+    rnn.analyze_data(config)
+  finally:
+    rnn.train_data = None
+  return [numpy.loadtxt(stat_prefix + ".%s.txt" % name) for name in ["log_priors", "mean", "var"]]
+
+
+def test_analyze_data_num_workers():
+  rnd = numpy.random.RandomState(42)
+  seqs = []
+  for n in [5, 3, 7, 1, 4, 6]:
+    seqs.append({"data": rnd.normal(size=(n, 3)).astype("float32"), "classes": rnd.randint(0, 4, size=(n,))})
+  dataset = StaticDataset(data=seqs, output_dim={"classes": [4, 1]})
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    log_priors, mean, std = _analyze_data(dataset, num_workers=1, stat_prefix=os.path.join(tmp_dir, "single"))
+    all_data = numpy.concatenate([seq["data"] for seq in seqs], axis=0).astype("float64")
+    all_classes = numpy.concatenate([seq["classes"] for seq in seqs], axis=0)
+    numpy.testing.assert_allclose(mean, numpy.mean(all_data, axis=0))
+    numpy.testing.assert_allclose(std, numpy.std(all_data, axis=0))
+    numpy.testing.assert_allclose(
+      log_priors, numpy.log(numpy.bincount(all_classes, minlength=4) / float(all_classes.shape[0])))
+    parallel_stats = _analyze_data(dataset, num_workers=3, stat_prefix=os.path.join(tmp_dir, "parallel"))
+    for single, parallel in zip([log_priors, mean, std], parallel_stats):
+      numpy.testing.assert_allclose(parallel, single)
+  finally:
+    shutil.rmtree(tmp_dir)